@@ -0,0 +1,6 @@
+"""Benchmarks of transact and query hot paths, over synthetic datoms, against a (local) MongoDB server.
+
+Run e.g. `python -m benchmarks --uri mongodb://localhost:27017 --out results.json`, and compare two runs with
+`python -m benchmarks.compare before.json after.json`. The benchmark database (by default, "maggtomic_bench") is
+dropped and recreated for each run.
+"""
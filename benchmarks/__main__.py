@@ -0,0 +1,81 @@
+"""Run the benchmarks, and write their results as JSON (see `benchmarks`)."""
+import argparse
+import json
+import platform
+import sys
+from datetime import datetime, timezone
+
+import pymongo
+
+from maggtomic import Database, connection_settings, create_collection
+
+from benchmarks.suites import run
+
+
+def _ints(s):
+    return [int(n) for n in s.split(",")]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description=__doc__)
+    parser.add_argument("--uri", help="MongoDB URI (default: from the environment)")
+    parser.add_argument("--db", default="maggtomic_bench", help="database, dropped")
+    parser.add_argument("--collection", default="bench", help="datom collection")
+    parser.add_argument("--entities", type=int, default=1000)
+    parser.add_argument("--attributes", type=int, default=20, help="per entity")
+    parser.add_argument("--trees", type=int, default=100)
+    parser.add_argument("--depth", type=int, default=5, help="of binary trees")
+    parser.add_argument("--chains", type=int, default=200)
+    parser.add_argument(
+        "--links", type=_ints, default=[1, 2, 4, 8], help="per chain query"
+    )
+    parser.add_argument("--star", type=_ints, default=[1, 4, 10], help="per star query")
+    parser.add_argument("--engines", default="python,pipeline")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="file for JSON results (default: stdout)")
+    args = parser.parse_args(argv)
+    args.engines = args.engines.split(",")
+    if max(args.star) > args.attributes:
+        parser.error("--star may not exceed --attributes")
+    return args
+
+
+def _version(module_name):
+    try:
+        import pkg_resources
+
+        return pkg_resources.get_distribution(module_name).version
+    except Exception:
+        return None
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    database = Database(args.uri or connection_settings()[0], args.db)
+    database.client.drop_database(args.db)
+    coll = create_collection(args.collection, drop_guard=False, database=database)
+    started = datetime.now(tz=timezone.utc)
+    results = run(coll, args)
+    report = {
+        "meta": {
+            "started": started.isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "maggtomic": _version("maggtomic"),
+            "pymongo": pymongo.version,
+            "mongodb": database.command("buildInfo")["version"],
+        },
+        "params": {k: v for k, v in vars(args).items() if k not in ("uri", "out")},
+        "results": results,
+    }
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+    database.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+"""Compare two benchmark runs, by the ratio of median seconds of each result that both have.
+
+Run e.g. `python -m benchmarks.compare before.json after.json --threshold 1.2`, which exits non-zero if any result
+is slower by more than that ratio.
+"""
+import argparse
+import json
+import sys
+
+
+def ratios(before: dict, after: dict) -> dict:
+    """For each result name in both runs, the ratio of its median seconds after to before."""
+    medians = {r["name"]: r["seconds"]["median"] for r in before["results"]}
+    return {
+        r["name"]: r["seconds"]["median"] / medians[r["name"]]
+        for r in after["results"]
+        if medians.get(r["name"])
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.compare")
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, help="ratio that fails, e.g. 1.2")
+    args = parser.parse_args(argv)
+    with open(args.before) as f1, open(args.after) as f2:
+        before, after = json.load(f1), json.load(f2)
+    if before["params"] != after["params"]:
+        print("warning: runs have different params", file=sys.stderr)
+    regressed = []
+    for name, ratio in ratios(before, after).items():
+        flag = ""
+        if args.threshold and ratio > args.threshold:
+            regressed.append(name)
+            flag = " REGRESSED"
+        print(f"{ratio:7.2f}x  {name}{flag}")
+    return 1 if regressed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
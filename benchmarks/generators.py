@@ -0,0 +1,91 @@
+"""Synthetic user statements of configurable scale and shape, and queries over them.
+
+Generators are deterministic given a seed, so that runs with the same parameters transact the same datoms.
+"""
+import random
+from datetime import datetime, timedelta, timezone
+
+PREFIXES = {"bench": "http://example.org/maggtomic/bench/"}
+
+EPOCH = datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+
+def _literal(rng: random.Random, j: int):
+    """A literal of one of several BSON types, by attribute index j, so that each attribute has one type."""
+    kind = j % 4
+    if kind == 0:
+        return rng.randrange(1 << 31)
+    elif kind == 1:
+        return rng.random()
+    elif kind == 2:
+        return f"value {rng.randrange(1 << 31):x}"
+    return EPOCH + timedelta(seconds=rng.randrange(1 << 25))
+
+
+def wide_entities(n_entities: int, n_attributes: int, seed=0, round_=0):
+    """Statements giving each of n_entities a literal value for each of n_attributes.
+
+    Each round_ is of new entities, so that each entity has one value per attribute, e.g. to build up history for
+    `as_of`.
+    """
+    rng = random.Random(f"wide:{seed}:{round_}")
+    for i in range(n_entities):
+        for j in range(n_attributes):
+            yield f"bench:w{round_}_{i}", f"bench:attr{j}", _literal(rng, j)
+
+
+def trees(n_trees: int, depth: int, breadth=2, seed=0):
+    """Statements nesting entities into n_trees trees of depth levels below the root (via bench:part), each of a
+    breadth of parts, and giving each entity a literal (via bench:value).
+    """
+    rng = random.Random(f"tree:{seed}")
+
+    def node(path, level):
+        yield path, "bench:value", _literal(rng, level)
+        if level < depth:
+            for k in range(breadth):
+                yield path, "bench:part", f"{path}.{k}"
+                yield from node(f"{path}.{k}", level + 1)
+
+    for i in range(n_trees):
+        yield from node(f"bench:t{i}", 0)
+
+
+def tree_size(depth: int, breadth=2) -> int:
+    """Number of entities per tree (see `trees`)."""
+    return sum(breadth**level for level in range(depth + 1))
+
+
+def chains(n_chains: int, length: int, seed=0):
+    """Statements linking entities into n_chains chains of length links (via bench:next), each end labeled."""
+    rng = random.Random(f"chain:{seed}")
+    for i in range(n_chains):
+        for k in range(length):
+            yield f"bench:c{i}_{k}", "bench:next", f"bench:c{i}_{k + 1}"
+        yield f"bench:c{i}_{length}", "bench:label", f"end {rng.randrange(1 << 31):x}"
+
+
+def chain_query(n_links: int) -> dict:
+    """A query joining n_links bench:next conditions, then the end's label: a path of n_links + 2 conditions."""
+    where = [[f"?x{k}", "bench:next", f"?x{k + 1}"] for k in range(n_links)]
+    where += [[f"?x{n_links}", "bench:label", "?l"], ["?l", "qudt:value", "?label"]]
+    return {"prefixes": PREFIXES, "select": ["?x0", "?label"], "where": where}
+
+
+def star_query(n_attributes: int) -> dict:
+    """A query for each entity's values of n_attributes attributes: a star of 2 * n_attributes conditions."""
+    where = []
+    for j in range(n_attributes):
+        where += [
+            ["?e", f"bench:attr{j}", f"?s{j}"],
+            [f"?s{j}", "qudt:value", f"?v{j}"],
+        ]
+    select = ["?e"] + [f"?v{j}" for j in range(n_attributes)]
+    return {"prefixes": PREFIXES, "select": select, "where": where}
+
+
+def tree_query(depth: int) -> dict:
+    """A query for the values of each tree's entities at depth, a path of depth + 2 conditions fanning out per level."""
+    where = [[f"?n{k}", "bench:part", f"?n{k + 1}"] for k in range(depth)]
+    where += [[f"?n{depth}", "bench:value", "?s"], ["?s", "qudt:value", "?value"]]
+    return {"prefixes": PREFIXES, "select": ["?n0", "?value"], "where": where}
@@ -0,0 +1,186 @@
+"""Benchmarks of transact, `_oids_for`, query, and as_of, each a function of a datom collection and run parameters.
+
+Each benchmark returns results, i.e. dicts of a name, a summary of seconds per run, and (for throughput) the number
+of items per run. Benchmarks run in order, and later ones query what earlier ones transacted.
+"""
+import statistics
+import time
+from datetime import datetime, timezone
+
+from maggtomic import (
+    _oids_cache,
+    _oids_for,
+    as_of,
+    assert_,
+    current,
+    prefix_expand,
+    transact,
+    transact_bulk,
+)
+from maggtomic.query import query
+
+from benchmarks.generators import (
+    PREFIXES,
+    chain_query,
+    chains,
+    star_query,
+    tree_query,
+    tree_size,
+    trees,
+    wide_entities,
+)
+
+
+def summary(seconds: list) -> dict:
+    return {
+        "n": len(seconds),
+        "min": min(seconds),
+        "median": statistics.median(seconds),
+        "mean": statistics.mean(seconds),
+        "max": max(seconds),
+    }
+
+
+def result(name: str, seconds: list, items=None, **info) -> dict:
+    out = {"name": name, "seconds": summary(seconds)}
+    if items is not None:
+        out["items"] = items
+        out["items_per_second"] = items / out["seconds"]["median"]
+    out.update(info)
+    return out
+
+
+def timed(fn, *args, **kwargs):
+    """The result of calling fn, and the seconds that it took."""
+    start = time.perf_counter()
+    out = fn(*args, **kwargs)
+    return out, time.perf_counter() - start
+
+
+def bench_transact(coll, params, tx_times: list) -> list:
+    """Transact wide entities via assert_ (one round per repeat), then trees and chains via transact_bulk.
+
+    Appends the time after each round of wide entities to tx_times, i.e. bases for `bench_as_of`.
+    """
+    seconds = []
+    for round_ in range(params.repeat):
+        statements = list(
+            wide_entities(params.entities, params.attributes, params.seed, round_)
+        )
+        _, s = timed(
+            transact,
+            [assert_(st, use_prefixes=PREFIXES, coll=coll) for st in statements],
+            coll=coll,
+        )
+        seconds.append(s)
+        tx_times.append(datetime.now(tz=timezone.utc))
+    n_wide = params.entities * params.attributes
+    results = [result("transact/assert_/wide", seconds, items=n_wide)]
+    loads = [
+        (
+            "transact_bulk/wide/interned",
+            wide_entities(
+                params.entities, params.attributes, params.seed, params.repeat
+            ),
+            n_wide,
+            True,
+        ),
+        (
+            "transact_bulk/trees",
+            trees(params.trees, params.depth, seed=params.seed),
+            params.trees * (2 * tree_size(params.depth) - 1),
+            False,
+        ),
+        (
+            "transact_bulk/chains",
+            chains(params.chains, max(params.links) + 1, seed=params.seed),
+            params.chains * (max(params.links) + 2),
+            False,
+        ),
+    ]
+    for name, statements, n, intern_literals in loads:
+        _, s = timed(
+            transact_bulk,
+            statements,
+            use_prefixes=PREFIXES,
+            coll=coll,
+            intern_literals=intern_literals,
+        )
+        results.append(result(name, [s], items=n))
+    return results
+
+
+def bench_oids_for(coll, params) -> list:
+    """Resolve the URIs of all wide entities and their attributes, with a cold and then a warm ref cache."""
+    curies = [f"bench:w0_{i}" for i in range(params.entities)]
+    curies += [f"bench:attr{j}" for j in range(params.attributes)]
+    uris = prefix_expand(curies, use_prefixes=PREFIXES)
+    _oids_cache.reset_ns(coll.full_name)
+    _, cold = timed(_oids_for, uris, coll=coll, create=False)
+    before = _oids_cache.stats(coll.full_name)["oids"]
+    warm = [
+        timed(_oids_for, uris, coll=coll, create=False)[1] for _ in range(params.repeat)
+    ]
+    after = _oids_cache.stats(coll.full_name)["oids"]
+    return [
+        result("_oids_for/cold", [cold], items=len(uris)),
+        result(
+            "_oids_for/warm",
+            warm,
+            items=len(uris),
+            cache_hits=after["hits"] - before["hits"],
+            cache_misses=after["misses"] - before["misses"],
+        ),
+    ]
+
+
+def _query_results(name, query_spec, coll_hof, repeat, engine) -> dict:
+    """Time the first run of query_spec (i.e. with planning and uncached refs) apart from the rest."""
+    rows, first = timed(query, query_spec, coll_hof=coll_hof, engine=engine)
+    seconds = [
+        timed(query, query_spec, coll_hof=coll_hof, engine=engine)[1]
+        for _ in range(repeat)
+    ]
+    return result(name, seconds, first_seconds=first, rows=len(rows))
+
+
+def bench_query(coll, params) -> list:
+    """Query latency per join shape: chains of links, stars of attributes, and trees of levels."""
+    shapes = [(f"chain-{n}", chain_query(n)) for n in params.links]
+    shapes += [(f"star-{n}", star_query(n)) for n in params.star]
+    shapes += [(f"tree-{n}", tree_query(n)) for n in range(params.depth + 1)]
+    coll_hof = current(coll)
+    return [
+        _query_results(f"query/{shape}/{engine}", spec, coll_hof, params.repeat, engine)
+        for engine in params.engines
+        for shape, spec in shapes
+    ]
+
+
+def bench_as_of(coll, params, tx_times: list) -> list:
+    """Resolve as_of each round of wide entities, and query each basis."""
+    results = []
+    spec = star_query(min(params.star))
+    for round_, t in enumerate(tx_times):
+        seconds = [timed(as_of, coll, t)[1] for _ in range(params.repeat)]
+        results.append(result(f"as_of/round-{round_}", seconds))
+        results.append(
+            _query_results(
+                f"query/as_of/round-{round_}/star-{min(params.star)}",
+                spec,
+                as_of(coll, t),
+                params.repeat,
+                "python",
+            )
+        )
+    return results
+
+
+def run(coll, params) -> list:
+    """Run all benchmarks against datom collection coll, which should be new."""
+    tx_times = []
+    results = bench_transact(coll, params, tx_times)
+    results += bench_oids_for(coll, params)
+    results += bench_query(coll, params)
+    results += bench_as_of(coll, params, tx_times)
+    return results
@@ -1,9 +1,15 @@
+import bisect
+import hashlib
+import itertools
 import os
 import re
+import threading
+from collections import OrderedDict
 from collections.abc import Iterable
 from datetime import datetime, timezone
 from typing import List, Tuple, Any, Union
 
+import bson
 from bson import ObjectId
 from dotenv import load_dotenv
 from pydash import py_
@@ -11,29 +17,108 @@ from pymongo import (
     MongoClient,
     ASCENDING as ASC,
     DESCENDING as DESC,
+    DeleteOne,
     IndexModel,
+    ReadPreference,
+    UpdateOne,
     WriteConcern,
 )
 from pymongo.collection import Collection
 from pymongo.errors import WriteError
-from toolz import assoc_in, get_in
+from toolz import merge, partition_all
 
-from maggtomic.util import generate_id, decode_id
+from maggtomic.profile import Profile, command_counter, phase, profiling
+from maggtomic.util import generate_id, decode_id, encode_id
 
+# Settings, here and in modules that import this one, are read from the environment, including any `.env` file.
 load_dotenv()
-MONGO_CONNECTION_URI = os.getenv("MONGO_CONNECTION_URI")
-if MONGO_CONNECTION_URI is None:
-    MONGO_HOST = os.getenv("MONGO_HOST", "localhost")
-    MONGO_PORT = int(os.getenv("MONGO_PORT", 27017))
-    MONGO_CONNECTION_URI = f"mongodb://{MONGO_HOST}:{MONGO_PORT}"
-MONGO_DBNAME = os.getenv("MONGO_DBNAME")
 
-client = MongoClient(MONGO_CONNECTION_URI)
-db = client[MONGO_DBNAME]
+
+def connection_settings() -> Tuple[str, str]:
+    """The MongoDB connection URI and database name from the environment, including any `.env` file (loaded on import).
+
+    The URI is MONGO_CONNECTION_URI, or else is built from MONGO_HOST and MONGO_PORT. Client options, e.g. maxPoolSize,
+    serverSelectionTimeoutMS, or readPreference, may be given as URI query parameters.
+    """
+    uri = os.getenv("MONGO_CONNECTION_URI")
+    if uri is None:
+        host = os.getenv("MONGO_HOST", "localhost")
+        port = int(os.getenv("MONGO_PORT", 27017))
+        uri = f"mongodb://{host}:{port}"
+    return uri, os.getenv("MONGO_DBNAME")
+
+
+class Database:
+    """A MongoDB database whose client is created on first use rather than on import.
+
+    Attributes and items not of this class are those of the (pymongo) database, e.g. `db.main` is its "main" collection.
+    The URI and database name default to those of `connection_settings`, and `client_options` (e.g. maxPoolSize,
+    socketTimeoutMS, or read_preference, to route reads to secondaries) are passed to `client_class`.
+
+    A client is not fork-safe, so a process forked after the client is created, e.g. by a process pool, creates its own
+    on first use. Reads that writes depend on, e.g. of the current state, are always made from the primary (see
+    `_primary`). Clients count commands into active profiles (see `maggtomic.profile`).
+    """
+
+    def __init__(self, uri=None, name=None, client_class=MongoClient, **client_options):
+        self.uri = uri
+        self.dbname = name
+        self.client_class = client_class
+        self.client_options = client_options
+        self._client = None
+        self._pid = None
+
+    def configure(self, uri=None, name=None, client_class=None, **client_options):
+        """Change settings, closing any client, so that the next use connects with the new settings."""
+        self.close()
+        self.uri = uri or self.uri
+        self.dbname = name or self.dbname
+        self.client_class = client_class or self.client_class
+        self.client_options.update(client_options)
+
+    @property
+    def client(self):
+        if self._client is None or self._pid != os.getpid():
+            uri, name = connection_settings()
+            self.uri, self.dbname = self.uri or uri, self.dbname or name
+            options = dict(self.client_options)
+            options["event_listeners"] = [command_counter] + list(
+                options.get("event_listeners", ())
+            )
+            self._client = self.client_class(self.uri, **options)
+            self._pid = os.getpid()
+        return self._client
+
+    @property
+    def database(self):
+        """The (pymongo) database."""
+        return self.client[self.dbname]
+
+    def close(self):
+        """Close the client of this process, if any. A client inherited via fork is dropped without closing it."""
+        if self._client is not None and self._pid == os.getpid():
+            self._client.close()
+        self._client = None
+        self._pid = None
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.database, name)
+
+    def __getitem__(self, name):
+        return self.database[name]
+
+
+db = Database()
 
 # fields allowed in underlying MongoDB collection
 E, A, V, T, O = "e", "a", "v", "t", "o"
 
+# Optional shard field, which partitions the datoms of a sharded collection (see `create_collection`), e.g. by a core
+# entity such as a study. Datoms with no shard (null) are shared by all shards, e.g. the rdf:resource of every entity.
+S = "s"
+
 INDEX_MODELS = [
     IndexModel(
         [(E, ASC), (A, ASC), (V, ASC), (T, DESC), (O, ASC)], name="EAVT (row/doc)"
@@ -52,6 +137,103 @@ INDEX_MODELS = [
     IndexModel([(T, DESC)], name="T (history)"),
 ]
 
+# Indexes for sharded datom collections: those of INDEX_MODELS, but led by the shard field, so that reads within a shard
+# are single-partition lookups. AVET is kept unprefixed for the lookups of refs and local IDs across all shards.
+SHARDED_INDEX_MODELS = [
+    IndexModel(
+        [(S, ASC), (E, ASC), (A, ASC), (V, ASC), (T, DESC), (O, ASC)],
+        name="SEAVT (row/doc)",
+    ),
+    IndexModel(
+        [(S, ASC), (A, ASC), (E, ASC), (V, ASC), (T, DESC), (O, ASC)],
+        name="SAEVT (column)",
+    ),
+    IndexModel(
+        [(S, ASC), (A, ASC), (V, ASC), (E, ASC), (T, DESC), (O, ASC)],
+        name="SAVET (key-val)",
+    ),
+    IndexModel(
+        [(S, ASC), (V, ASC), (A, ASC), (E, ASC), (T, DESC), (O, ASC)],
+        name="SVAET (graph)",
+        partialFilterExpression={V: {"$type": "objectId"}},
+    ),
+    IndexModel(
+        [(A, ASC), (V, ASC), (E, ASC), (T, DESC), (O, ASC)], name="AVET (key-val)"
+    ),
+    IndexModel([(T, DESC)], name="T (history)"),
+]
+
+# Indexes for the current-state collection that accompanies each datom collection (see `current_collection`).
+# Each (e, a, v) is stored at most once, with the transaction of its latest assertion.
+CURRENT_INDEX_MODELS = [
+    IndexModel([(E, ASC), (A, ASC), (V, ASC)], name="EAV (row/doc)", unique=True),
+    IndexModel([(A, ASC), (E, ASC), (V, ASC)], name="AEV (column)"),
+    IndexModel([(A, ASC), (V, ASC), (E, ASC)], name="AVE (key-val)"),
+    IndexModel(
+        [(V, ASC), (A, ASC), (E, ASC)],
+        name="VAE (graph)",
+        partialFilterExpression={V: {"$type": "objectId"}},
+    ),
+]
+
+# Indexes for the current-state collection of a sharded datom collection. Each (s, e, a, v) is stored at most once.
+# Those of CURRENT_INDEX_MODELS are kept too (with EAV not unique, as an (e, a, v) may be in many shards), for reads of
+# the current state across all shards (see `current`).
+SHARDED_CURRENT_INDEX_MODELS = [
+    IndexModel(
+        [(S, ASC), (E, ASC), (A, ASC), (V, ASC)], name="SEAV (row/doc)", unique=True
+    ),
+    IndexModel([(S, ASC), (A, ASC), (E, ASC), (V, ASC)], name="SAEV (column)"),
+    IndexModel([(S, ASC), (A, ASC), (V, ASC), (E, ASC)], name="SAVE (key-val)"),
+    IndexModel(
+        [(S, ASC), (V, ASC), (A, ASC), (E, ASC)],
+        name="SVAE (graph)",
+        partialFilterExpression={V: {"$type": "objectId"}},
+    ),
+    IndexModel([(E, ASC), (A, ASC), (V, ASC)], name="EAV (row/doc)"),
+    IndexModel([(A, ASC), (E, ASC), (V, ASC)], name="AEV (column)"),
+    IndexModel([(A, ASC), (V, ASC), (E, ASC)], name="AVE (key-val)"),
+    IndexModel(
+        [(V, ASC), (A, ASC), (E, ASC)],
+        name="VAE (graph)",
+        partialFilterExpression={V: {"$type": "objectId"}},
+    ),
+]
+
+# Names of the indexes of a datom collection (see INDEX_MODELS) and of its current-state collection (see
+# CURRENT_INDEX_MODELS), keyed by the order of the datom fields that they lead with.
+INDEX_NAMES = {
+    "EAV": "EAVT (row/doc)",
+    "AEV": "AEVT (column)",
+    "AVE": "AVET (key-val)",
+    "VAE": "VAET (graph)",
+    "T": "T (history)",
+}
+CURRENT_INDEX_NAMES = {
+    "EAV": "EAV (row/doc)",
+    "AEV": "AEV (column)",
+    "AVE": "AVE (key-val)",
+    "VAE": "VAE (graph)",
+}
+
+# Names of the indexes for reads within a shard of a sharded datom collection, and of its current-state collection.
+SHARDED_INDEX_NAMES = {
+    "EAV": "SEAVT (row/doc)",
+    "AEV": "SAEVT (column)",
+    "AVE": "SAVET (key-val)",
+    "VAE": "SVAET (graph)",
+    "T": "T (history)",
+}
+SHARDED_CURRENT_INDEX_NAMES = {
+    "EAV": "SEAV (row/doc)",
+    "AEV": "SAEV (column)",
+    "AVE": "SAVE (key-val)",
+    "VAE": "SVAE (graph)",
+}
+
+# Default number of documents per batch for datom cursors, if nonzero. Otherwise, the server default applies.
+CURSOR_BATCH_SIZE = int(os.getenv("MAGGTOMIC_CURSOR_BATCH_SIZE", 0))
+
 PREFIXES = {
     "qudt": "http://qudt.org/schema/qudt#",
     "rdf": "http://www.w3.org/1999/02/22-rdf-syntax-ns#",
@@ -94,22 +276,159 @@ OID_QUDT_VALUE = ObjectId.from_datetime(
 )
 
 
-def prefix_expand(items: Iterable, use_prefixes=None) -> list:
-    prefix = PREFIXES.copy()
-    if use_prefixes is not None:
-        prefix.update(use_prefixes)
-    out = []
-    for item in items:
-        if isinstance(item, str):
+class LRUCache:
+    """Bounded mapping that evicts its least-recently-used entry. Counts hits and misses.
+
+    Safe to share among threads, e.g. those that fetch datoms concurrently (see `maggtomic.query.fetch_concurrently`).
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._c = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._c)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                val = self._c[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._c.move_to_end(key)
+            self.hits += 1
+            return val
+
+    def set(self, key, val):
+        with self._lock:
+            self._c[key] = val
+            self._c.move_to_end(key)
+            if len(self._c) > self.maxsize:
+                self._c.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._c.clear()
+
+
+# Maximum number of expansions of compact URIs cached by each PrefixRegistry.
+PREFIX_EXPANSIONS_CACHE_MAXSIZE = int(
+    os.getenv("MAGGTOMIC_PREFIX_EXPANSIONS_CACHE_MAXSIZE", 100000)
+)
+
+# Key, in a node of a PrefixRegistry's trie, of the prefix whose namespace ends at that node.
+_PREFIX_END = ""
+
+
+class PrefixRegistry:
+    """Prefixes (a map of each prefix to its namespace, i.e. the URI that it abbreviates), compiled.
+
+    Compaction finds the longest namespace that a URI starts with by walking a trie of namespaces, one node per
+    character, so it costs at most the length of the longest namespace however many prefixes there are. Of prefixes
+    with the same namespace, the first one wins. Expansions of compact URIs are cached.
+    """
+
+    def __init__(self, prefixes: dict):
+        self.prefixes = dict(prefixes)
+        self._trie = {}
+        for p, ns in self.prefixes.items():
+            node = self._trie
+            for char in ns:
+                node = node.setdefault(char, {})
+            node.setdefault(_PREFIX_END, p)
+        self._expansions = LRUCache(PREFIX_EXPANSIONS_CACHE_MAXSIZE)
+
+    def expand(self, item):
+        if not isinstance(item, str):
+            return item
+        expanded = self._expansions.get(item)
+        if expanded is None:
             components = item.split(":", 1)
             if len(components) == 2 and not components[1].startswith("/"):
                 pfx, local_name = components
-                out.append(f'{prefix.get(pfx, pfx+":")}{local_name}')
+                expanded = f'{self.prefixes.get(pfx, pfx+":")}{local_name}'
             else:
-                out.append(item)
-        else:
-            out.append(item)
-    return out
+                expanded = item
+            self._expansions.set(item, expanded)
+        return expanded
+
+    def compact(self, uri):
+        if not (isinstance(uri, str) and re.match(URI_BEGINNING_PATTERN, uri)):
+            return uri
+        node, match = self._trie, None
+        for i, char in enumerate(uri):
+            node = node.get(char)
+            if node is None:
+                break
+            if _PREFIX_END in node:
+                match = (node[_PREFIX_END], i + 1)
+        if match is None:
+            return uri
+        p, end = match
+        return f"{p}:{uri[end:]}"
+
+
+# Maximum number of PrefixRegistry objects cached, i.e. of distinct `use_prefixes` in use at a time.
+PREFIX_REGISTRIES_MAXSIZE = 100
+
+_prefix_registries = LRUCache(PREFIX_REGISTRIES_MAXSIZE)
+
+
+def prefix_registry(use_prefixes=None) -> PrefixRegistry:
+    """The PrefixRegistry for PREFIXES updated with use_prefixes, compiled once per distinct use_prefixes.
+
+    To change PREFIXES, use `register_prefixes`, so that compiled registries are refreshed.
+    """
+    key = frozenset(use_prefixes.items()) if use_prefixes else None
+    registry = _prefix_registries.get(key)
+    if registry is None:
+        prefixes = PREFIXES.copy()
+        if use_prefixes:
+            prefixes.update(use_prefixes)
+        registry = PrefixRegistry(prefixes)
+        _prefix_registries.set(key, registry)
+    return registry
+
+
+def register_prefixes(prefixes: dict):
+    """Add prefixes to (or change them in) PREFIXES, for use by every expansion and compaction."""
+    PREFIXES.update(prefixes)
+    _prefix_registries.clear()
+
+
+def prefixes_collection(coll: Collection) -> Collection:
+    """The collection of prefixes stored for datom collection coll, as documents {"_id": prefix, "ns": namespace}."""
+    return coll.database[f"{coll.name}.prefixes"]
+
+
+def save_prefixes(prefixes: dict, coll: Collection = None):
+    """Store prefixes for coll (see `prefixes_collection`), and register them (see `register_prefixes`)."""
+    coll = coll if coll is not None else db.main
+    if prefixes:
+        prefixes_collection(coll).bulk_write(
+            [
+                UpdateOne({"_id": p}, {"$set": {"ns": ns}}, upsert=True)
+                for p, ns in prefixes.items()
+            ]
+        )
+    register_prefixes(prefixes)
+
+
+def load_prefixes(coll: Collection = None) -> dict:
+    """Register the prefixes stored for coll (see `save_prefixes`), and return them."""
+    coll = coll if coll is not None else db.main
+    prefixes = {d["_id"]: d["ns"] for d in prefixes_collection(coll).find()}
+    register_prefixes(prefixes)
+    return prefixes
+
+
+def prefix_expand(items: Iterable, use_prefixes=None) -> list:
+    expand = prefix_registry(use_prefixes).expand
+    return [expand(item) for item in items]
 
 
 CORE_ATTRIBUTES = {
@@ -121,35 +440,110 @@ LITERAL_VALUED_ATTRIBUTES = frozenset(
 )
 
 
-class NSCache:
-    """Cache partitioned by namespace (NS)."""
+# Maximum number of entries, per direction, of each namespace of the ref <-> ObjectId cache.
+OIDS_CACHE_MAXSIZE = int(os.getenv("MAGGTOMIC_OIDS_CACHE_MAXSIZE", 100000))
 
-    def __init__(self):
-        self._c = {}
+
+class RefCache:
+    """Bidirectional cache of refs and ObjectIds, partitioned by namespace (NS), i.e. by collection full name.
+
+    A ref is a URI (via rdf:resource) or a blank-node label for a local ID ("_:" followed by the encoded vaem:id). Each
+    direction of each namespace is an LRUCache of at most `maxsize` entries.
+    """
+
+    def __init__(self, maxsize=OIDS_CACHE_MAXSIZE):
+        self.maxsize = maxsize
+        self._oids = {}
+        self._refs = {}
+        self._epochs = {}
+        self._lock = threading.Lock()
 
     def reset_ns(self, ns):
-        self._c = assoc_in(self._c, [ns], {})
+        with self._lock:
+            self._reset_ns(ns)
+
+    def _reset_ns(self, ns):
+        self._oids[ns] = LRUCache(self.maxsize)
+        self._refs[ns] = LRUCache(self.maxsize)
+        self._epochs[ns] = self._epochs.get(ns, 0) + 1
+
+    def epoch(self, ns):
+        """Number of times namespace ns has been reset. Anything derived from its cached ObjectIds can key on this."""
+        return self._epochs.get(ns, 0)
+
+    def _ns(self, ns):
+        if ns not in self._oids:
+            with self._lock:
+                if ns not in self._oids:
+                    self._reset_ns(ns)
+        return self._oids[ns], self._refs[ns]
 
     def get(self, ns, key):
-        return get_in(self._c, [ns, key])
+        """ObjectId for ref `key`, or None."""
+        return self._ns(ns)[0].get(key)
 
-    def ns(self, ns):
-        return get_in(self._c, [ns], {})
+    def get_ref(self, ns, oid):
+        """Ref for ObjectId `oid`, or None."""
+        return self._ns(ns)[1].get(oid)
 
     def set(self, ns, key, val):
-        self._c = assoc_in(self._c, [ns, key], val)
+        """Cache ref `key` for ObjectId `val`, in both directions."""
+        oids, refs = self._ns(ns)
+        oids.set(key, val)
+        refs.set(val, key)
+
+    def set_ref(self, ns, oid, ref):
+        """Cache ref for ObjectId `oid`, in the ObjectId-to-ref direction only."""
+        self._ns(ns)[1].set(oid, ref)
+
+    def stats(self, ns):
+        oids, refs = self._ns(ns)
+        return {
+            direction: {"size": len(c), "hits": c.hits, "misses": c.misses}
+            for direction, c in (("oids", oids), ("refs", refs))
+        }
 
 
-_oids_cache = NSCache()
+_oids_cache = RefCache()
 
 
-def create_collection(name="main", drop_guard=True):
-    if drop_guard and name in db.list_collection_names():
+def current_collection(coll: Collection) -> Collection:
+    """The current-state collection for datom collection coll.
+
+    It holds every (e, a, v) asserted and not since retracted, i.e. the state of coll as of its latest transaction, and
+    is maintained incrementally by `_transact_raw`.
+    """
+    return coll.database[f"{coll.name}.current"]
+
+
+def _primary(coll: Collection) -> Collection:
+    """Coll, reading from the primary, for reads that writes depend on, which must see all prior writes."""
+    if coll.read_preference == ReadPreference.PRIMARY:
+        return coll
+    return coll.with_options(read_preference=ReadPreference.PRIMARY)
+
+
+def create_collection(name="main", drop_guard=True, sharded=False, database=None):
+    """Create datom collection `name` in database (by default, `db`), and its current-state collection.
+
+    If `sharded`, datoms may be transacted to shards (see `transact`), and are indexed by shard first (see
+    SHARDED_INDEX_MODELS), so that reads within a shard (e.g. via `current` or `as_of`) touch only that partition.
+    Reads of the current state across all shards are indexed too (see SHARDED_CURRENT_INDEX_MODELS), but reads of
+    history across all shards (e.g. via `as_of` or `since` with no shard) are served only by the AVET and T indexes.
+    """
+    database = database if database is not None else db
+    if drop_guard and name in database.list_collection_names():
         raise ValueError(f"collection `{name}` already exists in db.")
     else:
-        db.drop_collection(name)
-        _oids_cache.reset_ns(name)
-    collection = db.create_collection(
+        database.drop_collection(name)
+        database.drop_collection(f"{name}.current")
+        database.drop_collection(f"{name}.prefixes")
+        _index_names.pop(f"{database.name}.{name}", None)
+        _index_names.pop(f"{database.name}.{name}.current", None)
+        _oids_cache.reset_ns(f"{database.name}.{name}")
+        _id_pool.reset_ns(f"{database.name}.{name}")
+        _tx_times.reset_ns(f"{database.name}.{name}")
+    collection = database.create_collection(
         name,
         write_concern=WriteConcern(w=1, j=True),
         # TODO schema switch s.t. if attribute not in {objectIdFor(a) for a in {:value,:id,:uriref}},
@@ -171,6 +565,7 @@ def create_collection(name="main", drop_guard=True):
                         "title": "operation",
                         "description": "assertion (true) or retraction (false)",
                     },
+                    "s": {"title": "shard"},
                 },
                 "additionalProperties": False,
             }
@@ -178,6 +573,9 @@ def create_collection(name="main", drop_guard=True):
         # higher compression than default "snappy", lower CPU usage than "zlib".
         storageEngine={"wiredTiger": {"configString": "block_compressor=zstd"}},
     )
+    _create_current_collection(collection, sharded=sharded)
+    # indexes leverage default prefix compression
+    collection.create_indexes(SHARDED_INDEX_MODELS if sharded else INDEX_MODELS)
     _assert_raw(
         [
             (OID_URIREF, OID_URIREF, CORE_ATTRIBUTES["rdf:resource"]),
@@ -191,11 +589,139 @@ def create_collection(name="main", drop_guard=True):
         ],
         coll=collection,
     )
-    # indexes leverage default prefix compression
-    collection.create_indexes(INDEX_MODELS)
     return collection
 
 
+def _create_current_collection(coll: Collection, sharded=False) -> Collection:
+    current_coll = coll.database.create_collection(
+        current_collection(coll).name,
+        write_concern=WriteConcern(w=1, j=True),
+        validator={
+            "$jsonSchema": {
+                "bsonType": "object",
+                "required": ["e", "a", "v", "t", "_id"],
+                "properties": {
+                    "_id": {"bsonType": "objectId"},
+                    "e": {"bsonType": "objectId", "title": "entity"},
+                    "a": {"bsonType": "objectId", "title": "attribute"},
+                    "v": {"title": "value"},
+                    "t": {"bsonType": "objectId", "title": "transaction"},
+                    "s": {"title": "shard"},
+                },
+                "additionalProperties": False,
+            }
+        },
+        storageEngine={"wiredTiger": {"configString": "block_compressor=zstd"}},
+    )
+    current_coll.create_indexes(
+        SHARDED_CURRENT_INDEX_MODELS if sharded else CURRENT_INDEX_MODELS
+    )
+    return current_coll
+
+
+def _resolved_stages(filter_: dict) -> list:
+    """Aggregation stages that resolve retractions among the datoms matching filter_.
+
+    For each (s, e, a, v), keeps only its latest operation (by transaction, then by order within the transaction), and
+    passes it on, with the transaction t, iff it is an assertion.
+    """
+    return [
+        {"$match": filter_},
+        {"$sort": {T: DESC, "_id": DESC}},
+        {
+            "$group": {
+                "_id": {S: f"${S}", E: f"${E}", A: f"${A}", V: f"${V}"},
+                T: {"$first": f"${T}"},
+                O: {"$first": f"${O}"},
+            }
+        },
+        {"$match": {O: True}},
+        {
+            "$project": {
+                "_id": 0,
+                S: f"$_id.{S}",
+                E: f"$_id.{E}",
+                A: f"$_id.{A}",
+                V: f"$_id.{V}",
+                T: 1,
+            }
+        },
+    ]
+
+
+_index_names = {}
+
+
+def _existing_index_names(coll: Collection) -> set:
+    """Names of the indexes of coll, fetched once per collection per process."""
+    if coll.full_name not in _index_names:
+        _index_names[coll.full_name] = set(coll.index_information())
+    return _index_names[coll.full_name]
+
+
+def _cursor_options(
+    coll: Collection, index_names: dict, index=None, batch_size=None, existing=None
+) -> dict:
+    """Hint and batch-size options for a cursor over coll.
+
+    `index` is a key of index_names, e.g. "AVE". It is hinted only if coll has that index, so that collections with
+    other indexes are still served, if less efficiently. The names of coll's indexes are `existing`, if given, or else
+    are fetched (see `_existing_index_names`).
+    """
+    options = {}
+    if index is not None:
+        if existing is None:
+            existing = _existing_index_names(coll)
+        if index_names[index] in existing:
+            options["hint"] = index_names[index]
+    batch_size = batch_size or CURSOR_BATCH_SIZE
+    if batch_size:
+        options["batch_size"] = batch_size
+    return options
+
+
+def _is_sharded(coll: Collection, existing=None) -> bool:
+    """Whether datom collection coll was created sharded (see `create_collection`), given its `existing` indexes."""
+    if existing is None:
+        existing = _existing_index_names(coll)
+    return SHARDED_INDEX_NAMES["EAV"] in existing
+
+
+def _shard_key(coll: Collection, shard=None, existing=None) -> dict:
+    """The shard field for datoms of coll in shard, i.e. none for a collection that is not sharded."""
+    if not _is_sharded(coll, existing=existing):
+        if shard is not None:
+            raise ValueError(
+                f"collection `{coll.name}` is not sharded (see `create_collection`)"
+            )
+        return {}
+    return {S: shard}
+
+
+def _shard_scope(
+    coll: Collection, shard, index_names: dict, sharded_index_names: dict, existing=None
+):
+    """Index names and basis to read the datoms of coll in shard and in no shard, or all of them if shard is None."""
+    if shard is None:
+        return index_names, {}
+    _shard_key(coll, shard, existing=existing)
+    return sharded_index_names, {S: {"$in": [shard, None]}}
+
+
+def rebuild_current(coll: Collection) -> Collection:
+    """Rebuild the current-state collection for coll by resolving retractions over coll's full history.
+
+    Use for collections that predate current-state collections, or to repair one.
+    """
+    if current_collection(coll).name not in coll.database.list_collection_names():
+        _create_current_collection(coll, sharded=_is_sharded(coll))
+    coll.aggregate(
+        _resolved_stages({}) + [{"$out": current_collection(coll).name}],
+        allowDiskUse=True,
+    )
+    return current_collection(coll)
+
+
 RawStatement = Tuple[ObjectId, ObjectId, Any]
 RawStatementOperation = Tuple[ObjectId, ObjectId, Any, bool]
 
@@ -209,54 +735,270 @@ def generate_id_unique(coll: Collection = None, **generate_id_kwargs) -> str:
     return eid
 
 
+def generate_ids_unique(
+    n: int, coll: Collection = None, **generate_id_kwargs
+) -> List[str]:
+    """Like generate_id_unique, but generates n distinct IDs, checking each round of candidates with one query."""
+    eids = {}
+    while len(eids) < n:
+        candidates = {}
+        for _ in range(n - len(eids)):
+            eid = generate_id(**generate_id_kwargs)
+            candidates[decode_id(eid)] = eid
+        taken = {
+            d[V]
+            for d in _primary(coll).find(
+                {A: OID_VAEM_ID, V: {"$in": list(candidates)}}, {"_id": 0, V: 1}
+            )
+        }
+        eids.update({k: v for k, v in candidates.items() if k not in taken})
+    return list(eids.values())
+
+
+# Number of IDs that a local ID pool draws at a time for a collection.
+ID_POOL_BLOCK_SIZE = 1000
+
+
+class IDPool:
+    """Local pools of unique IDs for entities, partitioned by namespace (NS), i.e. by collection full name.
+
+    IDs are drawn from a pool without a round-trip to the database. An exhausted pool is refilled with at least
+    `block_size` IDs via `generate_ids_unique`. As with generate_id_unique, uniqueness rests on the checked IDs not
+    being generated elsewhere before they are transacted, which is unlikely given the 2**40 possible IDs. Pools are
+    locked, so threads may share them, but not while a refill is generated.
+    """
+
+    def __init__(self, block_size=ID_POOL_BLOCK_SIZE):
+        self.block_size = block_size
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def reset_ns(self, ns):
+        with self._lock:
+            self._pools.pop(ns, None)
+
+    def take(self, n: int, coll: Collection = None) -> List[str]:
+        ns = coll.full_name
+        eids = self.pop(n, ns)
+        while eids is None:
+            self.add(ns, generate_ids_unique(self.shortfall(n, ns), coll=coll))
+            eids = self.pop(n, ns)
+        return eids
+
+    def shortfall(self, n: int, ns) -> int:
+        """Number of IDs to generate for the pool of ns before n can be taken, or 0 if none are needed."""
+        with self._lock:
+            available = len(self._pools.get(ns, ()))
+        return max(n - available, self.block_size) if available < n else 0
+
+    def add(self, ns, eids: List[str]):
+        with self._lock:
+            pool = self._pools.setdefault(ns, {})
+            for eid in eids:
+                pool.setdefault(decode_id(eid), eid)
+
+    def pop(self, n: int, ns) -> List[str]:
+        """Pop n IDs from the pool of ns, or None if it has fewer (see `shortfall`)."""
+        with self._lock:
+            pool = self._pools.setdefault(ns, {})
+            if len(pool) < n:
+                return None
+            return [pool.pop(k) for k in list(itertools.islice(pool, n))]
+
+
+_id_pool = IDPool()
+
+
 def _transact_raw(
-    raw_statement_operations: List[RawStatementOperation], coll: Collection = None
+    raw_statement_operations: List[RawStatementOperation],
+    coll: Collection = None,
+    ordered=True,
+    shard=None,
 ):
+    shard_key = _shard_key(coll, shard)
+    operations = _net_operations(raw_statement_operations)
+    with phase("lookup"):
+        current_keys = _current_keys(operations, coll, shard_key=shard_key)
+    operations = _effective_operations(operations, current_keys)
+    if not operations:
+        return []
+    docs = _transaction_docs(
+        operations, _id_pool.take(1, coll=coll)[0], shard_key=shard_key
+    )
+    with phase("insert"):
+        inserted_ids = coll.insert_many(
+            docs, ordered=ordered
+        ).inserted_ids  # raises InvalidOperation if write is unacknowledged
+    if len(inserted_ids) != len(docs):
+        raise WriteError("not all documents inserted for transaction")
+    with phase("current"):
+        _update_current(docs, coll=coll)
+    return inserted_ids
+
+
+# Maximum number of (e, a, v) clauses per query when checking which statements of a transaction are current.
+CURRENT_LOOKUP_CHUNK_SIZE = 1000
+
+
+def _datom_key(e, a, v) -> tuple:
+    """A hashable key for (e, a, v), with v as it round-trips through BSON, so that the key of a datom read back from
+    MongoDB equals that of the operation that transacted it, e.g. for a timezone-aware datetime.
+    """
+    if isinstance(v, datetime):
+        v = _bson_datetime(v)
+    try:
+        hash(v)
+    except TypeError:
+        v = bson.encode({V: v})
+    return e, a, v
+
+
+def _bson_datetime(dt: datetime) -> datetime:
+    """dt as read back from MongoDB: naive UTC (see `_utc`), to the millisecond."""
+    dt = _utc(dt).replace(tzinfo=None)
+    return dt.replace(microsecond=dt.microsecond // 1000 * 1000)
+
+
+def _net_operations(
+    raw_statement_operations: List[RawStatementOperation],
+) -> List[RawStatementOperation]:
+    """The last operation on each (e, a, v) among raw_statement_operations, as only it affects the current state."""
+    net = OrderedDict()
+    for (e, a, v, o) in raw_statement_operations:
+        key = _datom_key(e, a, v)
+        net.pop(key, None)
+        net[key] = (e, a, v, o)
+    return list(net.values())
+
+
+def _current_lookups(
+    operations: List[RawStatementOperation], shard_key: dict = None
+) -> List[dict]:
+    """Filters for the current-state datoms of operations, with at most CURRENT_LOOKUP_CHUNK_SIZE clauses each."""
+    return [
+        {"$or": [merge({E: e, A: a, V: v}, shard_key or {}) for (e, a, v, _) in chunk]}
+        for chunk in partition_all(CURRENT_LOOKUP_CHUNK_SIZE, operations)
+    ]
+
+
+def _current_index_names(shard_key: dict) -> dict:
+    return SHARDED_CURRENT_INDEX_NAMES if shard_key else CURRENT_INDEX_NAMES
+
+
+def _current_keys(
+    operations: List[RawStatementOperation], coll: Collection, shard_key: dict = None
+) -> set:
+    """Keys (see `_datom_key`) of the (e, a, v) of operations that are current in coll, with one query per chunk.
+
+    For a sharded collection, `shard_key` (see `_shard_key`) restricts them to those current in its shard.
+    """
+    current_coll = _primary(current_collection(coll))
+    options = _cursor_options(current_coll, _current_index_names(shard_key), "EAV")
+    return {
+        _datom_key(d[E], d[A], d[V])
+        for filter_ in _current_lookups(operations, shard_key=shard_key)
+        for d in current_coll.find(filter_, {"_id": 0, E: 1, A: 1, V: 1}, **options)
+    }
+
+
+def _effective_operations(
+    operations: List[RawStatementOperation], current_keys: set
+) -> List[RawStatementOperation]:
+    """Drop no-op operations: assertions of current datoms, and retractions of datoms that are not current."""
+    return [op for op in operations if op[3] != (_datom_key(*op[:3]) in current_keys)]
+
+
+def _transaction_docs(
+    raw_statement_operations: List[RawStatementOperation],
+    t_eid: str,
+    shard_key: dict = None,
+) -> List[dict]:
+    """Datoms for a new transaction, including those for its wall-time and for its local ID t_eid.
+
+    Every datom, including those of the transaction entity, is given `shard_key` (see `_shard_key`), if any.
+    """
     t = ObjectId()
-    t_eid = generate_id_unique(coll=coll)
-    t_eid_decoded = decode_id(t_eid)
     docs = [{E: e, A: a, V: v, T: t, O: o} for (e, a, v, o) in raw_statement_operations]
     docs.extend(
         [
             {E: t, A: OID_GENERATED_AT_TIME, V: t.generation_time, T: t, O: True},
-            {E: t, A: OID_VAEM_ID, V: t_eid_decoded, T: t, O: True},
+            {E: t, A: OID_VAEM_ID, V: decode_id(t_eid), T: t, O: True},
         ]
     )
-    # TODO idempotent assert/retract, i.e. don't re-state datoms.
-    inserted_ids = coll.insert_many(
-        docs
-    ).inserted_ids  # raises InvalidOperation if write is unacknowledged
-    if len(inserted_ids) != len(docs):
-        raise WriteError("not all documents inserted for transaction")
-    return inserted_ids
+    if shard_key:
+        for d in docs:
+            d.update(shard_key)
+    return docs
+
+
+def _current_requests(docs: List[dict]) -> list:
+    """Bulk-write requests that apply datoms, in order, to a current-state collection.
+
+    A current-state datom is keyed by its (e, a, v), and also by its shard if it has a shard field.
+    """
+    return [
+        UpdateOne(_current_key(d), {"$set": {T: d[T]}}, upsert=True)
+        if d[O]
+        else DeleteOne(_current_key(d))
+        for d in docs
+    ]
+
+
+def _current_key(d: dict) -> dict:
+    key = {E: d[E], A: d[A], V: d[V]}
+    if S in d:
+        key[S] = d[S]
+    return key
+
+
+def _update_current(docs: List[dict], coll: Collection = None):
+    """Apply datoms, in order, to the current-state collection for coll."""
+    current_collection(coll).bulk_write(_current_requests(docs))
 
 
 def _assert_raw(raw_statements: List[RawStatement], coll: Collection = None):
     _transact_raw([(e, a, v, True) for (e, a, v) in raw_statements], coll=coll)
 
 
-def _oids_for(resources: List[str], coll: Collection = None) -> List[ObjectId]:
-    collname = coll.name
-    check_uris(resources)
-    docs = [
-        {E: _oids_cache.get(collname, r), V: r}
-        for r in set(resources) & set(_oids_cache.ns(collname))
-    ]
-    missing = list(set(resources) - {d[V] for d in docs})
+def _oids_for(
+    resources: List[str], coll: Collection = None, create=True
+) -> List[ObjectId]:
+    """Map each of resources (URIs) to its ObjectId in coll.
+
+    Resources new to coll are added to it, unless `create` is false, in which case they are omitted from the result
+    and nothing is written to the database.
+    """
+    ns = coll.full_name
+    docs, missing = _cached_oids(resources, ns)
     if missing:  # not in cache? fetch from database.
-        docs.extend(list(coll.find({A: OID_URIREF, V: {"$in": missing}}, [E, V])))
-        missing = list(set(resources) - {d[V] for d in docs})
-        if missing:  # not in database? add to database.
+        source = _primary(coll) if create else coll
+        fetched = list(source.find({A: OID_URIREF, V: {"$in": missing}}, [E, V]))
+        docs.extend(fetched)
+        missing = list(set(missing) - {d[V] for d in fetched})
+        if missing and create:  # not in database? add to database.
             new_oids = {r: ObjectId() for r in missing}
             _assert_raw(
                 [(oid, OID_URIREF, r) for r, oid in new_oids.items()], coll=coll
             )
             docs.extend([{E: oid, V: r} for r, oid in new_oids.items()])
     for d in docs:
-        _oids_cache.set(collname, d[V], d[E])
+        _oids_cache.set(ns, d[V], d[E])
     return {d[V]: d[E] for d in docs}
 
 
+def _cached_oids(resources: List[str], ns: str) -> Tuple[List[dict], List[str]]:
+    """Check resources (URIs), and split them into (e, v) docs for those cached for ns, and those missing."""
+    check_uris(resources)
+    docs, missing = [], []
+    for r in set(resources):
+        oid = _oids_cache.get(ns, r)
+        if oid is None:
+            missing.append(r)
+        else:
+            docs.append({E: oid, V: r})
+    return docs, missing
+
+
 URI_BEGINNING_PATTERN = re.compile(r"[a-z]\w*?://.")
 
 
@@ -269,9 +1011,8 @@ def check_uris(resources: List[str]) -> List[str]:
 ExpandedStatement = Tuple[Union[str, ObjectId], Union[str, ObjectId], Any]
 
 
-def _compile_to_raw(
-    statement: ExpandedStatement, coll: Collection = None
-) -> RawStatement:
+def _resources_in(statement: ExpandedStatement) -> set:
+    """Validate statement and return the URIs in it."""
     entity, attribute, value = statement
     objectIds = {c for c in statement if isinstance(c, ObjectId)}
     resources = {
@@ -290,102 +1031,573 @@ def _compile_to_raw(
             "Value must be a non-literal, e.g. a (compact) URI, unless attribute is one of "
             f"{{vaem:id, qudt:value}}. Input statement: {statement}."
         )
-    rmap = _oids_for(resources, coll=coll)
-    return (
-        rmap.get(entity, entity),
-        rmap.get(attribute, attribute),
-        rmap.get(value, value),
-    )
+    return resources
+
+
+def _compile_to_raw(
+    statement: ExpandedStatement, coll: Collection = None
+) -> RawStatement:
+    return _compile_all_to_raw([statement], coll=coll)[0]
+
+
+def _compile_all_to_raw(
+    statements: List[ExpandedStatement], coll: Collection = None
+) -> List[RawStatement]:
+    """Like _compile_to_raw, but resolves the URIs of all statements together."""
+    rmap = _oids_for(_resources_in_all(statements), coll=coll)
+    return _with_oids(statements, rmap)
+
+
+def _resources_in_all(statements: List[ExpandedStatement]) -> List[str]:
+    resources = set()
+    for statement in statements:
+        resources |= _resources_in(statement)
+    return list(resources)
+
+
+def _with_oids(statements: List[ExpandedStatement], rmap: dict) -> List[RawStatement]:
+    return [
+        (
+            rmap.get(entity, entity),
+            rmap.get(attribute, attribute),
+            rmap.get(value, value),
+        )
+        for (entity, attribute, value) in statements
+    ]
 
 
 UserStatement = Tuple[str, str, Any]
 
 
 def _ensure_structured_literal(
-    statement: UserStatement, use_prefixes=None, coll: Collection = None
+    statement: UserStatement,
+    use_prefixes=None,
+    coll: Collection = None,
+    intern_literals=False,
+    shard=None,
+    is_assert=True,
 ) -> List[ExpandedStatement]:
-    e_user, a_user, v_user = prefix_expand(statement, use_prefixes=use_prefixes)
-    v_user_is_uri = isinstance(v_user, str) and re.match(URI_BEGINNING_PATTERN, v_user)
-    if not v_user_is_uri and a_user not in LITERAL_VALUED_ATTRIBUTES:
-        new_oid = ObjectId()
-        v_eid = generate_id_unique(coll=coll)
-        v_eid_decoded = decode_id(v_eid)
-        expanded_statements = [
-            (e_user, a_user, new_oid),
-            (new_oid, CORE_ATTRIBUTES["qudt:value"], v_user),
-            (new_oid, CORE_ATTRIBUTES["vaem:id"], v_eid_decoded),
-        ]
-    else:
-        expanded_statements = [(e_user, a_user, v_user)]
+    return _ensure_structured_literals(
+        [statement],
+        use_prefixes=use_prefixes,
+        coll=coll,
+        intern_literals=intern_literals,
+        shard=shard,
+        is_assert=is_assert,
+    )
+
+
+def _ensure_structured_literals(
+    statements: List[UserStatement],
+    use_prefixes=None,
+    coll: Collection = None,
+    intern_literals=False,
+    shard=None,
+    is_assert=True,
+) -> List[ExpandedStatement]:
+    """Like _ensure_structured_literal, but for many statements, generating IDs for their literals in bulk.
+
+    With `intern_literals`, each literal is given its interned value entity in shard instead (see `literal_oid`), with
+    the same structure however many times it is stated (see `_interned_ids`), so that restating it is a no-op. It is
+    stated only for assertions (`is_assert`), so that a retraction retracts only the link to the entity.
+    """
+    expanded, needs_structure = _expanded_needing_structure(
+        statements, use_prefixes=use_prefixes
+    )
+    if not intern_literals:
+        v_eids = _id_pool.take(sum(needs_structure), coll=coll)
+        return _structured(expanded, needs_structure, v_eids)
+    shard_key = _shard_key(coll, shard)
+    oids = _literal_oids(expanded, needs_structure, shard=shard)
+    if not is_assert:
+        return _interned(expanded, oids)
+    return _interned(expanded, oids, _interned_ids(oids, coll, shard_key=shard_key))
+
+
+def _expanded_needing_structure(statements: List[UserStatement], use_prefixes=None):
+    """Prefix-expand statements, and flag each whose value is a literal that needs a structured value entity."""
+    expanded = py_.chunk(
+        prefix_expand(py_.flatten(statements), use_prefixes=use_prefixes), 3
+    )
+    needs_structure = [
+        not (isinstance(v_user, str) and re.match(URI_BEGINNING_PATTERN, v_user))
+        and a_user not in LITERAL_VALUED_ATTRIBUTES
+        for (e_user, a_user, v_user) in expanded
+    ]
+    return expanded, needs_structure
+
+
+def _structured(
+    expanded: list, needs_structure: List[bool], v_eids: List[str]
+) -> List[ExpandedStatement]:
+    """Replace flagged literals with structured value entities, identified in order by v_eids."""
+    v_eids = iter(v_eids)
+    expanded_statements = []
+    for (e_user, a_user, v_user), needs in zip(expanded, needs_structure):
+        if needs:
+            new_oid = ObjectId()
+            v_eid_decoded = decode_id(next(v_eids))
+            expanded_statements.extend(
+                [
+                    (e_user, a_user, new_oid),
+                    (new_oid, CORE_ATTRIBUTES["qudt:value"], v_user),
+                    (new_oid, CORE_ATTRIBUTES["vaem:id"], v_eid_decoded),
+                ]
+            )
+        else:
+            expanded_statements.append((e_user, a_user, v_user))
+    return expanded_statements
+
+
+def literal_oid(value, shard=None) -> ObjectId:
+    """The ObjectId of the interned value entity for literal value, derived from a hash of value's BSON encoding.
+
+    Equal values of the same BSON type, e.g. two equal strings, or two datetimes of the same instant (to the
+    millisecond), have the same interned value entity, whereas e.g. 1, 1.0, and True do not. Each shard of a sharded
+    collection has its own interned value entities, so that a shard holds the values of its statements.
+    """
+    doc = {"v": value} if shard is None else {"v": value, "s": shard}
+    digest = hashlib.sha256(b"maggtomic:literal:" + bson.encode(doc))
+    return ObjectId(digest.digest()[:12])
+
+
+def _literal_oids(expanded: list, needs_structure: List[bool], shard=None) -> list:
+    """The interned value entity (see `literal_oid`) of each flagged literal, or None for each unflagged statement."""
+    return [
+        literal_oid(v_user, shard=shard) if needs else None
+        for (_, _, v_user), needs in zip(expanded, needs_structure)
+    ]
+
+
+def _interned_id(oid: ObjectId, attempt=0) -> int:
+    """Candidate `attempt` for the decoded vaem:id of value entity oid: 40 bits of a hash, as for generate_id."""
+    digest = hashlib.sha256(oid.binary + attempt.to_bytes(4, "big")).digest()
+    return int.from_bytes(digest[:5], "big")
+
+
+def _interned_ids(oids: list, coll: Collection = None, shard_key: dict = None) -> dict:
+    """The (decoded) vaem:id of each interned value entity among oids.
+
+    An entity already in coll keeps its own. A new one gets the first of its candidates (see `_interned_id`) that no
+    other entity has, checked with one query per round of candidates as in `generate_ids_unique`. So the ID of a new
+    entity is the same however many statements give it, e.g. via separate calls to `assert_`, yet is unique.
+    """
+    ids, uncached = _cached_interned_ids(oids, coll.full_name)
+    if uncached:
+        current_coll = _primary(current_collection(coll))
+        docs = current_coll.find(
+            _value_entity_filter(uncached, shard_key=shard_key),
+            {"_id": 0, E: 1, V: 1},
+            **_cursor_options(current_coll, _current_index_names(shard_key), "EAV"),
+        )
+        ids.update(_cache_interned_ids(docs, coll.full_name))
+    new = [oid for oid in uncached if oid not in ids]
+    attempt = 0
+    while new:
+        candidates = {_interned_id(oid, attempt): oid for oid in new}
+        taken = {
+            d[V]
+            for d in _primary(coll).find(
+                {A: OID_VAEM_ID, V: {"$in": list(candidates)}}, {"_id": 0, V: 1}
+            )
+        }
+        new = _claim_interned_ids(new, candidates, taken, ids)
+        attempt += 1
+    return ids
+
+
+def _cached_interned_ids(oids: list, ns) -> Tuple[dict, List[ObjectId]]:
+    """Split the distinct value entities among oids into the IDs of those with refs cached for ns, and the others."""
+    ids, uncached = {}, []
+    for oid in OrderedDict.fromkeys(oid for oid in oids if oid is not None):
+        ref = _oids_cache.get_ref(ns, oid)
+        if ref is None:
+            uncached.append(oid)
+        else:
+            ids[oid] = decode_id(ref[2:])
+    return ids, uncached
+
+
+def _value_entity_filter(oids: List[ObjectId], shard_key: dict = None) -> dict:
+    return merge({E: {"$in": oids}, A: OID_VAEM_ID}, shard_key or {})
+
+
+def _cache_interned_ids(docs, ns) -> dict:
+    """Cache the refs of value entities for ns given their vaem:id datoms, and return their IDs."""
+    ids = {}
+    for d in docs:
+        _oids_cache.set_ref(ns, d[E], "_:" + encode_id(d[V]))
+        ids[d[E]] = d[V]
+    return ids
+
+
+def _claim_interned_ids(new: list, candidates: dict, taken: set, ids: dict) -> list:
+    """Give each of new entities its candidate ID, unless taken or claimed already, and return those left without."""
+    claimed = set(ids.values())
+    for v_id, oid in candidates.items():
+        if v_id not in taken and v_id not in claimed:
+            ids[oid] = v_id
+            claimed.add(v_id)
+    return [oid for oid in new if oid not in ids]
+
+
+def _interned(
+    expanded: list, oids: list, v_ids: dict = None
+) -> List[ExpandedStatement]:
+    """Replace literals with their value entities, given by oids, structuring each keyed in v_ids (by its ID) once."""
+    v_ids = dict(v_ids or {})
+    expanded_statements = []
+    for (e_user, a_user, v_user), oid in zip(expanded, oids):
+        if oid is None:
+            expanded_statements.append((e_user, a_user, v_user))
+            continue
+        expanded_statements.append((e_user, a_user, oid))
+        v_id = v_ids.pop(oid, None)
+        if v_id is not None:
+            expanded_statements.extend(
+                [
+                    (oid, CORE_ATTRIBUTES["qudt:value"], v_user),
+                    (oid, CORE_ATTRIBUTES["vaem:id"], v_id),
+                ]
+            )
     return expanded_statements
 
 
 def assert_(
-    statement: UserStatement, use_prefixes=None, coll: Collection = None
+    statement: UserStatement,
+    use_prefixes=None,
+    coll: Collection = None,
+    intern_literals=False,
+    shard=None,
 ) -> List[RawStatementOperation]:
     return assert_or_retract(
-        statement, is_assert=True, use_prefixes=use_prefixes, coll=coll
+        statement,
+        is_assert=True,
+        use_prefixes=use_prefixes,
+        coll=coll,
+        intern_literals=intern_literals,
+        shard=shard,
     )
 
 
 def retract(
-    statement: UserStatement, use_prefixes=None, coll: Collection = None
+    statement: UserStatement,
+    use_prefixes=None,
+    coll: Collection = None,
+    intern_literals=False,
+    shard=None,
 ) -> List[RawStatementOperation]:
     return assert_or_retract(
-        statement, is_assert=False, use_prefixes=use_prefixes, coll=coll
+        statement,
+        is_assert=False,
+        use_prefixes=use_prefixes,
+        coll=coll,
+        intern_literals=intern_literals,
+        shard=shard,
     )
 
 
 def assert_or_retract(
-    statement: UserStatement, is_assert=True, use_prefixes=None, coll: Collection = None
+    statement: UserStatement,
+    is_assert=True,
+    use_prefixes=None,
+    coll: Collection = None,
+    intern_literals=False,
+    shard=None,
 ) -> List[RawStatementOperation]:
+    """Raw statement operations that assert (or retract) statement.
+
+    A literal value is held by a structured value entity (see `OID_QUDT_VALUE`). By default, each literal gets a new
+    one. With `intern_literals`, equal literals of the same type share one (see `literal_oid`), and retracting a
+    statement retracts only its link to that entity, which other statements may share. Interned value entities are per
+    `shard`, i.e. the shard that the operations are to be transacted to (see `transact`).
+    """
     expanded_statements = _ensure_structured_literal(
-        statement, use_prefixes=use_prefixes, coll=coll
+        statement,
+        use_prefixes=use_prefixes,
+        coll=coll,
+        intern_literals=intern_literals,
+        shard=shard,
+        is_assert=is_assert,
     )
     raw_statements = [_compile_to_raw(s, coll=coll) for s in expanded_statements]
     return [(e, a, v, is_assert) for (e, a, v) in raw_statements]
 
 
-def transact(rso_sequence: List[List[RawStatementOperation]], coll: Collection = None):
-    _transact_raw(py_.flatten(rso_sequence), coll=coll)
+def transact(
+    rso_sequence: List[List[RawStatementOperation]],
+    coll: Collection = None,
+    shard=None,
+    profile: Profile = None,
+):
+    """Transact raw statement operations, e.g. from `assert_` and `retract`, as one transaction.
+
+    For a sharded collection (see `create_collection`), its datoms are in `shard`, or in no shard (i.e. shared by all
+    shards) if shard is None.
+
+    If given, `profile` collects the time of each phase of the transaction, and its commands (see `Profile`).
+    """
+    with profiling(profile):
+        _transact_raw(py_.flatten(rso_sequence), coll=coll, shard=shard)
+
+
+def transact_bulk(
+    statements: Iterable[UserStatement],
+    is_assert=True,
+    chunk_size=10000,
+    use_prefixes=None,
+    coll: Collection = None,
+    intern_literals=False,
+    shard=None,
+    profile: Profile = None,
+):
+    """Assert (or retract) a stream of user statements, transacting each chunk of chunk_size statements.
 
+    Unlike transacting the results of `assert_` or `retract`, each chunk resolves all of its URIs with one lookup (and
+    one insert for those new to coll), generates IDs for all of its structured literals in bulk, and is inserted
+    unordered. Statements are consumed lazily, so memory use is bounded by chunk_size rather than by the stream.
 
-def _as_of_or_since(coll: Collection, t: Union[ObjectId, datetime], compare_op="$lte"):
-    """Returns a higher-order filter to produce a collection cursor that pre-filters according to t.
+    With `intern_literals`, literals share value entities (see `assert_or_retract`). For a sharded collection,
+    statements are transacted to `shard` (see `transact`). If given, `profile` is collected over all chunks, with
+    resolving their URIs and literals as the "resolve" phase.
+    """
+    with profiling(profile):
+        for chunk in partition_all(chunk_size, statements):
+            with phase("resolve"):
+                expanded_statements = _ensure_structured_literals(
+                    chunk,
+                    use_prefixes=use_prefixes,
+                    coll=coll,
+                    intern_literals=intern_literals,
+                    shard=shard,
+                    is_assert=is_assert,
+                )
+                raw_statements = _compile_all_to_raw(expanded_statements, coll=coll)
+            _transact_raw(
+                [(e, a, v, is_assert) for (e, a, v) in raw_statements],
+                coll=coll,
+                ordered=False,
+                shard=shard,
+            )
+
+
+# Smallest and largest possible ObjectIds, e.g. for a basis before or after every transaction.
+MIN_OID = ObjectId("0" * 24)
+MAX_OID = ObjectId("f" * 24)
+
+
+def _utc(dt: datetime) -> datetime:
+    """dt as a timezone-aware UTC datetime. Naive datetimes, e.g. as read from MongoDB, are taken to be in UTC."""
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)
+
+
+class TxTimeIndex:
+    """Wall times of the transactions of each namespace (NS), i.e. collection full name, sorted for binary search.
+
+    Each entry is a (prov:generatedAtTime, transaction ObjectId) pair. A namespace is refreshed incrementally, by
+    fetching only the wall times of transactions later than the latest one it has (see `refresh_filter`).
+    """
+
+    def __init__(self):
+        self._entries = {}
+
+    def reset_ns(self, ns):
+        self._entries.pop(ns, None)
+
+    def latest(self, ns) -> ObjectId:
+        """The latest transaction of ns, or MIN_OID if it has none."""
+        return self._entries[ns][-1][1] if self._entries.get(ns) else MIN_OID
+
+    def refresh_filter(self, ns) -> dict:
+        """Filter for the wall-time datoms of transactions of ns that are not yet in the index."""
+        return {A: OID_GENERATED_AT_TIME, T: {"$gt": self.latest(ns)}}
+
+    def add(self, ns, docs: Iterable[dict]):
+        """Add wall-time datoms, each with at least fields v and t."""
+        entries = self._entries.setdefault(ns, [])
+        entries.extend((_utc(d[V]), d[T]) for d in docs)
+        entries.sort()
+
+    def basis(self, ns, time: datetime) -> ObjectId:
+        """The latest transaction of ns at or before time, or MIN_OID if there is none.
+
+        Transactions at or before time are those with T at or before the basis, and those after time are those with T
+        after it.
+        """
+        entries = self._entries.get(ns, [])
+        i = bisect.bisect_right(entries, (_utc(time), MAX_OID))
+        return entries[i - 1][1] if i else MIN_OID
+
+
+_tx_times = TxTimeIndex()
+
+
+def _refresh_tx_times(coll: Collection):
+    filter_ = _tx_times.refresh_filter(coll.full_name)
+    options = _cursor_options(coll, INDEX_NAMES, "T")
+    _tx_times.add(coll.full_name, coll.find(filter_, {"_id": 0, V: 1, T: 1}, **options))
+
+
+class DatomFilter:
+    """A higher-order filter: produces cursors over the datoms of a source collection, pre-filtered by a basis.
+
+    Called with a filter F, combines the basis with F and returns a cursor over the source collection using the combined
+    filter. It also accepts, as keywords:
+      - index: the order of datom fields of the index to hint, e.g. "AVE" (see INDEX_NAMES).
+      - projection: fields to return, e.g. only e, a, and v, so that the cursor may be covered by the index.
+      - batch_size: number of documents per batch (see CURSOR_BATCH_SIZE).
+
+    If `resolve_retractions`, only the facts asserted and not since retracted (as of the basis) are produced.
+
+    `existing_indexes` are the names of the source collection's indexes, if known, e.g. as fetched by a coroutine (see
+    `maggtomic.aio`). Otherwise, they are fetched on first use (see `_existing_index_names`).
+    """
+
+    def __init__(
+        self,
+        source: Collection,
+        index_names: dict,
+        basis=None,
+        resolve_retractions=False,
+        existing_indexes=None,
+    ):
+        self.source = source
+        self.index_names = index_names
+        self.basis = basis or {}
+        self.resolve_retractions = resolve_retractions
+        self.existing_indexes = existing_indexes
+
+    def _cursor_options(self, index=None, batch_size=None) -> dict:
+        return _cursor_options(
+            self.source,
+            self.index_names,
+            index,
+            batch_size,
+            existing=self.existing_indexes,
+        )
+
+    def stages_for(self, filter_: dict) -> list:
+        """Aggregation stages over the source collection that produce the datoms this filter produces for filter_.
+
+        The first stage is always a `$match`.
+        """
+        filter_ = merge(filter_, self.basis)
+        if self.resolve_retractions:
+            return _resolved_stages(filter_)
+        return [{"$match": filter_}]
+
+    def __call__(self, filter_: dict, index=None, projection=None, batch_size=None):
+        options = self._cursor_options(index, batch_size)
+        if not self.resolve_retractions:
+            return self.source.find(merge(filter_, self.basis), projection, **options)
+        pipeline = self.stages_for(filter_)
+        if projection is not None:
+            pipeline.append({"$project": projection})
+        if "batch_size" in options:
+            options["batchSize"] = options.pop("batch_size")
+        return self.source.aggregate(pipeline, allowDiskUse=True, **options)
+
+    def explain(self, filter_: dict, index=None, projection=None) -> dict:
+        """The server's explanation, with execution stats, of the cursor that this filter produces for filter_.
+
+        Runs the cursor's query in full (see `maggtomic.profile.explained`).
+        """
+        if not self.resolve_retractions:
+            command = {"find": self.source.name, "filter": merge(filter_, self.basis)}
+            if projection is not None:
+                command["projection"] = projection
+        else:
+            pipeline = self.stages_for(filter_)
+            if projection is not None:
+                pipeline.append({"$project": projection})
+            command = {
+                "aggregate": self.source.name,
+                "pipeline": pipeline,
+                "cursor": {},
+            }
+        options = self._cursor_options(index)
+        if "hint" in options:
+            command["hint"] = options["hint"]
+        return self.source.database.command(
+            "explain", command, verbosity="executionStats"
+        )
+
+
+def _as_of_or_since(
+    coll: Collection,
+    t: Union[ObjectId, datetime],
+    compare_op="$lte",
+    shard=None,
+    live=False,
+):
+    """Returns a higher-order filter (see `DatomFilter`) to produce a collection cursor that pre-filters according to t.
 
     A higher-order filter for collection coll is a function that, when passed a filter F, combines a previously
     specified filter (based on the value t given to as_of) with the filter F, and returns a cursor over the collection
-    coll using the combined filter.
+    coll using the combined filter. It is returned paired with coll.
 
-    """
-    if isinstance(t, datetime):
-        # TODO synthesize oid if no oid in db has generation_time $gt t (o/w `since` call may error).
-        oid = coll.find_one(
-            {A: OID_GENERATED_AT_TIME, V: {compare_op: t}}, [E], sort=[(T, DESC)]
-        )[E]
-    else:
-        oid = t
+    A datetime t stands for the latest transaction at or before it, as found in the collection's transaction-time index
+    (see `TxTimeIndex`), which is first refreshed with any new transactions.
 
-    def docs_for(filter_):
-        filter_ = assoc_in(filter_, [T, compare_op], oid)
-        return coll.find(filter_)
+    For a sharded collection, a `shard` restricts datoms to those in that shard or in none (see `S`).
 
+    If `live`, an as_of t at or after the latest transaction reads the current state instead (see `as_of`).
+    """
+    shortcut = compare_op == "$lte" and live
+    if isinstance(t, datetime) or shortcut:
+        _refresh_tx_times(coll)
+    oid = _tx_times.basis(coll.full_name, t) if isinstance(t, datetime) else t
+    if shortcut and oid >= _tx_times.latest(coll.full_name):
+        return current(coll, shard=shard)
+    index_names, shard_basis = _shard_scope(
+        coll, shard, INDEX_NAMES, SHARDED_INDEX_NAMES
+    )
+    docs_for = DatomFilter(
+        coll,
+        index_names,
+        basis=merge({T: {compare_op: oid}}, shard_basis),
+        resolve_retractions=(compare_op == "$lte"),
+    )
     return docs_for, coll
 
 
-def as_of(coll: Collection, t: Union[ObjectId, datetime]):
-    """Returns a higher-order filter to produce a collection cursor that pre-filters for transactions before or at t."""
-    return _as_of_or_since(coll, t, compare_op="$lte")
+def as_of(coll: Collection, t: Union[ObjectId, datetime], shard=None, live=False):
+    """Returns a higher-order filter to produce a collection cursor that pre-filters for transactions before or at t.
+
+    Retractions are resolved, i.e. only facts asserted and not since retracted as of t are produced. The basis is pinned
+    to t however many transactions follow, e.g. across the pages of `query_iter`. With `live`, if t is at or after the
+    latest transaction in coll, the current-state collection is read directly instead (see `current`), which avoids
+    resolving history but costs a round-trip to the transaction-time index, and each cursor then reads the state as of
+    when it is created, so results include later transactions.
+    """
+    return _as_of_or_since(coll, t, compare_op="$lte", shard=shard, live=live)
+
+
+def since(coll: Collection, t: Union[ObjectId, datetime], shard=None):
+    """Like as_of, but pre-filters collection for transactions after t.
 
+    Unlike as_of, retractions are not resolved: every datom, assertion or retraction, transacted after t is produced.
+    """
+    return _as_of_or_since(coll, t, compare_op="$gt", shard=shard)
+
+
+def current(coll: Collection, shard=None):
+    """Returns a higher-order filter over the current state of coll, i.e. as of its latest transaction.
 
-def since(coll: Collection, t: Union[ObjectId, datetime]):
-    """Like as_of, but pre-filters collection for transactions after t."""
-    return _as_of_or_since(coll, t, compare_op="$gt")
+    Reads the current-state collection (see `current_collection`), so retractions are resolved without scanning
+    history. For a sharded collection, a `shard` restricts datoms to those in that shard or in none (see `S`), and no
+    shard reads all of them.
+    """
+    index_names, shard_basis = _shard_scope(
+        coll, shard, CURRENT_INDEX_NAMES, SHARDED_CURRENT_INDEX_NAMES
+    )
+    return DatomFilter(current_collection(coll), index_names, basis=shard_basis), coll
 
 
 # TODO basic CRUD
 #  or rather, "ARAR" (pirate voice): create->assert, read->read, update->accumulate, delete->retract.
-#  - idempotent assert/retract, i.e. don't re-state datoms.
 #  - "update"
 #    - accumulate for cardinality/many
 #    - "replace" for cardinality/one, i.e. retract and assert.
@@ -432,7 +1644,6 @@ if __name__ == "__main__":
             ],
         ],
     }
-    coll_as_of_now = as_of(mycoll, datetime.now(tz=timezone.utc))
-    results = query(query_spec, coll_hof=coll_as_of_now)
+    results = query(query_spec, coll_hof=current(mycoll))
     assert len(results) == len(key_time_statements)
     assert all(k.startswith("myns:") for k in py_.pluck(results, "?key"))
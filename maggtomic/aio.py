@@ -0,0 +1,653 @@
+"""Asyncio counterparts of transact, assert_/retract, as_of/since/current, and query, via Motor.
+
+Coroutines here take Motor collections (e.g. from `db` below, connected on first use) wherever their blocking
+counterparts take pymongo ones, and never block the event loop on the database. They share the blocking API's pure
+helpers and its process-wide caches of refs, local IDs, index names, and query plans.
+
+Requires motor (`pip install maggtomic[aio]`).
+"""
+import asyncio
+from datetime import datetime
+from typing import Iterable, List, Union
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorCollection
+from pydash import py_
+from pymongo.errors import WriteError
+from toolz import merge, partition_all
+
+from maggtomic import (
+    A,
+    E,
+    INDEX_NAMES,
+    CURRENT_INDEX_NAMES,
+    SHARDED_INDEX_NAMES,
+    SHARDED_CURRENT_INDEX_NAMES,
+    OID_URIREF,
+    OID_VAEM_ID,
+    V,
+    T,
+    Database,
+    DatomFilter,
+    RawStatementOperation,
+    UserStatement,
+    _cache_interned_ids,
+    _cached_interned_ids,
+    _cached_oids,
+    _claim_interned_ids,
+    _current_index_names,
+    _current_lookups,
+    _current_requests,
+    _cursor_options,
+    _datom_key,
+    _effective_operations,
+    _expanded_needing_structure,
+    _id_pool,
+    _index_names,
+    _interned,
+    _interned_id,
+    _literal_oids,
+    _net_operations,
+    _oids_cache,
+    _primary,
+    _resources_in_all,
+    _shard_key,
+    _shard_scope,
+    _structured,
+    _tx_times,
+    _transaction_docs,
+    _value_entity_filter,
+    _with_oids,
+    current_collection,
+)
+from maggtomic.query import (
+    ESTIMATE_LIMIT,
+    QUERY_BATCH_SIZE,
+    _UNIT,
+    _arg_values,
+    _as_bindings,
+    _bindings_for_args,
+    _cached_refs,
+    _checked_refs,
+    _formatted,
+    _getter,
+    _graph_pattern_constants,
+    _join,
+    _join_all,
+    _oid_places,
+    _plan_cache,
+    _plan_components,
+    _plan_key,
+    _ref_filter,
+    _refs_from,
+    _row_oids,
+    _row_reader,
+    _stream_join,
+    _with_constant_oids,
+    _with_refs,
+    Bindings,
+    bound_values,
+    compile_pipeline,
+    cursor_for,
+    estimate_size as _estimate_size,
+    filter_for,
+    find_datoms,
+    variable_fields,
+)
+from maggtomic.util import generate_id, decode_id
+
+db = Database(client_class=AsyncIOMotorClient)
+
+
+async def _existing_index_names(coll: AsyncIOMotorCollection) -> set:
+    """Names of the indexes of coll, fetched once per collection per process (see `maggtomic._existing_index_names`).
+
+    Each use of them, e.g. by `DatomFilter`, is given them, as the blocking API would fetch them without awaiting.
+    """
+    if coll.full_name not in _index_names:
+        _index_names[coll.full_name] = set(await coll.index_information())
+    return _index_names[coll.full_name]
+
+
+async def generate_ids_unique(
+    n: int, coll: AsyncIOMotorCollection = None, **generate_id_kwargs
+) -> List[str]:
+    eids = {}
+    while len(eids) < n:
+        candidates = {}
+        for _ in range(n - len(eids)):
+            eid = generate_id(**generate_id_kwargs)
+            candidates[decode_id(eid)] = eid
+        taken = {
+            d[V]
+            async for d in _primary(coll).find(
+                {A: OID_VAEM_ID, V: {"$in": list(candidates)}}, {"_id": 0, V: 1}
+            )
+        }
+        eids.update({k: v for k, v in candidates.items() if k not in taken})
+    return list(eids.values())
+
+
+async def _take_ids(n: int, coll: AsyncIOMotorCollection = None) -> List[str]:
+    """Take n IDs from the local ID pool for coll (see `maggtomic.IDPool`)."""
+    ns = coll.full_name
+    eids = _id_pool.pop(n, ns)
+    while eids is None:
+        _id_pool.add(
+            ns, await generate_ids_unique(_id_pool.shortfall(n, ns), coll=coll)
+        )
+        eids = _id_pool.pop(n, ns)
+    return eids
+
+
+async def _shard_key_for(coll: AsyncIOMotorCollection, shard=None) -> dict:
+    """Like `maggtomic._shard_key`."""
+    return _shard_key(coll, shard, existing=await _existing_index_names(coll))
+
+
+async def _current_keys(
+    operations: List[RawStatementOperation], coll, shard_key: dict = None
+) -> set:
+    current_coll = _primary(current_collection(coll))
+    options = _cursor_options(
+        current_coll,
+        _current_index_names(shard_key),
+        "EAV",
+        existing=await _existing_index_names(current_coll),
+    )
+    return {
+        _datom_key(d[E], d[A], d[V])
+        for filter_ in _current_lookups(operations, shard_key=shard_key)
+        async for d in current_coll.find(
+            filter_, {"_id": 0, E: 1, A: 1, V: 1}, **options
+        )
+    }
+
+
+async def _transact_raw(
+    raw_statement_operations: List[RawStatementOperation],
+    coll: AsyncIOMotorCollection = None,
+    ordered=True,
+    shard=None,
+):
+    shard_key = await _shard_key_for(coll, shard)
+    operations = _net_operations(raw_statement_operations)
+    operations = _effective_operations(
+        operations, await _current_keys(operations, coll, shard_key=shard_key)
+    )
+    if not operations:
+        return []
+    docs = _transaction_docs(
+        operations, (await _take_ids(1, coll))[0], shard_key=shard_key
+    )
+    result = await coll.insert_many(docs, ordered=ordered)
+    if len(result.inserted_ids) != len(docs):
+        raise WriteError("not all documents inserted for transaction")
+    await current_collection(coll).bulk_write(_current_requests(docs))
+    return result.inserted_ids
+
+
+async def _oids_for(
+    resources: List[str], coll: AsyncIOMotorCollection = None, create=True
+) -> dict:
+    ns = coll.full_name
+    docs, missing = _cached_oids(resources, ns)
+    if missing:
+        source = _primary(coll) if create else coll
+        cursor = source.find({A: OID_URIREF, V: {"$in": missing}}, [E, V])
+        fetched = await cursor.to_list(None)
+        docs.extend(fetched)
+        missing = list(set(missing) - {d[V] for d in fetched})
+        if missing and create:
+            new_oids = {r: ObjectId() for r in missing}
+            await _transact_raw(
+                [(oid, OID_URIREF, r, True) for r, oid in new_oids.items()], coll=coll
+            )
+            docs.extend([{E: oid, V: r} for r, oid in new_oids.items()])
+    for d in docs:
+        _oids_cache.set(ns, d[V], d[E])
+    return {d[V]: d[E] for d in docs}
+
+
+async def _interned_statements(
+    expanded, needs_structure, coll, shard=None, is_assert=True
+):
+    """Like `maggtomic._ensure_structured_literals` with `intern_literals`, after expansion."""
+    shard_key = await _shard_key_for(coll, shard)
+    oids = _literal_oids(expanded, needs_structure, shard=shard)
+    if not is_assert:
+        return _interned(expanded, oids)
+    return _interned(
+        expanded, oids, await _interned_ids(oids, coll, shard_key=shard_key)
+    )
+
+
+async def _interned_ids(
+    oids: list, coll: AsyncIOMotorCollection = None, shard_key: dict = None
+) -> dict:
+    """Like `maggtomic._interned_ids`."""
+    ids, uncached = _cached_interned_ids(oids, coll.full_name)
+    if uncached:
+        current_coll = _primary(current_collection(coll))
+        options = _cursor_options(
+            current_coll,
+            _current_index_names(shard_key),
+            "EAV",
+            existing=await _existing_index_names(current_coll),
+        )
+        cursor = current_coll.find(
+            _value_entity_filter(uncached, shard_key=shard_key),
+            {"_id": 0, E: 1, V: 1},
+            **options,
+        )
+        ids.update(_cache_interned_ids(await cursor.to_list(None), coll.full_name))
+    new = [oid for oid in uncached if oid not in ids]
+    attempt = 0
+    while new:
+        candidates = {_interned_id(oid, attempt): oid for oid in new}
+        taken = {
+            d[V]
+            async for d in _primary(coll).find(
+                {A: OID_VAEM_ID, V: {"$in": list(candidates)}}, {"_id": 0, V: 1}
+            )
+        }
+        new = _claim_interned_ids(new, candidates, taken, ids)
+        attempt += 1
+    return ids
+
+
+async def _raw_statement_operations(
+    statements: List[UserStatement],
+    is_assert=True,
+    use_prefixes=None,
+    coll: AsyncIOMotorCollection = None,
+    intern_literals=False,
+    shard=None,
+) -> List[RawStatementOperation]:
+    expanded, needs_structure = _expanded_needing_structure(
+        statements, use_prefixes=use_prefixes
+    )
+    if intern_literals:
+        expanded_statements = await _interned_statements(
+            expanded, needs_structure, coll, shard=shard, is_assert=is_assert
+        )
+    else:
+        v_eids = await _take_ids(sum(needs_structure), coll=coll)
+        expanded_statements = _structured(expanded, needs_structure, v_eids)
+    rmap = await _oids_for(_resources_in_all(expanded_statements), coll=coll)
+    return [(e, a, v, is_assert) for (e, a, v) in _with_oids(expanded_statements, rmap)]
+
+
+async def assert_(
+    statement: UserStatement,
+    use_prefixes=None,
+    coll: AsyncIOMotorCollection = None,
+    intern_literals=False,
+    shard=None,
+) -> List[RawStatementOperation]:
+    return await assert_or_retract(
+        statement,
+        is_assert=True,
+        use_prefixes=use_prefixes,
+        coll=coll,
+        intern_literals=intern_literals,
+        shard=shard,
+    )
+
+
+async def retract(
+    statement: UserStatement,
+    use_prefixes=None,
+    coll: AsyncIOMotorCollection = None,
+    intern_literals=False,
+    shard=None,
+) -> List[RawStatementOperation]:
+    return await assert_or_retract(
+        statement,
+        is_assert=False,
+        use_prefixes=use_prefixes,
+        coll=coll,
+        intern_literals=intern_literals,
+        shard=shard,
+    )
+
+
+async def assert_or_retract(
+    statement: UserStatement,
+    is_assert=True,
+    use_prefixes=None,
+    coll: AsyncIOMotorCollection = None,
+    intern_literals=False,
+    shard=None,
+) -> List[RawStatementOperation]:
+    return await _raw_statement_operations(
+        [statement],
+        is_assert=is_assert,
+        use_prefixes=use_prefixes,
+        coll=coll,
+        intern_literals=intern_literals,
+        shard=shard,
+    )
+
+
+async def transact(
+    rso_sequence: List[List[RawStatementOperation]],
+    coll: AsyncIOMotorCollection = None,
+    shard=None,
+):
+    await _transact_raw(py_.flatten(rso_sequence), coll=coll, shard=shard)
+
+
+async def transact_bulk(
+    statements: Iterable[UserStatement],
+    is_assert=True,
+    chunk_size=10000,
+    use_prefixes=None,
+    coll: AsyncIOMotorCollection = None,
+    intern_literals=False,
+    shard=None,
+):
+    """Like `maggtomic.transact_bulk`."""
+    for chunk in partition_all(chunk_size, statements):
+        await _transact_raw(
+            await _raw_statement_operations(
+                chunk,
+                is_assert=is_assert,
+                use_prefixes=use_prefixes,
+                coll=coll,
+                intern_literals=intern_literals,
+                shard=shard,
+            ),
+            coll=coll,
+            ordered=False,
+            shard=shard,
+        )
+
+
+async def _refresh_tx_times(coll: AsyncIOMotorCollection):
+    filter_ = _tx_times.refresh_filter(coll.full_name)
+    options = _cursor_options(
+        coll, INDEX_NAMES, "T", existing=await _existing_index_names(coll)
+    )
+    cursor = coll.find(filter_, {"_id": 0, V: 1, T: 1}, **options)
+    _tx_times.add(coll.full_name, await cursor.to_list(None))
+
+
+async def _as_of_or_since(
+    coll: AsyncIOMotorCollection,
+    t: Union[ObjectId, datetime],
+    compare_op="$lte",
+    shard=None,
+    live=False,
+):
+    shortcut = compare_op == "$lte" and live
+    if isinstance(t, datetime) or shortcut:
+        await _refresh_tx_times(coll)
+    oid = _tx_times.basis(coll.full_name, t) if isinstance(t, datetime) else t
+    if shortcut and oid >= _tx_times.latest(coll.full_name):
+        return await current(coll, shard=shard)
+    existing = await _existing_index_names(coll)
+    index_names, shard_basis = _shard_scope(
+        coll, shard, INDEX_NAMES, SHARDED_INDEX_NAMES, existing=existing
+    )
+    docs_for = DatomFilter(
+        coll,
+        index_names,
+        basis=merge({T: {compare_op: oid}}, shard_basis),
+        resolve_retractions=(compare_op == "$lte"),
+        existing_indexes=existing,
+    )
+    return docs_for, coll
+
+
+async def as_of(
+    coll: AsyncIOMotorCollection, t: Union[ObjectId, datetime], shard=None, live=False
+):
+    """Like `maggtomic.as_of`. The higher-order filter produces Motor cursors."""
+    return await _as_of_or_since(coll, t, compare_op="$lte", shard=shard, live=live)
+
+
+async def since(coll: AsyncIOMotorCollection, t: Union[ObjectId, datetime], shard=None):
+    """Like `maggtomic.since`. The higher-order filter produces Motor cursors."""
+    return await _as_of_or_since(coll, t, compare_op="$gt", shard=shard)
+
+
+async def current(coll: AsyncIOMotorCollection, shard=None):
+    """Like `maggtomic.current`. The higher-order filter produces Motor cursors."""
+    index_names, shard_basis = _shard_scope(
+        coll,
+        shard,
+        CURRENT_INDEX_NAMES,
+        SHARDED_CURRENT_INDEX_NAMES,
+        existing=await _existing_index_names(coll),
+    )
+    current_coll = current_collection(coll)
+    docs_for = DatomFilter(
+        current_coll,
+        index_names,
+        basis=shard_basis,
+        existing_indexes=await _existing_index_names(current_coll),
+    )
+    return docs_for, coll
+
+
+async def compile_graph_pattern(graph_pattern, use_prefixes=None, coll_hof=None):
+    coll_hof = coll_hof or await current(db.main)
+    expanded_resource = _graph_pattern_constants(graph_pattern, use_prefixes)
+    expanded_resource_oid = await _oids_for(
+        list(expanded_resource.values()), coll=coll_hof[1], create=False
+    )
+    return _with_constant_oids(graph_pattern, expanded_resource, expanded_resource_oid)
+
+
+async def estimate_size(condition, coll_hof, use_stats=True):
+    if not use_stats:
+        return _estimate_size(condition, coll_hof, use_stats=False)
+    return await coll_hof[1].count_documents(
+        filter_for(condition), limit=ESTIMATE_LIMIT
+    )
+
+
+async def plan_conditions(conditions, coll_hof, use_stats=True, bound=()):
+    """Like `maggtomic.query.plan_conditions`, but estimates the sizes of all conditions concurrently."""
+    estimates = await asyncio.gather(
+        *[estimate_size(c, coll_hof, use_stats=use_stats) for c in conditions]
+    )
+    return _plan_components(conditions, estimates, bound=bound)
+
+
+async def _iter_rows_for(condition, coll_hof, bound=None):
+    reader = _row_reader(condition)
+    if reader is None:
+        async for _ in cursor_for(condition, coll_hof, batch_size=1):
+            yield ()
+            break
+        return
+    _, row_of = reader
+    async for doc in cursor_for(condition, coll_hof, bound=bound):
+        yield row_of(doc)
+
+
+async def _rows_for(condition, coll_hof, bound=None) -> Bindings:
+    rows = [row async for row in _iter_rows_for(condition, coll_hof, bound=bound)]
+    return Bindings(tuple(variable_fields(condition)), rows)
+
+
+async def _join_component(component, coll_hof, joined=None):
+    for c in component:
+        if joined is None:
+            joined = await _rows_for(c, coll_hof)
+        else:
+            bound = bound_values(joined, variable_fields(c))
+            joined = _join(joined, await _rows_for(c, coll_hof, bound=bound))
+        if not joined:
+            return joined
+    return joined
+
+
+async def _aiter(iterable):
+    for item in iterable:
+        yield item
+
+
+async def iter_planned_bindings(components, coll_hof, seed=None):
+    """Like `maggtomic.query.iter_planned_bindings`, but joins independent components concurrently."""
+    variables, rows = await planned_rows(components, coll_hof, seed=seed)
+    async for row in rows:
+        yield dict(zip(variables, row))
+
+
+async def planned_rows(components, coll_hof, seed=None):
+    """Like `maggtomic.query.planned_rows`, but joins independent components concurrently.
+
+    :returns: the variables bound, and an asynchronous iterator of rows of their values.
+    """
+    seed = _as_bindings(seed)
+    if not components or (seed is not None and not seed):
+        return (), _aiter(())
+    starts = [seed] + [None] * (len(components) - 1)
+    *independent, joined = await asyncio.gather(
+        *[
+            _join_component(component, coll_hof, joined=start)
+            for component, start in zip(components[:-1] + [components[-1][:-1]], starts)
+        ]
+    )
+    if not all(independent) or (joined is not None and not joined):
+        return (), _aiter(())
+    rest = _join_all(independent) if independent else _UNIT
+    if not rest:
+        return (), _aiter(())
+    joined = _UNIT if joined is None else joined
+    final = components[-1]
+    if final:
+        last_variables = tuple(variable_fields(final[-1]))
+        stream = _iter_rows_for(
+            final[-1], coll_hof, bound=bound_values(joined, last_variables)
+        )
+        variables, join = _stream_join(joined, last_variables)
+        rows = (row async for s in stream for row in join(s))
+    else:
+        variables, rows = joined.variables, _aiter(joined.rows)
+    return rest.variables + variables, (
+        r + row async for row in rows for r in rest.rows
+    )
+
+
+async def iter_pipeline_bindings(components, coll_hof, seed=None, batch_size=None):
+    """Like `maggtomic.query.iter_pipeline_bindings`."""
+    variables, rows = await pipeline_rows(
+        components, coll_hof, seed=seed, batch_size=batch_size
+    )
+    async for row in rows:
+        yield dict(zip(variables, row))
+
+
+async def pipeline_rows(components, coll_hof, seed=None, batch_size=None):
+    """Like `maggtomic.query.pipeline_rows`."""
+    seed = _as_bindings(seed)
+    conditions = [c for component in components for c in component]
+    if not conditions or (seed is not None and not seed):
+        return (), _aiter(())
+    if not all(variable_fields(c) for c in conditions):
+        return await planned_rows(components, coll_hof, seed=seed)
+    pipeline, fields = compile_pipeline(components, coll_hof, seed=seed)
+    options = {"batchSize": batch_size} if batch_size else {}
+    docs = coll_hof[0].source.aggregate(pipeline, allowDiskUse=True, **options)
+    variables, row_of = tuple(fields), _getter(list(fields.values()))
+    rows = (row_of(doc) async for doc in docs)
+    if seed is None:
+        return variables, rows
+    variables, join = _stream_join(seed, variables)
+    return variables, (row async for s in rows for row in join(s))
+
+
+async def refs_for(oids, coll_hof=None):
+    coll_hof = coll_hof or await current(db.main)
+    ns = coll_hof[1].full_name
+    out = _cached_refs(oids, ns)
+    to_fetch = list(set(oids) - set(out))
+    if to_fetch:
+        docs = await find_datoms(_ref_filter(to_fetch), coll_hof).to_list(None)
+        out.update(_refs_from(docs, ns))
+    return _checked_refs(oids, out)
+
+
+async def sub_refs(selected, coll_hof=None):
+    oid_places = _oid_places(selected)
+    refs = await refs_for([o_p[2] for o_p in oid_places], coll_hof=coll_hof)
+    return _with_refs(selected, oid_places, refs)
+
+
+async def compile_query(query_spec, coll_hof=None):
+    """Like `maggtomic.query.compile_query`. Plans are cached alongside those of blocking queries."""
+    coll_hof = coll_hof or await current(db.main)
+    key = _plan_key(query_spec, coll_hof[1])
+    components = _plan_cache.get(key)
+    if components is None:
+        conditions = await compile_graph_pattern(
+            query_spec["where"],
+            use_prefixes=query_spec.get("prefixes"),
+            coll_hof=coll_hof,
+        )
+        if conditions is None:
+            return None
+        components = await plan_conditions(
+            conditions, coll_hof, bound=query_spec.get("params", ())
+        )
+        _plan_cache.set(key, components)
+    return components
+
+
+async def bind_args(query_spec, coll_hof=None):
+    params = query_spec.get("params")
+    if not params:
+        return None
+    coll_hof = coll_hof or await current(db.main)
+    arg_values, resources = _arg_values(query_spec)
+    oid_for = await _oids_for(list(resources), coll=coll_hof[1], create=False)
+    return _bindings_for_args(params, arg_values, resources, oid_for)
+
+
+async def query(query_spec, coll_hof=None, engine="python"):
+    """Like `maggtomic.query.query`, with coll_hof from e.g. `current`, `as_of`, or `since` in this module."""
+    return [r async for r in query_iter(query_spec, coll_hof=coll_hof, engine=engine)]
+
+
+async def query_iter(
+    query_spec, coll_hof=None, batch_size=QUERY_BATCH_SIZE, engine="python"
+):
+    """Like `maggtomic.query.query_iter`, as an asynchronous generator."""
+    if coll_hof is None:
+        coll_hof = await current(db.main)
+    components = await compile_query(query_spec, coll_hof=coll_hof)
+    if components is None:
+        return
+    seed = await bind_args(query_spec, coll_hof=coll_hof)
+    if engine == "python":
+        variables, rows = await planned_rows(components, coll_hof, seed=seed)
+    elif engine == "pipeline":
+        variables, rows = await pipeline_rows(components, coll_hof, seed=seed)
+    else:
+        raise ValueError(f"Unknown query engine {engine}")
+    if "select" in query_spec:
+        selected = [v for v in query_spec["select"] if v in variables]
+        row_of = _getter([variables.index(v) for v in selected])
+        rows = (row_of(row) async for row in rows)
+        variables = selected
+    batch = []
+    async for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            for result in await _formatted_batch(
+                variables, batch, query_spec, coll_hof
+            ):
+                yield result
+            batch = []
+    if batch:
+        for result in await _formatted_batch(variables, batch, query_spec, coll_hof):
+            yield result
+
+
+async def _formatted_batch(variables, rows, query_spec, coll_hof):
+    refs = await refs_for(_row_oids(rows), coll_hof=coll_hof)
+    return _formatted(variables, rows, refs, use_prefixes=query_spec.get("prefixes"))
@@ -5,10 +5,11 @@ from io import BytesIO
 
 import boto3
 from gridfs import GridFS
-from pymongo import MongoClient
 from toolz import keyfilter
 from tqdm import tqdm
 
+from maggtomic import Database
+
 AWS_PROFILE = os.getenv("AWS_PROFILE")
 S3_BUCKET = os.getenv("S3_BUCKET")
 S3_PREFIX = os.getenv("S3_PREFIX")
@@ -16,10 +17,35 @@ MONGO_HOST = os.getenv("MONGO_HOST")
 MONGO_PORT = int(os.getenv("MONGO_PORT", 27017))
 MONGO_DBNAME = os.getenv("MONGO_DBNAME")
 
-session = boto3.session.Session(profile_name=AWS_PROFILE)
-s3 = session.client("s3")
+# Connected on first use, once per process (see `maggtomic.Database`).
+db = Database(f"mongodb://{MONGO_HOST or 'localhost'}:{MONGO_PORT}", MONGO_DBNAME)
+
+FS_COLL_NAME = "s3_object_cache"
+
+_s3 = {}
+
+
+def s3_client():
+    """The S3 client of this process, created on first use, as boto3 sessions are not safe to share across a fork."""
+    pid = os.getpid()
+    if pid not in _s3:
+        _s3.clear()
+        _s3[pid] = boto3.session.Session(profile_name=AWS_PROFILE).client("s3")
+    return _s3[pid]
+
 
-if os.getenv("MOCK_S3_BUCKET"):
+def gridfs():
+    return GridFS(db.database, FS_COLL_NAME)
+
+
+_mock_imported = False
+
+
+def import_mock_s3_bucket():
+    """Load the mock S3 listing at MOCK_S3_BUCKET into the database, once per process."""
+    global _mock_imported
+    if _mock_imported:
+        return
     file = os.getenv("MOCK_S3_BUCKET")
     subprocess.run(
         [
@@ -38,17 +64,12 @@ if os.getenv("MOCK_S3_BUCKET"):
         ],
         check=True,
     )
-
-client = MongoClient(host=MONGO_HOST, port=MONGO_PORT)
-db = client[MONGO_DBNAME]
-
-FS_COLL_NAME = "s3_object_cache"
-fs = GridFS(db, FS_COLL_NAME)
-fs_filecoll = db[f"{FS_COLL_NAME}.files"]
+    _mock_imported = True
 
 
 def mock_key_ts_map_for(bucket_name=S3_BUCKET, prefix=S3_PREFIX):
     """Using local cache, given S3 bucket name and prefix, return map of {key: timestamp}."""
+    import_mock_s3_bucket()
     doc = db.s3_list_objects.find_one({"bucket": bucket_name, "prefix": prefix})
     return {entry["key"]: entry["ts"] for entry in doc["results"]}
 
@@ -59,6 +80,7 @@ def key_ts_map_for(bucket_name=S3_BUCKET, prefix=S3_PREFIX):
         return mock_key_ts_map_for(bucket_name, prefix)
 
     results = {}
+    s3 = s3_client()
 
     def one_round(continuation_token):
         if continuation_token:
@@ -90,12 +112,13 @@ def key_ts_map_for(bucket_name=S3_BUCKET, prefix=S3_PREFIX):
 def s3_key_value(key, ts, bucket=S3_BUCKET, refresh=False):
     filename = f"{bucket}/{key}"
     last_modified = ts.isoformat()
+    fs = gridfs()
     if refresh or not fs.exists(filename=filename, last_modified=last_modified):
         f = BytesIO()
-        s3.download_fileobj(bucket, key, f)
+        s3_client().download_fileobj(bucket, key, f)
         fs.put(f.getvalue(), filename=filename, last_modified=last_modified)
     last = fs.get_last_version(filename)
-    for past in fs_filecoll.find(
+    for past in db[f"{FS_COLL_NAME}.files"].find(
         {"filename": filename, "_id": {"$ne": last._id}}, ["_id"]
     ):
         fs.delete(past["_id"])
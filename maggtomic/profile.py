@@ -0,0 +1,179 @@
+"""Profiles of queries and transactions: time per phase, datoms per condition, and commands sent to the database.
+
+A profile is collected while it is active, i.e. during `query(..., profile=p)`, `transact(..., profile=p)`, or a
+`with profiling(p):` block, in the calling thread and in the fetch threads that it uses. Otherwise, instrumented code
+costs one thread-local lookup per phase or cursor, so profiling may be left enabled per call in production. Commands
+are counted via `command_counter`, which `maggtomic.Database` adds to its (blocking) clients.
+"""
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from pymongo import monitoring
+
+_local = threading.local()
+
+
+class Profile:
+    """Time per phase, stats per condition (i.e. per cursor over datoms), and counts of commands, by name.
+
+    Phases are "compile", "fetch" (waiting on cursors), "join", "refs", and "format" for a query, and "resolve",
+    "lookup", "insert", and "current" for a transaction. Phase times are summed across threads, so fetches done
+    concurrently may add up to more than the elapsed time.
+
+    Stats of a condition are its filter, the index hinted, the datoms returned, and the bindings after it was joined.
+    With `explain`, each cursor is also explained by the server, for the index used and the documents and keys examined
+    (see `explained`). As this runs each cursor's query again, it is for diagnosis rather than production.
+    """
+
+    def __init__(self, explain=False):
+        self.explain = explain
+        self.phases = defaultdict(float)
+        self.conditions = []
+        self.commands = Counter()
+        self._stats_for = {}
+        self._lock = threading.Lock()
+
+    def add_time(self, phase_name, seconds):
+        with self._lock:
+            self.phases[phase_name] += seconds
+
+    def add_condition(self, condition, **stats) -> dict:
+        """Add stats for condition, returning them to be updated in place."""
+        stats = dict(condition=condition, **stats)
+        with self._lock:
+            self.conditions.append(stats)
+            self._stats_for[id(condition)] = stats
+        return stats
+
+    def set_bindings(self, condition, n):
+        stats = self._stats_for.get(id(condition))
+        if stats is not None:
+            stats["bindings"] = n
+
+    def add_command(self, command_name):
+        with self._lock:
+            self.commands[command_name] += 1
+
+    @property
+    def round_trips(self):
+        return sum(self.commands.values())
+
+    def as_dict(self) -> dict:
+        return {
+            "phases": dict(self.phases),
+            "conditions": list(self.conditions),
+            "commands": dict(self.commands),
+            "round_trips": self.round_trips,
+        }
+
+
+def active():
+    """The profile active in this thread, or None."""
+    return getattr(_local, "profile", None)
+
+
+@contextmanager
+def profiling(profile: Profile = None):
+    """Activate profile (if not None) in this thread for the duration of the block."""
+    if profile is None:
+        yield
+        return
+    previous = active()
+    _local.profile = profile
+    try:
+        yield profile
+    finally:
+        _local.profile = previous
+
+
+@contextmanager
+def phase(phase_name):
+    """Add the time of the block to phase_name of the active profile, if any."""
+    profile = active()
+    if profile is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add_time(phase_name, time.perf_counter() - start)
+
+
+def propagating(call):
+    """Call, wrapped to run with the profile active in this thread (if any), e.g. in a fetch thread."""
+    profile = active()
+    if profile is None:
+        return call
+
+    def profiled():
+        with profiling(profile):
+            return call()
+
+    return profiled
+
+
+def fetched(profile: Profile, stats: dict, cursor):
+    """Yield from cursor, adding the time spent waiting on it to the "fetch" phase, and counting into stats."""
+    seconds, n = 0.0, 0
+    iterator = iter(cursor)
+    while True:
+        start = time.perf_counter()
+        doc = next(iterator, None)
+        seconds += time.perf_counter() - start
+        if doc is None:
+            break
+        n += 1
+        yield doc
+    stats["returned"] = n
+    profile.add_time("fetch", seconds)
+
+
+def _first(doc, key):
+    """The value of the first occurrence of key in nested documents and lists, or None."""
+    if isinstance(doc, dict):
+        if key in doc:
+            return doc[key]
+        children = doc.values()
+    elif isinstance(doc, list):
+        children = doc
+    else:
+        return None
+    for child in children:
+        found = _first(child, key)
+        if found is not None:
+            return found
+    return None
+
+
+def explained(explanation: dict) -> dict:
+    """The index used (None for a collection scan), and documents and keys examined, from a server's explanation.
+
+    Handles explanations of finds and of aggregations (whose first stage may hold the query's), across server versions.
+    """
+    planner = _first(explanation, "queryPlanner") or {}
+    return {
+        "index": _first(planner.get("winningPlan"), "indexName"),
+        "docs_examined": _first(explanation, "totalDocsExamined"),
+        "keys_examined": _first(explanation, "totalKeysExamined"),
+    }
+
+
+class CommandCounter(monitoring.CommandListener):
+    """Counts each command started in a thread with an active profile, i.e. each round-trip, into that profile."""
+
+    def started(self, event):
+        profile = active()
+        if profile is not None:
+            profile.add_command(event.command_name)
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+command_counter = CommandCounter()
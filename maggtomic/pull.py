@@ -0,0 +1,222 @@
+"""Pull entities as nested documents, one round-trip per level of nesting rather than per entity or attribute."""
+from typing import List
+
+from bson import ObjectId
+
+from maggtomic import (
+    E,
+    A,
+    V,
+    OID_QUDT_VALUE,
+    OID_URIREF,
+    OID_VAEM_ID,
+    _oids_for,
+    current,
+    db as mdb,
+    prefix_expand,
+)
+from maggtomic.query import find_datoms, prefix_compact, refs_for
+from maggtomic.util import decode_id, encode_id
+
+# Attributes that every pulled entity is fetched with: those that identify it, and qudt:value for structured literals.
+CORE_ATTRIBUTE_OIDS = frozenset([OID_URIREF, OID_VAEM_ID, OID_QUDT_VALUE])
+
+
+def _spec(wildcard=False, attrs=None):
+    return {"wildcard": wildcard, "attrs": attrs or {}}
+
+
+# Pattern for ObjectId values not pulled by a nested pattern: enough to tell a structured literal from a ref.
+_LITERAL_SPEC = _spec()
+
+
+def _pattern_attributes(pattern) -> set:
+    names = set()
+    for item in pattern:
+        if isinstance(item, dict):
+            for name, subpattern in item.items():
+                names.add(name)
+                names |= _pattern_attributes(subpattern)
+        elif item != "*":
+            names.add(item)
+    return names
+
+
+def _compile_pattern(pattern, oid_for: dict) -> dict:
+    """Compile a pull pattern to a spec, i.e. whether it has a wildcard, and a map of attribute ObjectIds to subspecs.
+
+    Attributes unknown to the collection are omitted, as no entity can have them.
+    """
+    spec = _spec()
+    for item in pattern:
+        if item == "*":
+            spec["wildcard"] = True
+        elif isinstance(item, str):
+            if item in oid_for:
+                spec["attrs"].setdefault(oid_for[item], None)
+        elif isinstance(item, dict):
+            for name, subpattern in item.items():
+                if name in oid_for:
+                    spec["attrs"][oid_for[name]] = _compile_pattern(subpattern, oid_for)
+        else:
+            raise ValueError(f"Unsupported pull pattern item {item}")
+    return spec
+
+
+def _merge_specs(spec1, spec2):
+    """A spec for everything that either of two specs pulls."""
+    if spec1 is None or spec2 is None:
+        return spec1 or spec2
+    attrs = dict(spec1["attrs"])
+    for a, sub in spec2["attrs"].items():
+        attrs[a] = _merge_specs(attrs[a], sub) if a in attrs else sub
+    return _spec(spec1["wildcard"] or spec2["wildcard"], attrs)
+
+
+def _needed_attributes(spec):
+    """ObjectIds of the attributes to fetch for an entity pulled with spec, or None for all of them."""
+    if spec["wildcard"]:
+        return None
+    return CORE_ATTRIBUTE_OIDS | set(spec["attrs"])
+
+
+def _entity_oids(entities, coll_hof, use_prefixes=None) -> List[ObjectId]:
+    """Resolve entities, each an ObjectId, a (compact) URI, or a local ID ("_:" then vaem:id), read-only."""
+    uris = [e for e in entities if isinstance(e, str) and not e.startswith("_:")]
+    expanded = dict(zip(uris, prefix_expand(uris, use_prefixes=use_prefixes)))
+    oid_for = _oids_for(list(set(expanded.values())), coll=coll_hof[1], create=False)
+    local_ids = {
+        decode_id(e[2:]): e
+        for e in entities
+        if isinstance(e, str) and e.startswith("_:")
+    }
+    if local_ids:
+        filter_ = {A: OID_VAEM_ID, V: {"$in": list(local_ids)}}
+        for d in find_datoms(filter_, coll_hof):
+            oid_for[local_ids[d[V]]] = d[E]
+    return [
+        e if isinstance(e, ObjectId) else oid_for.get(expanded.get(e, e))
+        for e in entities
+    ]
+
+
+def _fetch(level: dict, fetched: dict, fetched_attrs: dict, coll_hof):
+    """Fetch, with one query, the datoms of the entities of a level (a map of ObjectIds to specs) not yet fetched."""
+    to_fetch = {}
+    for oid, spec in level.items():
+        needed, have = _needed_attributes(spec), fetched_attrs.get(oid, set())
+        if have is not None and (needed is None or not needed <= have):
+            to_fetch[oid] = None if needed is None else needed | have
+    if not to_fetch:
+        return
+    filter_ = {E: {"$in": list(to_fetch)}}
+    if all(needed is not None for needed in to_fetch.values()):
+        filter_[A] = {"$in": list(set().union(*to_fetch.values()))}
+    for oid, needed in to_fetch.items():
+        fetched[oid] = []
+        fetched_attrs[oid] = needed
+    for d in find_datoms(filter_, coll_hof):
+        fetched[d[E]].append((d[A], d[V]))
+
+
+def _children(oid, spec, fetched) -> dict:
+    children = {}
+    for a, v in fetched[oid]:
+        if isinstance(v, ObjectId) and (spec["wildcard"] or a in spec["attrs"]):
+            child_spec = spec["attrs"].get(a) or _LITERAL_SPEC
+            children[v] = _merge_specs(children.get(v), child_spec)
+    return children
+
+
+def _ref(datoms):
+    ref = None
+    for a, v in datoms:
+        if a == OID_URIREF:
+            return v
+        if a == OID_VAEM_ID:
+            ref = "_:" + encode_id(v)
+    return ref
+
+
+def _literal(datoms):
+    return next((v for a, v in datoms if a == OID_QUDT_VALUE), None)
+
+
+def _assemble(oid, spec, fetched, names):
+    out = {"@id": names.get(_ref(fetched[oid]))}
+    for a, v in fetched[oid]:
+        if a in CORE_ATTRIBUTE_OIDS and a not in spec["attrs"]:
+            continue
+        if not (spec["wildcard"] or a in spec["attrs"]):
+            continue
+        if isinstance(v, ObjectId) and a != OID_QUDT_VALUE:
+            subspec = spec["attrs"].get(a)
+            if subspec is not None:
+                v = _assemble(v, subspec, fetched, names)
+            elif _literal(fetched[v]) is not None:
+                v = _literal(fetched[v])
+            else:
+                v = names.get(_ref(fetched[v]))
+        out.setdefault(names[a], []).append(v)
+    return out
+
+
+def pull_many(entities, pattern, coll_hof=None, use_prefixes=None) -> list:
+    """Pull many entities as nested documents, as per pattern.
+
+    :param entities: each an ObjectId, a (compact) URI, or a local ID ("_:" then its encoded vaem:id).
+
+    :param pattern: a list of items, each
+      - an attribute (compact) URI, to pull that attribute,
+      - "*", to pull every attribute, or
+      - a dict mapping an attribute to a (nested) pattern, to pull that attribute's (entity) values as documents.
+
+    :param coll_hof: a collection higher-order filter, e.g. from `current` or `as_of`.
+
+    :returns: for each entity, a dict of its "@id" (its ref) and of each pulled attribute to the list of its values, or
+      None if the entity has no datoms. Values that are refs to entities not pulled by a nested pattern are given as
+      refs, except for structured literals, which are given as their qudt:value.
+
+    Entities are fetched level by level, i.e. one query for all entities, one for all of their values that are refs,
+    and so on, each hinted to the EAV index.
+    """
+    coll_hof = coll_hof or current(mdb.main)
+    names_in_pattern = list(_pattern_attributes(pattern))
+    expanded = dict(
+        zip(names_in_pattern, prefix_expand(names_in_pattern, use_prefixes))
+    )
+    oid_for_expanded = _oids_for(
+        list(set(expanded.values())), coll=coll_hof[1], create=False
+    )
+    oid_for = {
+        name: oid_for_expanded[uri]
+        for name, uri in expanded.items()
+        if uri in oid_for_expanded
+    }
+    spec = _compile_pattern(pattern, oid_for)
+    oids = _entity_oids(entities, coll_hof, use_prefixes=use_prefixes)
+    level = {}
+    for oid in oids:
+        if oid is not None:
+            level[oid] = _merge_specs(level.get(oid), spec)
+    fetched, fetched_attrs = {}, {}
+    while level:
+        _fetch(level, fetched, fetched_attrs, coll_hof)
+        next_level = {}
+        for oid, oid_spec in level.items():
+            for child, child_spec in _children(oid, oid_spec, fetched).items():
+                next_level[child] = _merge_specs(next_level.get(child), child_spec)
+        level = next_level
+    attributes = list({a for datoms in fetched.values() for a, _ in datoms})
+    names = refs_for(attributes, coll_hof=coll_hof)
+    names.update({ref: ref for ref in map(_ref, fetched.values()) if ref is not None})
+    names = prefix_compact([names], use_prefixes=use_prefixes)[0]
+    return [
+        _assemble(oid, spec, fetched, names) if fetched.get(oid) else None
+        for oid in oids
+    ]
+
+
+def pull(entity, pattern, coll_hof=None, use_prefixes=None):
+    """Pull one entity as a nested document (see `pull_many`)."""
+    return pull_many([entity], pattern, coll_hof=coll_hof, use_prefixes=use_prefixes)[0]
@@ -1,32 +1,60 @@
+import os
 import re
-from datetime import datetime, timezone
-from copy import copy
 import functools
 import itertools
+import operator
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import List
 
 from bson import ObjectId
 from pydash import py_
+from toolz import merge, partition_all
 
 from maggtomic import (
     prefix_expand,
-    as_of,
+    current,
     db as mdb,
     _oids_for,
+    _oids_cache,
+    LRUCache,
     E,
     A,
     V,
     OID_URIREF,
     OID_VAEM_ID,
-    PREFIXES,
+    prefix_registry,
     URI_BEGINNING_PATTERN,
 )
+from maggtomic.profile import (
+    Profile,
+    active,
+    explained,
+    fetched,
+    phase,
+    profiling,
+    propagating,
+)
 from maggtomic.util import encode_id
 
 
 def compile_graph_pattern(graph_pattern, use_prefixes=None, coll_hof=None):
-    """prefix_expand and get oids_for terms, so can pass result to cursor_for"""
-    coll_hof = coll_hof or as_of(mdb.main, datetime.now(tz=timezone.utc))
+    """prefix_expand and get oids_for terms, so can pass result to cursor_for.
+
+    Terms are only looked up, never created. Returns None if some term is unknown to the collection, as then no datom
+    can satisfy the graph pattern.
+    """
+    coll_hof = coll_hof or current(mdb.main)
+    expanded_resource = _graph_pattern_constants(graph_pattern, use_prefixes)
+    expanded_resource_oid = _oids_for(
+        list(expanded_resource.values()), coll=coll_hof[1], create=False
+    )
+    return _with_constant_oids(graph_pattern, expanded_resource, expanded_resource_oid)
+
+
+def _graph_pattern_constants(graph_pattern, use_prefixes=None):
+    """Map each constant term in graph_pattern to its prefix expansion."""
     if not all(isinstance(line, list) for line in graph_pattern):
         raise ValueError("graph_pattern must be an iterable of lists/tuples")
     expanded_resource = {}
@@ -35,13 +63,12 @@ def compile_graph_pattern(graph_pattern, use_prefixes=None, coll_hof=None):
         for (i, spec), field in zip(enumerate(expanded_line), (E, A, V)):
             if isinstance(spec, str) and not spec.startswith("?"):
                 expanded_resource[line[i]] = spec
-    # TODO Needs access to full underlying collection, not just filter-extendable cursor,
-    #  because may need to create new objectIds for new resources. Should be able to short-circuit
-    #  this for the case of queries because resources without objectIds will not satisfy any query
-    #  conditions. Low priority, but would enable removal of direct access to collection.
-    expanded_resource_oid = _oids_for(
-        list(expanded_resource.values()), coll=coll_hof[1]
-    )
+    return expanded_resource
+
+
+def _with_constant_oids(graph_pattern, expanded_resource, expanded_resource_oid):
+    if set(expanded_resource.values()) - set(expanded_resource_oid):
+        return None
     oid_for = {
         r: expanded_resource_oid[expanded_resource[r]] for r in expanded_resource.keys()
     }
@@ -54,18 +81,106 @@ def compile_graph_pattern(graph_pattern, use_prefixes=None, coll_hof=None):
     return out
 
 
-def cursor_for(condition, coll_hof):
+def variable_fields(condition):
+    """Map each variable name in a condition to the datom field it occupies."""
+    fields = {}
+    for spec, field in zip(condition, (E, A, V)):
+        if isinstance(spec, dict):
+            spec = list(spec.keys())[0]
+        if isinstance(spec, str) and spec.startswith("?"):
+            fields[spec] = field
+    return fields
+
+
+def _restricted_to(spec_filter, values):
+    """Add an `$in` restriction to a field filter, if it is an operator expression that lacks one."""
+    if (
+        isinstance(spec_filter, dict)
+        and all(k.startswith("$") for k in spec_filter)
+        and "$in" not in spec_filter
+    ):
+        return merge(spec_filter, {"$in": values})
+    return spec_filter
+
+
+def filter_for(condition, bound=None):
+    """Returns a filter for datoms that satisfy condition in isolation.
+
+    `bound` optionally maps variable names to lists of values already bound to them by other conditions. A variable in
+    `bound` restricts its datom field to those values via `$in`, so that only datoms that can join are fetched.
+
+    """
+    bound = bound or {}
     filter_ = {}
     for spec, field in zip(condition, (E, A, V)):
         if isinstance(spec, dict):
-            filter_[field] = list(spec.values())[0]
+            var, spec_filter = list(spec.items())[0]
+            filter_[field] = (
+                _restricted_to(spec_filter, bound[var]) if var in bound else spec_filter
+            )
         elif isinstance(spec, ObjectId):
             filter_[field] = spec
         elif isinstance(spec, str) and not spec.startswith("?"):
             filter_[field] = spec
-        elif not isinstance(spec, str):
+        elif isinstance(spec, str):
+            if spec in bound:
+                filter_[field] = {"$in": bound[spec]}
+        else:
             raise ValueError(f"Unsupported type {type(spec)} for spec")
-    return coll_hof[0](filter_)
+    return filter_
+
+
+# Projection of datoms to the fields needed to bind conditions, so that cursors may be covered by an index.
+DATOM_PROJECTION = {"_id": 0, E: 1, A: 1, V: 1}
+
+
+def _constrains(field_filter):
+    return not (isinstance(field_filter, dict) and not field_filter)
+
+
+def index_for(filter_):
+    """The order of datom fields of the index that best serves filter_, given which fields it constrains.
+
+    Returns None if no index leads with a constrained field. The VAE index is partial, covering only ObjectId values,
+    so it is chosen only for values that are all ObjectIds (see `_for_partial_vae`).
+    """
+    constrained = {f for f, f_filter in filter_.items() if _constrains(f_filter)}
+    if E in constrained:
+        return "EAV"
+    if A in constrained:
+        return "AVE" if V in constrained else "AEV"
+    if V in constrained and _for_partial_vae(filter_[V]) is not None:
+        return "VAE"
+    return None
+
+
+def _for_partial_vae(v_filter):
+    """Restate a filter on values, if it admits only ObjectIds, such that it implies the VAE index's partial filter."""
+    if isinstance(v_filter, ObjectId):
+        return {"$eq": v_filter, "$type": "objectId"}
+    if (
+        isinstance(v_filter, dict)
+        and set(v_filter) == {"$in"}
+        and all(isinstance(v, ObjectId) for v in v_filter["$in"])
+    ):
+        return {"$in": v_filter["$in"], "$type": "objectId"}
+    return None
+
+
+def find_datoms(filter_, coll_hof, batch_size=None):
+    """Cursor over datoms matching filter_, hinted to the best index and projected to e, a, and v."""
+    index = index_for(filter_)
+    if index == "VAE":
+        filter_ = merge(filter_, {V: _for_partial_vae(filter_[V])})
+    return coll_hof[0](
+        filter_, index=index, projection=DATOM_PROJECTION, batch_size=batch_size
+    )
+
+
+def cursor_for(condition, coll_hof, bound=None, batch_size=None):
+    return find_datoms(
+        filter_for(condition, bound=bound), coll_hof, batch_size=batch_size
+    )
 
 
 def get_doc_binder(condition):
@@ -87,124 +202,875 @@ def get_doc_binder(condition):
     return doc_binding
 
 
+def binding_variables(bindings):
+    """Variable names bound in a collection of bindings.
+
+    Every binding in a collection binds the same variables, so the first binding is representative.
+    """
+    if isinstance(bindings, Bindings):
+        return set(bindings.variables)
+    return set(bindings[0]) if bindings else set()
+
+
+class Bindings:
+    """A collection of bindings of the same variables, held compactly as rows.
+
+    A row is a tuple of the values of `variables`, in order. Joins build rows by concatenating tuples, so values are
+    shared among rows rather than copied into a dict per binding. Dicts are made only for output (see `dicts`).
+    """
+
+    __slots__ = ("variables", "rows")
+
+    def __init__(self, variables=(), rows=None):
+        self.variables = tuple(variables)
+        self.rows = [] if rows is None else rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    @classmethod
+    def from_dicts(cls, bindings):
+        variables = tuple(bindings[0]) if bindings else ()
+        return cls(variables, [tuple(b[var] for var in variables) for b in bindings])
+
+    def dicts(self):
+        return [dict(zip(self.variables, row)) for row in self.rows]
+
+
+# The collection of the one binding of no variables, i.e. the identity for joins.
+_UNIT = Bindings((), [()])
+
+
+def _getter(keys):
+    """Function of a row (or document) to the tuple of its values at keys."""
+    if not keys:
+        return lambda row: ()
+    if len(keys) == 1:
+        key = keys[0]
+        return lambda row: (row[key],)
+    return operator.itemgetter(*keys)
+
+
+def _row_reader(condition):
+    """The variables of condition, and a function of a datom to the row of their values, or None if it has none."""
+    fields = variable_fields(condition)
+    if not fields:
+        return None
+    return tuple(fields), _getter(list(fields.values()))
+
+
+def _stream_join(build: Bindings, stream_variables):
+    """Prepare to join bindings with a stream of rows of stream_variables, as the stream is consumed.
+
+    Only a hash table of `build`, keyed by the values of the shared variables, is held in memory.
+
+    :returns: the joined variables, i.e. build's and then the stream's others, and a function of a streamed row to its
+      joined rows.
+    """
+    shared = [var for var in build.variables if var in stream_variables]
+    extra = [i for i, var in enumerate(stream_variables) if var not in build.variables]
+    variables = build.variables + tuple(stream_variables[i] for i in extra)
+    build_key = _getter([build.variables.index(var) for var in shared])
+    stream_key = _getter([stream_variables.index(var) for var in shared])
+    stream_extra = _getter(extra)
+    table = defaultdict(list)
+    for row in build.rows:
+        table[build_key(row)].append(row)
+
+    def joined(row):
+        return [b + stream_extra(row) for b in table.get(stream_key(row), ())]
+
+    return variables, joined
+
+
+def _join(left: Bindings, right: Bindings) -> Bindings:
+    """Hash-join two collections of bindings on their shared variables, building on the smaller one.
+
+    Collections that share no variables are combined via their cross product.
+    """
+    if len(left) > len(right):
+        left, right = right, left
+    variables, joined = _stream_join(left, right.variables)
+    return Bindings(variables, [row for r in right.rows for row in joined(r)])
+
+
+def _join_all(collections) -> Bindings:
+    """Join many collections of bindings, deferring cross products until last.
+
+    Starting from the smallest collection, repeatedly joins the smallest remaining collection that shares a variable
+    with what has been joined so far. When no remaining collection shares a variable, the joined collection is set
+    aside and joining restarts from the smallest remaining collection. The set-aside (i.e., mutually independent)
+    results are finally combined via their cross product, smallest first.
+
+    """
+    if not collections or not all(collections):
+        return Bindings()
+    pending = sorted(collections, key=len)
+    independent = []
+    joined = pending.pop(0)
+    while pending:
+        bound = set(joined.variables)
+        i = next((i for i, b in enumerate(pending) if bound & set(b.variables)), None)
+        if i is None:
+            independent.append(joined)
+            joined = pending.pop(0)
+        else:
+            joined = _join(joined, pending.pop(i))
+        if not joined:
+            return joined
+    independent.append(joined)
+    return functools.reduce(_join, sorted(independent, key=len))
+
+
 def merge_binding_collections(bindings1, bindings2):
-    merged = []
-    for (b1, b2) in itertools.product(bindings1, bindings2):
-        no_good = False
-        new_binding = copy(b1)
-        for k, v in b2.items():
-            if k in new_binding and v != new_binding[k]:
-                no_good = True
+    """Join two collections of bindings (each a list of dicts) on their shared variables.
+
+    A hash table keyed by the values of the shared variables is built from the smaller collection and probed with each
+    binding of the larger one, so cost is linear in the sizes of the inputs and of the output. Collections that share
+    no variables are combined via their cross product.
+
+    """
+    if not bindings1 or not bindings2:
+        return []
+    return _join(Bindings.from_dicts(bindings1), Bindings.from_dicts(bindings2)).dicts()
+
+
+# Cap on the number of datoms counted to estimate the size of a condition's result.
+ESTIMATE_LIMIT = 10000
+
+# Heuristic selectivity of each bound datom field, used to estimate the size of a condition's result when not
+# consulting index statistics: a bound entity is more selective than a bound value, which in turn is more selective
+# than a bound attribute.
+BOUND_FIELD_SELECTIVITY = {E: 1000, V: 100, A: 10}
+
+# Cap on the number of distinct values bound to a variable that are pushed down to a cursor as an `$in` filter.
+# Beyond it, datoms are fetched without restriction on that variable and are filtered by the join instead.
+MAX_PUSHDOWN_VALUES = 10000
+
+
+# Number of threads that fetch datoms concurrently, e.g. for conditions that share no variables. With 1 (or fewer),
+# fetches are run one after another in the calling thread.
+FETCH_THREADS = int(os.getenv("MAGGTOMIC_FETCH_THREADS", 8))
+
+_fetch_executor = None
+
+
+def set_fetch_threads(n: int):
+    """Resize the pool of threads that fetch datoms concurrently (see FETCH_THREADS)."""
+    global FETCH_THREADS, _fetch_executor
+    FETCH_THREADS = n
+    if _fetch_executor is not None:
+        _fetch_executor.shutdown(wait=False)
+        _fetch_executor = None
+
+
+def _fetch_pool():
+    global _fetch_executor
+    if _fetch_executor is None:
+        _fetch_executor = ThreadPoolExecutor(
+            max_workers=FETCH_THREADS, thread_name_prefix="maggtomic-fetch"
+        )
+    return _fetch_executor
+
+
+def fetch_concurrently(calls):
+    """Run calls, i.e. functions of no arguments, concurrently in the fetch pool.
+
+    Yields (i, result) pairs as calls complete, where i is the index of the call. If the consumer stops early, calls
+    not yet started are cancelled. Calls run with the caller's active profile, if any (see `maggtomic.profile`).
+    """
+    if FETCH_THREADS <= 1 or len(calls) <= 1:
+        for i, call in enumerate(calls):
+            yield i, call()
+        return
+    futures = {
+        _fetch_pool().submit(propagating(call)): i for i, call in enumerate(calls)
+    }
+    try:
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+def _fetch_all(calls):
+    """Results of calls, in order, run as per `fetch_concurrently`."""
+    results = [None] * len(calls)
+    for i, result in fetch_concurrently(calls):
+        results[i] = result
+    return results
+
+
+def estimate_size(condition, coll_hof, use_stats=True):
+    """Estimate the number of datoms that satisfy condition in isolation.
+
+    With `use_stats`, counts (up to ESTIMATE_LIMIT) matching datoms via the collection's indexes. Otherwise, scores the
+    condition by which of its fields are bound, according to BOUND_FIELD_SELECTIVITY.
+
+    """
+    filter_ = filter_for(condition)
+    if use_stats:
+        return coll_hof[1].count_documents(filter_, limit=ESTIMATE_LIMIT)
+    selectivity = 1
+    for field in filter_:
+        selectivity *= BOUND_FIELD_SELECTIVITY[field]
+    return ESTIMATE_LIMIT / selectivity
+
+
+def plan_conditions(conditions, coll_hof, use_stats=True, bound=()):
+    """Order conditions for evaluation with bound-variable pushdown.
+
+    Conditions are grouped into components that are connected via shared variables. Each component is ordered
+    greedily: first its condition with the smallest estimated size (see `estimate_size`), then, repeatedly, the
+    smallest remaining condition that shares a variable with those already ordered, so that it may be restricted to
+    already-bound values. Components are returned in order of their smallest estimated size, so that an empty component
+    is found as early as possible.
+
+    If variables are `bound` before evaluation (e.g., query parameters), the first component is that of the conditions
+    connected to them, and it may be empty.
+
+    :returns: a list of components, each a list of conditions.
+    """
+    if use_stats:
+        estimates = _fetch_all(
+            [functools.partial(estimate_size, c, coll_hof) for c in conditions]
+        )
+    else:
+        estimates = [estimate_size(c, coll_hof, use_stats=False) for c in conditions]
+    return _plan_components(conditions, estimates, bound=bound)
+
+
+def _plan_components(conditions, estimates, bound=()):
+    """Group and order conditions as per `plan_conditions`, given their estimated sizes."""
+    remaining = sorted(range(len(conditions)), key=lambda i: estimates[i])
+    components = []
+    bound = set(bound)
+    while remaining or bound:
+        if bound:
+            component = []
+        else:
+            component = [remaining.pop(0)]
+            bound = set(variable_fields(conditions[component[0]]))
+        while True:
+            i = next(
+                (i for i in remaining if set(variable_fields(conditions[i])) & bound),
+                None,
+            )
+            if i is None:
                 break
-            else:
-                new_binding[k] = v
-        if no_good:
-            continue
+            remaining.remove(i)
+            component.append(i)
+            bound |= set(variable_fields(conditions[i]))
+        components.append([conditions[i] for i in component])
+        bound = set()
+    return components
+
+
+def bound_values(bindings, variables):
+    """Distinct values bound to each of variables in bindings, omitting variables with too many to push down."""
+    if not isinstance(bindings, Bindings):
+        bindings = Bindings.from_dicts(bindings)
+    bound = {}
+    for var in set(variables) & set(bindings.variables):
+        i = bindings.variables.index(var)
+        values = list({row[i] for row in bindings.rows})
+        if len(values) <= MAX_PUSHDOWN_VALUES:
+            bound[var] = values
+    return bound
+
+
+def _exists(condition, coll_hof):
+    """Whether some datom satisfies condition."""
+    return next(iter(cursor_for(condition, coll_hof, batch_size=1)), None) is not None
+
+
+def _iter_rows_for(condition, coll_hof, bound=None):
+    """Rows of the values of condition's variables for each datom that satisfies it (see `_row_reader`).
+
+    A ground condition, i.e. one without variables, yields one empty row if some datom satisfies it, and none otherwise.
+    """
+    reader = _row_reader(condition)
+    if reader is None:
+        if _exists(condition, coll_hof):
+            yield ()
+        return
+    _, row_of = reader
+    profile = active()
+    if profile is None:
+        for doc in cursor_for(condition, coll_hof, bound=bound):
+            yield row_of(doc)
+        return
+    filter_ = filter_for(condition, bound=bound)
+    index = index_for(filter_)
+    stats = profile.add_condition(condition, filter=filter_, index_hinted=index)
+    for doc in fetched(profile, stats, find_datoms(filter_, coll_hof)):
+        yield row_of(doc)
+    if profile.explain:
+        if index == "VAE":
+            filter_ = merge(filter_, {V: _for_partial_vae(filter_[V])})
+        explanation = coll_hof[0].explain(filter_, index, projection=DATOM_PROJECTION)
+        stats.update(explained(explanation))
+
+
+def _rows_for(condition, coll_hof, bound=None) -> Bindings:
+    return Bindings(
+        tuple(variable_fields(condition)),
+        list(_iter_rows_for(condition, coll_hof, bound=bound)),
+    )
+
+
+def _join_component(component, coll_hof, joined=None):
+    profile = active()
+    for c in component:
+        if joined is None:
+            joined = _rows_for(c, coll_hof)
         else:
-            merged.append(new_binding)
-    return merged
+            bound = bound_values(joined, variable_fields(c))
+            rows = _rows_for(c, coll_hof, bound=bound)
+            with phase("join"):
+                joined = _join(joined, rows)
+        if profile is not None:
+            profile.set_bindings(c, len(joined))
+        if not joined:
+            return joined
+    return joined
+
 
+def get_valid_bindings(conditions, coll_hof, use_stats=True, seed=None):
+    """Bindings that satisfy all conditions.
 
-def get_valid_bindings(conditions, coll_hof):
-    condition_bindings = []
-    for c in conditions:
-        bindings = []
-        doc_binding = get_doc_binder(c)
-        for doc in cursor_for(c, coll_hof):
-            binding = doc_binding(doc)
-            if binding is not None:
-                bindings.append(binding)
-        condition_bindings.append(bindings)
-    valid_bindings = functools.reduce(merge_binding_collections, condition_bindings)
-    return valid_bindings
+    Conditions are evaluated in the order given by `plan_conditions`. Within a component of conditions connected via
+    shared variables, each condition's cursor is restricted to values bound by the conditions evaluated before it.
+
+    `seed` optionally gives bindings of variables before evaluation, e.g. of query parameters to their arguments.
+
+    """
+    return list(
+        iter_valid_bindings(conditions, coll_hof, use_stats=use_stats, seed=seed)
+    )
+
+
+def iter_valid_bindings(conditions, coll_hof, use_stats=True, seed=None):
+    """Like get_valid_bindings, but yields bindings lazily (see `iter_planned_bindings`)."""
+    components = plan_conditions(
+        conditions, coll_hof, use_stats=use_stats, bound=binding_variables(seed)
+    )
+    return iter_planned_bindings(components, coll_hof, seed=seed)
+
+
+def _as_bindings(seed):
+    if seed is None or isinstance(seed, Bindings):
+        return seed
+    return Bindings.from_dicts(seed)
+
+
+def iter_planned_bindings(components, coll_hof, seed=None):
+    """Yield bindings that satisfy planned components of conditions (see `plan_conditions`), as dicts.
+
+    See `planned_rows`, which this wraps.
+    """
+    variables, rows = planned_rows(components, coll_hof, seed=seed)
+    for row in rows:
+        yield dict(zip(variables, row))
+
+
+def _component_calls(components, coll_hof, seed=None):
+    """Calls that evaluate all planned components but the last, and all but the last condition of the last."""
+    starts = [seed] + [None] * (len(components) - 1)
+    return [
+        functools.partial(_join_component, component, coll_hof, joined=start)
+        for component, start in zip(components[:-1] + [components[-1][:-1]], starts)
+    ]
+
+
+def planned_rows(components, coll_hof, seed=None):
+    """Evaluate planned components of conditions (see `plan_conditions`), as rows (see `Bindings`).
+
+    Every condition but the last one planned is evaluated and joined up front. The datoms of the last condition are
+    then streamed from its cursor, and each is joined with the rest as it arrives, so that the full result is never
+    materialized.
+
+    Components share no variables, so they are evaluated concurrently (see `fetch_concurrently`), and evaluation stops
+    as soon as any of them is found to be empty.
+
+    If given, `seed` bindings (a list of dicts, or `Bindings`) start the join of the first component.
+
+    :returns: the variables bound, and an iterator of rows of their values.
+    """
+    seed = _as_bindings(seed)
+    if not components or (seed is not None and not seed):
+        return (), iter(())
+    results = [None] * len(components)
+    for i, result in fetch_concurrently(_component_calls(components, coll_hof, seed)):
+        if result is not None and not result:
+            return (), iter(())
+        results[i] = result
+    *independent, joined = results
+    with phase("join"):
+        rest = _join_all(independent) if independent else _UNIT
+    if not rest:
+        return (), iter(())
+    variables, rows = _final_rows(components[-1], coll_hof, joined)
+    return rest.variables + variables, (r + row for row in rows for r in rest.rows)
+
+
+def _final_rows(final, coll_hof, joined):
+    """Stream the last condition of the final component, joined with the rest of that component as it arrives."""
+    joined = _UNIT if joined is None else joined
+    if not final:
+        return joined.variables, iter(joined.rows)
+    last_variables = tuple(variable_fields(final[-1]))
+    stream = _iter_rows_for(
+        final[-1], coll_hof, bound=bound_values(joined, last_variables)
+    )
+    variables, join = _stream_join(joined, last_variables)
+    profile = active()
+    if profile is not None:
+        return variables, _profiled_join(profile, final[-1], stream, join)
+    return variables, (row for s in stream for row in join(s))
+
+
+def _profiled_join(profile: Profile, condition, stream, join):
+    """Join a stream of rows as per `_final_rows`, adding time to the "join" phase and the bindings to condition's."""
+    seconds, n = 0.0, 0
+    for s in stream:
+        start = time.perf_counter()
+        rows = join(s)
+        seconds += time.perf_counter() - start
+        n += len(rows)
+        yield from rows
+    profile.add_time("join", seconds)
+    profile.set_bindings(condition, n)
+
+
+def compile_pipeline(components, coll_hof, seed=None):
+    """Translate planned components of conditions into one aggregation pipeline over the data source.
+
+    The first condition's datoms are matched directly. Each later condition is joined via a `$lookup` of its datoms from
+    the same source collection, correlated on the variables it shares with earlier conditions (if any) and then
+    unwound, so that only joined rows leave the server. Datoms are produced as per the data source's higher-order
+    filter (see `DatomFilter.stages_for`), e.g. with as_of's basis and resolution of retractions. Variables bound by
+    `seed` restrict their fields via `$in`, as with the Python engine.
+
+    :returns: the pipeline, and a map of variable names to the fields of pipeline output documents that hold them.
+    """
+    docs_for = coll_hof[0]
+    seed = _as_bindings(seed)
+    seed_values = bound_values(seed, seed.variables) if seed else {}
+    fields = {}
+    pipeline = []
+    for c in [c for component in components for c in component]:
+        var_fields = variable_fields(c)
+        stages = docs_for.stages_for(filter_for(c, bound=seed_values))
+        shared = [var for var in var_fields if var in fields]
+        new = [var for var in var_fields if var not in fields]
+        fields.update({var: f"b{len(fields) + i}" for i, var in enumerate(new)})
+        if not pipeline:
+            pipeline = stages + [
+                {
+                    "$project": merge(
+                        {"_id": 0}, {fields[var]: f"${var_fields[var]}" for var in new}
+                    )
+                }
+            ]
+            continue
+        if shared:
+            stages[0]["$match"]["$expr"] = {
+                "$and": [
+                    {"$eq": [f"${var_fields[var]}", f"$${fields[var]}"]}
+                    for var in shared
+                ]
+            }
+        pipeline.extend(
+            [
+                {
+                    "$lookup": {
+                        "from": docs_for.source.name,
+                        "let": {fields[var]: f"${fields[var]}" for var in shared},
+                        "pipeline": stages
+                        + [{"$project": {"_id": 0, E: 1, A: 1, V: 1}}],
+                        "as": "_datom",
+                    }
+                },
+                {"$unwind": "$_datom"},
+                {
+                    "$project": merge(
+                        {"_id": 0},
+                        {fields[var]: 1 for var in fields if var not in new},
+                        {fields[var]: f"$_datom.{var_fields[var]}" for var in new},
+                    )
+                },
+            ]
+        )
+    return pipeline, fields
+
+
+def iter_pipeline_bindings(components, coll_hof, seed=None, batch_size=None):
+    """Like iter_planned_bindings, but joins conditions on the server (see `pipeline_rows`)."""
+    variables, rows = pipeline_rows(
+        components, coll_hof, seed=seed, batch_size=batch_size
+    )
+    for row in rows:
+        yield dict(zip(variables, row))
+
+
+def pipeline_rows(components, coll_hof, seed=None, batch_size=None):
+    """Like planned_rows, but joins conditions on the server, via the pipeline from `compile_pipeline`.
+
+    Seed bindings are joined with the pipeline's output as it is streamed, which also restores any combinations of
+    seed values that the per-variable `$in` restrictions admit too broadly.
+    """
+    seed = _as_bindings(seed)
+    conditions = [c for component in components for c in component]
+    if not conditions or (seed is not None and not seed):
+        return (), iter(())
+    ground = [c for c in conditions if not variable_fields(c)]
+    if ground:
+        # Ground conditions only test for existence, so they are checked up front rather than joined on the server.
+        if not all(_exists(c, coll_hof) for c in ground):
+            return (), iter(())
+        components = [
+            [c for c in component if variable_fields(c)] for component in components
+        ]
+        components = [component for component in components if component]
+        if not components:
+            seed = _UNIT if seed is None else seed
+            return seed.variables, iter(seed.rows)
+    pipeline, fields = compile_pipeline(components, coll_hof, seed=seed)
+    options = {"batchSize": batch_size} if batch_size else {}
+    source = coll_hof[0].source
+    docs = source.aggregate(pipeline, allowDiskUse=True, **options)
+    profile = active()
+    if profile is not None:
+        docs = _profiled_pipeline(profile, conditions, pipeline, source, docs)
+    variables, row_of = tuple(fields), _getter(list(fields.values()))
+    rows = (row_of(doc) for doc in docs)
+    if seed is None:
+        return variables, rows
+    variables, join = _stream_join(seed, variables)
+    return variables, (row for s in rows for row in join(s))
+
+
+def _profiled_pipeline(profile: Profile, conditions, pipeline, source, docs):
+    """Yield from docs, collecting stats for all of the pipeline's conditions as one (see `_iter_rows_for`)."""
+    stats = profile.add_condition(conditions, pipeline=pipeline)
+    yield from fetched(profile, stats, docs)
+    stats["bindings"] = stats["returned"]
+    if profile.explain:
+        command = {"aggregate": source.name, "pipeline": pipeline, "cursor": {}}
+        explanation = source.database.command(
+            "explain", command, verbosity="executionStats"
+        )
+        stats.update(explained(explanation))
+
+
+# Maximum number of ObjectIds whose refs are looked up per query. Larger lookups are split, and fetched concurrently.
+REFS_CHUNK_SIZE = 1000
 
 
 def refs_for(oids, coll_hof=None):
-    coll_hof = coll_hof or as_of(mdb.main, datetime.now(tz=timezone.utc))
+    """Map each of oids to its ref, i.e. its URI (via rdf:resource) or else its local ID (via vaem:id).
+
+    Refs are served from, and added to, the ObjectId-to-ref direction of the collection's ref cache, so only oids not
+    recently seen are looked up, in concurrent chunks of REFS_CHUNK_SIZE.
+    """
+    coll_hof = coll_hof or current(mdb.main)
+    ns = coll_hof[1].full_name
+    out = _cached_refs(oids, ns)
+    to_fetch = list(set(oids) - set(out))
+    calls = [
+        functools.partial(_ref_docs, list(chunk), coll_hof)
+        for chunk in partition_all(REFS_CHUNK_SIZE, to_fetch)
+    ]
+    for _, docs in fetch_concurrently(calls):
+        out.update(_refs_from(docs, ns))
+    return _checked_refs(oids, out)
+
+
+def _ref_docs(oids, coll_hof):
+    return list(find_datoms(_ref_filter(oids), coll_hof))
+
+
+def _cached_refs(oids, ns):
     out = {}
-    docs = list(coll_hof[0]({E: {"$in": oids}, A: {"$in": [OID_URIREF, OID_VAEM_ID]}}))
+    for oid in set(oids):
+        ref = _oids_cache.get_ref(ns, oid)
+        if ref is not None:
+            out[oid] = ref
+    return out
+
+
+def _ref_filter(oids):
+    return {E: {"$in": oids}, A: {"$in": [OID_URIREF, OID_VAEM_ID]}}
+
+
+def _refs_from(docs, ns):
+    """Map entities to refs given their rdf:resource and vaem:id datoms, and cache the refs for ns."""
+    fetched = {}
     for doc in docs:
-        if doc[A] == OID_VAEM_ID and doc[E] not in out:
-            out[doc[E]] = "_:" + encode_id(doc[V])
+        if doc[A] == OID_VAEM_ID and doc[E] not in fetched:
+            fetched[doc[E]] = "_:" + encode_id(doc[V])
         elif doc[A] == OID_URIREF:
-            out[doc[E]] = doc[V]
-    if len(oids) != len(out):
-        missing = set(oids) - set(out)
+            fetched[doc[E]] = doc[V]
+    for oid, ref in fetched.items():
+        _oids_cache.set_ref(ns, oid, ref)
+    return fetched
+
+
+def _checked_refs(oids, out):
+    missing = set(oids) - set(out)
+    if missing:
         raise RuntimeError(
-            f"{len(missing)} oids out of {len(oids)} ({missing}) have no refs or IDs"
+            f"{len(missing)} oids out of {len(set(oids))} ({missing}) have no refs or IDs"
         )
     return out
 
 
 def sub_refs(selected, coll_hof=None):
+    oid_places = _oid_places(selected)
+    refs = refs_for([o_p[2] for o_p in oid_places], coll_hof=coll_hof)
+    return _with_refs(selected, oid_places, refs)
+
+
+def _oid_places(selected):
     oid_places = []
     for i, s in enumerate(selected):
         for k, v in s.items():
             if isinstance(v, ObjectId):
                 oid_places.append((i, k, v))
-    refs = refs_for([o_p[2] for o_p in oid_places], coll_hof=coll_hof)
+    return oid_places
+
+
+def _with_refs(selected, oid_places, refs):
     out = [s.copy() for s in selected]
     for (i, k, v) in oid_places:
         py_.set_(out[i], k, refs[v])
     return out
 
 
+def _compactor(use_prefixes=None):
+    """A function that compacts URIs (see `PrefixRegistry`), memoized per value, as results repeat the same few URIs."""
+    registry = prefix_registry(use_prefixes)
+    memo = {}
+
+    def compact(v):
+        if not isinstance(v, str):
+            return v
+        if v not in memo:
+            memo[v] = registry.compact(v)
+        return memo[v]
+
+    return compact
+
+
 def prefix_compact(bindings: List[dict], use_prefixes=None) -> List[dict]:
-    prefix = PREFIXES.copy()
-    if use_prefixes is not None:
-        prefix.update(use_prefixes)
-    out = []
-    for b in bindings:
-        b_new = {}
-        for (k, v) in b.items():
-            v_new = v
-            if isinstance(v, str) and re.match(URI_BEGINNING_PATTERN, v):
-                for p, expanded in prefix.items():
-                    if v.startswith(expanded):
-                        local_name = v.split(expanded, 1)[1]
-                        v_new = f"{p}:{local_name}"
-                        break
-            b_new[k] = v_new
-        out.append(b_new)
-    return out
+    compact = _compactor(use_prefixes)
+    return [{k: compact(v) for (k, v) in b.items()} for b in bindings]
+
+
+def _row_oids(rows) -> List[ObjectId]:
+    return list({v for row in rows for v in row if isinstance(v, ObjectId)})
+
+
+def _formatted(variables, rows, refs, use_prefixes=None) -> List[dict]:
+    """Rows of values for variables as dicts, with refs (from `refs_for`) for ObjectIds, and prefixes compacted.
+
+    Each distinct value is formatted once, however many rows share it.
+    """
+    compact = _compactor(use_prefixes)
+
+    def value(v):
+        return compact(refs[v] if isinstance(v, ObjectId) else v)
 
+    return [dict(zip(variables, map(value, row))) for row in rows]
 
-def query(query_spec, coll_hof=None):
+
+def query(query_spec, coll_hof=None, engine="python", profile: Profile = None):
     """Query data sources.
 
     :param query_spec: a dictionary with these keys:
       - where: specifies what satisfies this query. Introduces variable names and can use `params`.
       - select: (optional) specifies what is to be returned, using names introduced in `where`.
-      - prefixes: (optional) additional prefixes to expand CURIEs used in `where`.
-      - params: (optional) names mapping to the provided `args`. [NOT YET IMPLEMENTED]
-      - args: (optional) data sources for the query. [NOT YET IMPLEMENTED]
+      - prefixes: (optional) additional prefixes to expand CURIEs used in `where` and `args`.
+      - params: (optional) variable names mapping to the provided `args`.
+      - args: (optional) values for `params`, in order. A list, tuple, or set of values binds its param to any of them.
 
     :param coll_hof: a collection higher-order filter, i.e. the data source for the query.
 
+    :param engine: where conditions are joined: "python" (see `iter_planned_bindings`), or "pipeline" for the server,
+      via one aggregation pipeline (see `compile_pipeline`). Both produce the same results.
+
+    :param profile: (optional) a `maggtomic.profile.Profile` that collects the time of each phase of the query, stats
+      for each condition, and the commands sent to the database.
+
     The query language notation for use in `where` can be imagined as an unholy reverse-orthology (i.e., a common
     ancestor) of the query forms of MongoDB and Datalog -- its code name is "mongortholog".
 
     Generate a list of bindings for each condition. A binding is a dictionary mapping variable names to values. Each
     condition will have one binding associated with each compatible (in isolation) datum.
 
-    After all assertion bindings are generated, the cartesian product will yield an iterable of binding-collections that
-    will either be unified consistently or discarded. The resulting set of unified bindings is returned, projected to
-    the selected variable names.
+    After all assertion bindings are generated, they are hash-joined on shared variable names, so that only bindings
+    that unify consistently are combined (conditions that share no variables are combined via their cartesian
+    product). The resulting set of unified bindings is returned, projected to the selected variable names.
+
+    Params are bound to args before any condition is evaluated, and restrict the datoms fetched for conditions that use
+    them. Because args are not part of a query's plan (see `compile_query`), a query with params is compiled once and
+    may then be run many times with different args (see `prepare`).
+
+    """
+    with profiling(profile):
+        return list(query_iter(query_spec, coll_hof=coll_hof, engine=engine))
+
+
+# Default number of results for which `query_iter` resolves refs at a time.
+QUERY_BATCH_SIZE = 1000
+
+
+def query_iter(query_spec, coll_hof=None, batch_size=QUERY_BATCH_SIZE, engine="python"):
+    """Like query, but yields results lazily.
+
+    Bindings are streamed as rows (see `planned_rows`), and refs are resolved and prefixes compacted for one batch of
+    `batch_size` results at a time, so that a first page of results does not require materializing the rest. Rows become
+    dicts only then.
 
     """
     if coll_hof is None:
-        coll_hof = as_of(mdb.main, datetime.now(tz=timezone.utc))
-    conditions = compile_graph_pattern(
-        query_spec["where"], use_prefixes=query_spec.get("prefixes"), coll_hof=coll_hof
-    )
-    valid_bindings = get_valid_bindings(conditions, coll_hof=coll_hof)
-    selected_bindings = (
-        [py_.pick(v, *query_spec["select"]) for v in valid_bindings]
-        if "select" in query_spec
-        else valid_bindings
-    )
-    # TODO compact_with_prefixes after sub_refs and before return
-    return prefix_compact(
-        sub_refs(selected_bindings, coll_hof=coll_hof),
-        use_prefixes=query_spec.get("prefixes"),
+        coll_hof = current(mdb.main)
+    variables, rows = query_rows(query_spec, coll_hof=coll_hof, engine=engine)
+    for batch in partition_all(batch_size, rows):
+        with phase("refs"):
+            refs = refs_for(_row_oids(batch), coll_hof=coll_hof)
+        with phase("format"):
+            out = _formatted(
+                variables, batch, refs, use_prefixes=query_spec.get("prefixes")
+            )
+        yield from out
+
+
+def query_rows(query_spec, coll_hof=None, engine="python"):
+    """Evaluate query_spec (see `query`) as rows (see `Bindings`), i.e. without resolving refs or compacting prefixes.
+
+    :returns: the selected variables, and an iterator of rows of their values.
+    """
+    if coll_hof is None:
+        coll_hof = current(mdb.main)
+    with phase("compile"):
+        components = compile_query(query_spec, coll_hof=coll_hof)
+        seed = None if components is None else bind_args(query_spec, coll_hof=coll_hof)
+    if components is None:
+        return (), iter(())
+    if engine == "python":
+        variables, rows = planned_rows(components, coll_hof, seed=seed)
+    elif engine == "pipeline":
+        variables, rows = pipeline_rows(components, coll_hof, seed=seed)
+    else:
+        raise ValueError(f"Unknown query engine {engine}")
+    if "select" in query_spec:
+        selected = tuple(v for v in query_spec["select"] if v in variables)
+        rows = map(_getter([variables.index(v) for v in selected]), rows)
+        variables = selected
+    return variables, rows
+
+
+# Maximum number of compiled query plans that are cached.
+PLAN_CACHE_MAXSIZE = 1000
+
+_plan_cache = LRUCache(PLAN_CACHE_MAXSIZE)
+
+
+def compile_query(query_spec, coll_hof=None):
+    """Compile and plan query_spec, caching the plan by the query's shape.
+
+    A plan is the list of components of compiled conditions given by `plan_conditions`. The shape of a query is its
+    `where`, `prefixes`, and `params` -- not its `args` -- together with the collection queried and the epoch of the
+    collection's ref cache, so that a plan is reused across calls with different args and bases (e.g. `as_of` times)
+    but not across a re-creation of the collection. Returns None, uncached, if some constant is unknown to the
+    collection (see `compile_graph_pattern`).
+
+    """
+    coll_hof = coll_hof or current(mdb.main)
+    key = _plan_key(query_spec, coll_hof[1])
+    components = _plan_cache.get(key)
+    if components is None:
+        conditions = compile_graph_pattern(
+            query_spec["where"],
+            use_prefixes=query_spec.get("prefixes"),
+            coll_hof=coll_hof,
+        )
+        if conditions is None:
+            return None
+        components = plan_conditions(
+            conditions, coll_hof, bound=query_spec.get("params", ())
+        )
+        _plan_cache.set(key, components)
+    return components
+
+
+def _plan_key(query_spec, coll):
+    return (
+        coll.full_name,
+        _oids_cache.epoch(coll.full_name),
+        repr(query_spec["where"]),
+        repr(query_spec.get("prefixes")),
+        tuple(query_spec.get("params", ())),
     )
+
+
+def bind_args(query_spec, coll_hof=None):
+    """Bindings of query_spec's `params` to its `args`, or None if it has no params.
+
+    An arg that is a list, tuple, or set binds its param to each of its values in turn, and the bindings are the cross
+    product over params. Values that are (compact) URIs are resolved, read-only, to ObjectIds; those unknown to the
+    collection cannot match any datom and are dropped.
+
+    """
+    params = query_spec.get("params")
+    if not params:
+        return None
+    coll_hof = coll_hof or current(mdb.main)
+    arg_values, resources = _arg_values(query_spec)
+    oid_for = _oids_for(list(resources), coll=coll_hof[1], create=False)
+    return _bindings_for_args(params, arg_values, resources, oid_for)
+
+
+def _arg_values(query_spec):
+    """The prefix-expanded values of each of query_spec's args, and the set of them that are URIs."""
+    params, args = query_spec["params"], query_spec.get("args", [])
+    if len(args) != len(params):
+        raise ValueError(f"Expected {len(params)} args for params {params}: {args}")
+    arg_values = [
+        prefix_expand(
+            a if isinstance(a, (list, tuple, set, frozenset)) else [a],
+            use_prefixes=query_spec.get("prefixes"),
+        )
+        for a in args
+    ]
+    resources = {
+        v
+        for values in arg_values
+        for v in values
+        if isinstance(v, str) and re.match(URI_BEGINNING_PATTERN, v)
+    }
+    return arg_values, resources
+
+
+def _bindings_for_args(params, arg_values, resources, oid_for):
+    resolved = [
+        [oid_for.get(v, v) for v in values if v in oid_for or v not in resources]
+        for values in arg_values
+    ]
+    return [dict(zip(params, combo)) for combo in itertools.product(*resolved)]
+
+
+def prepare(query_spec):
+    """Prepare a query with `params`, returning a function that runs it with args.
+
+    The function takes the args positionally, and `coll_hof` as a keyword. The query's plan is compiled on the first
+    call for a collection, and reused from the plan cache on later calls (see `compile_query`).
+    """
+
+    def run(*args, coll_hof=None):
+        return query(merge(query_spec, {"args": list(args)}), coll_hof=coll_hof)
+
+    return run
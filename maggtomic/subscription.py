@@ -0,0 +1,251 @@
+"""Incremental query subscriptions, maintained from the transaction log rather than by re-running queries."""
+import time
+from collections import Counter, defaultdict
+
+from pydash import py_
+from pymongo.collection import Collection
+
+from maggtomic import (
+    ASC,
+    DESC,
+    E,
+    A,
+    V,
+    T,
+    O,
+    INDEX_NAMES,
+    _cursor_options,
+    as_of,
+    current,
+    db as mdb,
+)
+from maggtomic.query import (
+    bind_args,
+    binding_variables,
+    compile_graph_pattern,
+    filter_for,
+    get_doc_binder,
+    iter_planned_bindings,
+    merge_binding_collections,
+    plan_conditions,
+    prefix_compact,
+    sub_refs,
+    variable_fields,
+)
+
+
+def subscribe(query_spec, coll: Collection = None):
+    """Register query_spec (see `maggtomic.query.query`) against the current state of coll.
+
+    :returns: a `Subscription`, whose `results` are those of the query now, and whose `poll` and `deltas` report the
+      rows added to and removed from them by later transactions.
+    """
+    return Subscription(query_spec, coll if coll is not None else mdb.main)
+
+
+def _latest_t(coll: Collection):
+    return coll.find_one({}, [T], sort=[(T, DESC)])[T]
+
+
+def _key(binding):
+    return tuple(sorted(binding.items(), key=lambda item: item[0]))
+
+
+def _datom_for(condition, binding):
+    """The (e, a, v) by which binding satisfies condition."""
+    datom = []
+    for spec in condition:
+        if isinstance(spec, dict):
+            spec = list(spec.keys())[0]
+        datom.append(
+            binding[spec] if isinstance(spec, str) and spec.startswith("?") else spec
+        )
+    return tuple(datom)
+
+
+class Subscription:
+    """A query whose results are maintained incrementally as transactions land.
+
+    The join state is the set of full bindings (i.e., of all variables) that satisfy the query, each indexed by the
+    datom that satisfies each condition. On `poll`, the datoms transacted since the last poll that may satisfy some
+    condition are read via the T (history) index, and each (e, a, v) takes the net effect of its latest operation:
+      - a retracted datom removes every binding that it satisfies a condition for.
+      - an asserted datom seeds the evaluation of the query, as of the latest transaction, with the bindings of each
+        condition it may satisfy, so that only the bindings it takes part in are fetched.
+      - an asserted datom that satisfies a ground condition, i.e. one without variables, re-evaluates the query in full.
+
+    Transactions are ordered by their ObjectIds, as for `as_of` and `since`, so those from clients with skewed clocks
+    may be missed.
+    """
+
+    def __init__(self, query_spec, coll: Collection):
+        self.query_spec = query_spec
+        self.coll = coll
+        self.t = _latest_t(coll)
+        self.conditions = None
+        self._args = None
+        self._plans = {}
+        self._bindings = {}
+        self._by_datom = []
+        self._selected = {}
+        self._counts = Counter()
+        self._changes = Counter()
+        self._load(as_of(coll, self.t, live=False))
+        self._changes.clear()
+
+    def _load(self, coll_hof):
+        """Compile the query and evaluate it in full, unless some constant is unknown (see `compile_graph_pattern`)."""
+        self.conditions = compile_graph_pattern(
+            self.query_spec["where"],
+            use_prefixes=self.query_spec.get("prefixes"),
+            coll_hof=coll_hof,
+        )
+        if self.conditions is None:
+            return
+        self._by_datom = [defaultdict(set) for _ in self.conditions]
+        self._args = bind_args(self.query_spec, coll_hof=coll_hof)
+        self._evaluate(coll_hof, self._args)
+
+    def _evaluate(self, coll_hof, seed):
+        bound = frozenset(binding_variables(seed or []))
+        if bound not in self._plans:
+            self._plans[bound] = plan_conditions(self.conditions, coll_hof, bound=bound)
+        for binding in iter_planned_bindings(self._plans[bound], coll_hof, seed=seed):
+            self._add(binding)
+
+    def _add(self, binding):
+        key = _key(binding)
+        if key in self._bindings:
+            return
+        self._bindings[key] = binding
+        for c, by_datom in zip(self.conditions, self._by_datom):
+            by_datom[_datom_for(c, binding)].add(key)
+        selected = self._select(binding)
+        selected_key = _key(selected)
+        self._selected[selected_key] = selected
+        self._counts[selected_key] += 1
+        self._changes[selected_key] += 1
+
+    def _remove(self, key):
+        binding = self._bindings.pop(key, None)
+        if binding is None:
+            return
+        for c, by_datom in zip(self.conditions, self._by_datom):
+            datom = _datom_for(c, binding)
+            by_datom[datom].discard(key)
+            if not by_datom[datom]:
+                del by_datom[datom]
+        selected_key = _key(self._select(binding))
+        self._counts[selected_key] -= 1
+        self._changes[selected_key] -= 1
+
+    def _select(self, binding):
+        if "select" in self.query_spec:
+            return py_.pick(binding, *self.query_spec["select"])
+        return binding
+
+    def _format(self, selected, coll_hof):
+        return prefix_compact(
+            sub_refs(selected, coll_hof=coll_hof),
+            use_prefixes=self.query_spec.get("prefixes"),
+        )
+
+    def results(self):
+        """The query's results, as of the last poll."""
+        selected = [
+            self._selected[k] for k, n in self._counts.items() for _ in range(n)
+        ]
+        return self._format(selected, current(self.coll))
+
+    def _datoms_since(self, t, t_latest):
+        """Datoms transacted after t, up to and including t_latest, that may satisfy a condition, in order."""
+        filter_ = {
+            T: {"$gt": t, "$lte": t_latest},
+            "$or": [filter_for(c) for c in self.conditions],
+        }
+        return self.coll.find(
+            filter_,
+            {"_id": 0, E: 1, A: 1, V: 1, O: 1},
+            sort=[(T, ASC), ("_id", ASC)],
+            **_cursor_options(self.coll, INDEX_NAMES, "T"),
+        )
+
+    def _grounds_asserted(self, latest_op) -> bool:
+        """Whether a ground condition, i.e. one without variables, is satisfied by a datom asserted per latest_op.
+
+        Such a datom binds no variables, so it cannot seed an evaluation. Instead, the query is evaluated in full.
+        """
+        return any(
+            latest_op.get(_datom_for(c, {}))
+            for c in self.conditions
+            if not variable_fields(c)
+        )
+
+    def poll(self):
+        """Apply the transactions since the last poll.
+
+        :returns: (added, removed), the rows that entered and left the results, formatted as by query. A row that the
+          query yields n times is reported n times.
+        """
+        t_latest = _latest_t(self.coll)
+        if t_latest == self.t:
+            return [], []
+        coll_hof = as_of(self.coll, t_latest, live=False)
+        if self.conditions is None:
+            self._load(coll_hof)
+        else:
+            latest_op = {}
+            for d in self._datoms_since(self.t, t_latest):
+                latest_op[(d[E], d[A], d[V])] = d[O]
+            for datom, o in latest_op.items():
+                if not o:
+                    for by_datom in self._by_datom:
+                        for key in list(by_datom.get(datom, ())):
+                            self._remove(key)
+            asserted = [{E: e, A: a, V: v} for (e, a, v), o in latest_op.items() if o]
+            if self._grounds_asserted(latest_op):
+                self._evaluate(coll_hof, self._args)
+            else:
+                for c in self.conditions:
+                    doc_binding = get_doc_binder(c)
+                    seed = list(
+                        {
+                            _key(b): b
+                            for b in (doc_binding(d) for d in asserted)
+                            if b is not None
+                        }.values()
+                    )
+                    if seed and self._args is not None:
+                        seed = merge_binding_collections(self._args, seed)
+                    if seed:
+                        self._evaluate(coll_hof, seed)
+        self.t = t_latest
+        added, removed = [], []
+        for selected_key, n in self._changes.items():
+            rows = added if n > 0 else removed
+            rows.extend([self._selected[selected_key]] * abs(n))
+            if not self._counts[selected_key]:
+                del self._counts[selected_key]
+                del self._selected[selected_key]
+        self._changes.clear()
+        return self._format(added, coll_hof), self._format(removed, coll_hof)
+
+    def deltas(self, interval=1.0, change_stream=False):
+        """Yield (added, removed) from `poll` whenever the results change.
+
+        Polls every `interval` seconds, or, with `change_stream`, whenever a datom of a new transaction is inserted into
+        the collection, which requires a replica set.
+        """
+        if not change_stream:
+            while True:
+                added, removed = self.poll()
+                if added or removed:
+                    yield added, removed
+                time.sleep(interval)
+        with self.coll.watch([{"$match": {"operationType": "insert"}}]) as stream:
+            for change in stream:
+                if change["fullDocument"][T] <= self.t:
+                    continue
+                added, removed = self.poll()
+                if added or removed:
+                    yield added, removed
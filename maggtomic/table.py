@@ -0,0 +1,138 @@
+"""Query results as columns, i.e. NumPy arrays, a pandas DataFrame, or an Arrow table, rather than as a list of dicts.
+
+Rows are dictionary-encoded per column as they are streamed, so refs are resolved and prefixes compacted once per
+distinct value of a column rather than once per row, and each column is built from its distinct values and an integer
+array of codes.
+
+Requires numpy, pandas, or pyarrow, depending on the format (`pip install maggtomic[table]`).
+"""
+import importlib
+from array import array
+
+from bson import ObjectId
+
+from maggtomic import current, db as mdb
+from maggtomic.query import _compactor, query_rows, refs_for, variable_fields
+
+FORMATS = ("numpy", "pandas", "arrow")
+
+
+def _require(module_name):
+    try:
+        return importlib.import_module(module_name)
+    except ImportError as e:
+        raise ImportError(
+            f"{module_name} is required for this format (`pip install maggtomic[table]`)"
+        ) from e
+
+
+def _selected_variables(query_spec) -> tuple:
+    """The variables that query_spec selects: those of its `select`, or else all of those in its `where`, in order."""
+    if "select" in query_spec:
+        return tuple(query_spec["select"])
+    return tuple(
+        dict.fromkeys(v for c in query_spec["where"] for v in variable_fields(c))
+    )
+
+
+def _encoded_columns(n_columns, rows):
+    """Dictionary-encode rows by column, as the distinct values of each column, and each row's index into them.
+
+    Values are keyed by their type as well, so that e.g. 1, 1.0, and True stay distinct. Unhashable values (e.g. lists)
+    are not deduplicated.
+    """
+    indexes = [{} for _ in range(n_columns)]
+    values = [[] for _ in range(n_columns)]
+    codes = [array("q") for _ in range(n_columns)]
+    for row in rows:
+        for v, index, column_values, column_codes in zip(row, indexes, values, codes):
+            key = (v.__class__, v)
+            try:
+                code = index[key]
+            except KeyError:
+                code = index[key] = len(column_values)
+                column_values.append(v)
+            except TypeError:
+                code = len(column_values)
+                column_values.append(v)
+            column_codes.append(code)
+    return values, codes
+
+
+def _formatted_columns(values, coll_hof, use_prefixes=None):
+    """Distinct values of each column, with ObjectIds as refs (resolved at once), and prefixes compacted."""
+    oids = list({v for vs in values for v in vs if isinstance(v, ObjectId)})
+    refs = refs_for(oids, coll_hof=coll_hof)
+    compact = _compactor(use_prefixes)
+    return [
+        [compact(refs[v] if isinstance(v, ObjectId) else v) for v in vs]
+        for vs in values
+    ]
+
+
+def _numpy_dictionary(np, values):
+    """An array of values, typed if they are all numbers (or all booleans) of one type, and of objects otherwise."""
+    types = {v.__class__ for v in values}
+    if len(types) == 1 and types <= {bool, int, float}:
+        try:
+            return np.array(values)
+        except OverflowError:
+            pass
+    out = np.empty(len(values), dtype=object)
+    for i, v in enumerate(values):
+        out[i] = v
+    return out
+
+
+def _numpy_columns(variables, values, codes):
+    np = _require("numpy")
+    return {
+        var: _numpy_dictionary(np, vs)[np.asarray(cs, dtype=np.int64)]
+        for var, vs, cs in zip(variables, values, codes)
+    }
+
+
+def _arrow_column(pa, values, codes):
+    """Decode an Arrow column from its distinct values, given as strings if they are of mixed types."""
+    try:
+        dictionary = pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        dictionary = pa.array([None if v is None else str(v) for v in values])
+    indices = pa.Array.from_buffers(pa.int64(), len(codes), [None, pa.py_buffer(codes)])
+    return dictionary.take(indices)
+
+
+def query_to_table(query_spec, coll_hof=None, format="pandas", engine="python"):
+    """Query data sources (see `maggtomic.query.query`), with results as columns, one per selected variable.
+
+    :param format: "numpy", for a dict of variable names to arrays, "pandas", for a DataFrame, or "arrow", for a
+      pyarrow Table.
+
+    Values are as for `query`, i.e. refs for entities, with prefixes compacted. Columns of numbers are typed, and
+    others are of Python objects (for numpy and pandas) or inferred (for Arrow).
+    """
+    if format not in FORMATS:
+        raise ValueError(f"Unknown table format {format}, not one of {FORMATS}")
+    if coll_hof is None:
+        coll_hof = current(mdb.main)
+    variables, rows = query_rows(query_spec, coll_hof=coll_hof, engine=engine)
+    if not variables:
+        # No variables are bound if there are no rows, but the columns are still those selected.
+        variables = _selected_variables(query_spec)
+    values, codes = _encoded_columns(len(variables), rows)
+    values = _formatted_columns(
+        values, coll_hof, use_prefixes=query_spec.get("prefixes")
+    )
+    if format == "arrow":
+        pa = _require("pyarrow")
+        return pa.table(
+            {
+                var: _arrow_column(pa, vs, cs)
+                for var, vs, cs in zip(variables, values, codes)
+            }
+        )
+    columns = _numpy_columns(variables, values, codes)
+    if format == "pandas":
+        pd = _require("pandas")
+        return pd.DataFrame(columns, columns=list(variables))
+    return columns
@@ -9,7 +9,7 @@ with open("requirements/main.in") as f:
 setup(
     name="maggtomic",
     url="https://github.com/polyneme/maggtomic",
-    packages=find_packages(),
+    packages=find_packages(exclude=["benchmarks", "benchmarks.*"]),
     use_scm_version=True,
     setup_requires=["setuptools_scm"],
     author="Donny Winston",
@@ -24,5 +24,6 @@ setup(
         "License :: OSI Approved :: BSD License",
     ],
     install_requires=install_requires,
+    extras_require={"aio": ["motor"], "table": ["numpy", "pandas", "pyarrow"]},
     python_requires=">=3.6",
 )
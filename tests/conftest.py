@@ -0,0 +1,36 @@
+import os
+
+import pytest
+from pymongo.errors import PyMongoError
+
+from maggtomic import Database, create_collection
+
+# Database for tests that need a MongoDB server, dropped after the session. Tests that need one are skipped if the
+# server (from the environment, e.g. via `.env`) is not available.
+TEST_DBNAME = os.getenv("MONGO_DBNAME") or "maggtomic_test"
+
+
+@pytest.fixture(scope="session")
+def database():
+    database = Database(name=TEST_DBNAME, serverSelectionTimeoutMS=2000)
+    try:
+        database.client.admin.command("ping")
+    except PyMongoError as e:
+        pytest.skip(f"MongoDB is not available: {e}")
+    yield database
+    database.client.drop_database(TEST_DBNAME)
+    database.close()
+
+
+@pytest.fixture
+def coll(database):
+    """A new, empty datom collection."""
+    return create_collection("test", drop_guard=False, database=database.database)
+
+
+@pytest.fixture
+def sharded_coll(database):
+    """A new, empty sharded datom collection."""
+    return create_collection(
+        "test_sharded", drop_guard=False, sharded=True, database=database.database
+    )
@@ -0,0 +1,59 @@
+import asyncio
+
+import pytest
+
+motor_asyncio = pytest.importorskip("motor.motor_asyncio")
+
+from maggtomic import _index_names, current_collection  # noqa: E402
+from maggtomic import aio  # noqa: E402
+
+PREFIXES = {"ex": "http://example.org/"}
+
+KNOWS = {"prefixes": PREFIXES, "where": [["?x", "ex:knows", "?y"]]}
+
+
+def _run(database, coll, main):
+    """Run coroutine function main with the Motor collection for coll."""
+
+    async def run():
+        client = motor_asyncio.AsyncIOMotorClient(database.uri)
+        try:
+            return await main(client[coll.database.name][coll.name])
+        finally:
+            client.close()
+
+    return asyncio.run(run())
+
+
+def test_transact_and_query(database, coll):
+    async def main(acoll):
+        await aio.transact(
+            [
+                await aio.assert_(s, use_prefixes=PREFIXES, coll=acoll)
+                for s in [("ex:a", "ex:knows", "ex:b"), ("ex:b", "ex:knows", "ex:c")]
+            ],
+            coll=acoll,
+        )
+        await aio.transact(
+            [
+                await aio.retract(
+                    ("ex:b", "ex:knows", "ex:c"), use_prefixes=PREFIXES, coll=acoll
+                )
+            ],
+            coll=acoll,
+        )
+        return await aio.query(KNOWS, coll_hof=await aio.current(acoll))
+
+    assert _run(database, coll, main) == [{"?x": "ex:a", "?y": "ex:b"}]
+
+
+def test_filters_do_not_fetch_index_names_without_awaiting(database, coll):
+    async def main(acoll):
+        await aio.transact_bulk(
+            [("ex:a", "ex:knows", "ex:b")], use_prefixes=PREFIXES, coll=acoll
+        )
+        coll_hof = await aio.current(acoll)
+        _index_names.pop(current_collection(coll).full_name, None)
+        return await aio.query(KNOWS, coll_hof=coll_hof)
+
+    assert _run(database, coll, main) == [{"?x": "ex:a", "?y": "ex:b"}]
@@ -0,0 +1,68 @@
+import json
+
+import pytest
+
+from benchmarks import compare
+from benchmarks.__main__ import parse_args
+from benchmarks.generators import chains, tree_size, trees, wide_entities
+from benchmarks.suites import result, run
+
+
+def test_generators_are_deterministic_given_a_seed():
+    assert list(wide_entities(3, 4, seed=1)) == list(wide_entities(3, 4, seed=1))
+    assert list(wide_entities(3, 4, seed=1)) != list(wide_entities(3, 4, seed=2))
+    assert list(trees(2, 3, seed=1)) == list(trees(2, 3, seed=1))
+
+
+def test_generators_are_of_the_given_scale():
+    assert len(list(wide_entities(3, 4))) == 12
+    values = [s for s in trees(2, 3) if s[1] == "bench:value"]
+    assert len(values) == 2 * tree_size(3) == 2 * 15
+    assert len(list(chains(2, 3))) == 2 * (3 + 1)
+
+
+def test_result_summarizes_seconds_and_throughput():
+    out = result("x", [1.0, 3.0, 2.0], items=10, rows=5)
+    assert out["seconds"]["median"] == 2.0
+    assert out["items_per_second"] == 5.0
+    assert out["rows"] == 5
+
+
+def _run_file(path, medians, params=None):
+    results = [{"name": k, "seconds": {"median": v}} for k, v in medians.items()]
+    path.write_text(json.dumps({"params": params or {}, "results": results}))
+    return str(path)
+
+
+def test_compare_ratios_and_threshold(tmp_path):
+    before = _run_file(tmp_path / "before.json", {"a": 1.0, "b": 2.0, "c": 1.0})
+    after = _run_file(tmp_path / "after.json", {"a": 1.5, "b": 2.0, "d": 1.0})
+    with open(before) as f1, open(after) as f2:
+        assert compare.ratios(json.load(f1), json.load(f2)) == {"a": 1.5, "b": 1.0}
+    assert compare.main([before, after]) == 0
+    assert compare.main([before, after, "--threshold", "1.2"]) == 1
+    assert compare.main([before, after, "--threshold", "2"]) == 0
+
+
+def test_parse_args():
+    args = parse_args(["--links", "1,3", "--engines", "python"])
+    assert args.links == [1, 3]
+    assert args.engines == ["python"]
+    with pytest.raises(SystemExit):
+        parse_args(["--attributes", "2", "--star", "1,4"])
+
+
+def test_run_at_a_small_scale(coll):
+    params = parse_args(
+        "--entities 3 --attributes 2 --trees 2 --depth 2 --chains 2 --links 1,2"
+        " --star 1,2 --engines python --repeat 2".split()
+    )
+    results = run(coll, params)
+    names = [r["name"] for r in results]
+    assert len(names) == len(set(names))
+    assert "transact/assert_/wide" in names
+    assert "query/chain-2/python" in names
+    rows = {r["name"]: r.get("rows") for r in results}
+    assert rows["query/chain-2/python"] == 2
+    assert rows["query/star-2/python"] == 3 * 3
+    assert rows["query/tree-2/python"] == 2 * 4
@@ -0,0 +1,60 @@
+import threading
+
+from bson import ObjectId
+
+from maggtomic import LRUCache, RefCache
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    assert len(cache) == 2
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_lru_cache_is_thread_safe():
+    cache = LRUCache(10)
+    errors = []
+
+    def hammer(offset):
+        try:
+            for i in range(5000):
+                cache.set((offset + i) % 20, i)
+                cache.get((offset + i + 1) % 20)
+        except Exception as e:  # pragma: no cover
+            errors.append(e)
+
+    threads = [threading.Thread(target=hammer, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert len(cache) == 10
+
+
+def test_ref_cache_is_bidirectional_per_namespace():
+    cache = RefCache(maxsize=10)
+    oid = ObjectId()
+    cache.set("db.one", "http://example.org/a", oid)
+    assert cache.get("db.one", "http://example.org/a") == oid
+    assert cache.get_ref("db.one", oid) == "http://example.org/a"
+    assert cache.get("db.two", "http://example.org/a") is None
+    cache.set_ref("db.two", oid, "_:00000-00000")
+    assert cache.get_ref("db.two", oid) == "_:00000-00000"
+    assert cache.get("db.two", "_:00000-00000") is None
+
+
+def test_ref_cache_reset_bumps_epoch():
+    cache = RefCache(maxsize=10)
+    cache.set("db.one", "http://example.org/a", ObjectId())
+    epoch = cache.epoch("db.one")
+    cache.reset_ns("db.one")
+    assert cache.epoch("db.one") == epoch + 1
+    assert cache.get("db.one", "http://example.org/a") is None
+    assert cache.stats("db.one")["oids"] == {"size": 0, "hits": 0, "misses": 1}
@@ -0,0 +1,81 @@
+import pytest
+
+from maggtomic import (
+    Database,
+    _oids_for,
+    as_of,
+    assert_,
+    connection_settings,
+    create_collection,
+    current,
+    transact,
+)
+from maggtomic.query import query
+
+PREFIXES = {"ex": "http://example.org/"}
+
+
+class FakeClient:
+    def __init__(self, uri, **options):
+        self.uri, self.options, self.closed = uri, options, False
+
+    def __getitem__(self, name):
+        return name
+
+    def close(self):
+        self.closed = True
+
+
+def test_connection_settings_from_the_environment(monkeypatch):
+    monkeypatch.delenv("MONGO_CONNECTION_URI", raising=False)
+    monkeypatch.setenv("MONGO_HOST", "example.org")
+    monkeypatch.setenv("MONGO_PORT", "27018")
+    monkeypatch.setenv("MONGO_DBNAME", "example")
+    assert connection_settings() == ("mongodb://example.org:27018", "example")
+    monkeypatch.setenv("MONGO_CONNECTION_URI", "mongodb://other:27017/?maxPoolSize=5")
+    assert connection_settings()[0] == "mongodb://other:27017/?maxPoolSize=5"
+
+
+def test_database_connects_on_first_use_once_per_process(monkeypatch):
+    database = Database("mongodb://example.org", "example", client_class=FakeClient)
+    assert database._client is None
+    client = database.client
+    assert database.client is client
+    assert database.database == "example"
+    monkeypatch.setattr("os.getpid", lambda: -1)
+    assert database.client is not client
+    assert not client.closed
+
+
+def test_database_configure_reconnects(monkeypatch):
+    database = Database("mongodb://example.org", "example", client_class=FakeClient)
+    client = database.client
+    database.configure(name="other", maxPoolSize=5)
+    assert client.closed
+    assert database.database == "other"
+    assert database.client.options["maxPoolSize"] == 5
+    assert database.client.uri == "mongodb://example.org"
+
+
+@pytest.fixture
+def other_coll(database):
+    """A datom collection with the same name as the `coll` fixture, in another database."""
+    other = database.client[f"{database.dbname}_other"]
+    yield create_collection("test", drop_guard=False, database=other)
+    database.client.drop_database(other.name)
+
+
+def test_caches_are_per_database(coll, other_coll):
+    for c in (coll, other_coll):
+        transact(
+            [assert_(("ex:a", "ex:knows", "ex:b"), use_prefixes=PREFIXES, coll=c)],
+            coll=c,
+        )
+    uri = "http://example.org/a"
+    assert _oids_for([uri], coll=coll)[uri] != _oids_for([uri], coll=other_coll)[uri]
+    knows = {"prefixes": PREFIXES, "where": [["?x", "ex:knows", "?y"]]}
+    for c in (coll, other_coll):
+        for coll_hof in (current(c), as_of(c, c.find_one(sort=[("t", -1)])["t"])):
+            assert [(r["?x"], r["?y"]) for r in query(knows, coll_hof=coll_hof)] == [
+                ("ex:a", "ex:b")
+            ]
@@ -0,0 +1,43 @@
+from bson import ObjectId
+
+from maggtomic import (
+    CURRENT_INDEX_NAMES,
+    INDEX_NAMES,
+    _cursor_options,
+    current,
+    current_collection,
+)
+from maggtomic.query import DATOM_PROJECTION, _for_partial_vae, find_datoms, index_for
+
+
+def test_index_for_leads_with_the_most_selective_constrained_field():
+    oid = ObjectId()
+    assert index_for({"e": oid, "a": oid}) == "EAV"
+    assert index_for({"a": oid, "v": 1}) == "AVE"
+    assert index_for({"a": oid}) == "AEV"
+    assert index_for({"v": oid}) == "VAE"
+    assert index_for({"v": {"$in": [oid, 1]}}) is None
+    assert index_for({}) is None
+
+
+def test_for_partial_vae_admits_only_object_ids():
+    oid = ObjectId()
+    assert _for_partial_vae(oid) == {"$eq": oid, "$type": "objectId"}
+    assert _for_partial_vae({"$in": [oid]}) == {"$in": [oid], "$type": "objectId"}
+    assert _for_partial_vae({"$gt": 1}) is None
+
+
+def test_cursor_options_hint_existing_indexes(coll):
+    options = _cursor_options(coll, INDEX_NAMES, "AVE", batch_size=100)
+    assert options == {"hint": INDEX_NAMES["AVE"], "batch_size": 100}
+    current_options = _cursor_options(
+        current_collection(coll), CURRENT_INDEX_NAMES, "EAV"
+    )
+    assert current_options["hint"] == CURRENT_INDEX_NAMES["EAV"]
+    assert "hint" not in _cursor_options(coll, {"AVE": "no such index"}, "AVE")
+
+
+def test_find_datoms_projects_to_e_a_v(coll):
+    docs = list(find_datoms({}, current(coll)))
+    assert docs
+    assert all(set(d) == set(DATOM_PROJECTION) - {"_id"} for d in docs)
@@ -0,0 +1,41 @@
+import threading
+
+import pytest
+
+from maggtomic import query
+from maggtomic.profile import Profile, active, profiling
+from maggtomic.query import _fetch_all, fetch_concurrently, set_fetch_threads
+
+
+@pytest.fixture(params=[1, 4])
+def fetch_threads(request):
+    configured = query.FETCH_THREADS
+    set_fetch_threads(request.param)
+    yield request.param
+    set_fetch_threads(configured)
+
+
+def test_fetch_all_keeps_order(fetch_threads):
+    calls = [lambda n=n: n * n for n in range(10)]
+    assert _fetch_all(calls) == [n * n for n in range(10)]
+
+
+@pytest.mark.parametrize("fetch_threads", [4], indirect=True)
+def test_fetch_concurrently_uses_pool_threads(fetch_threads):
+    names = _fetch_all([lambda: threading.current_thread().name] * 3)
+    assert all(name.startswith("maggtomic-fetch") for name in names)
+
+
+def test_fetch_concurrently_propagates_the_active_profile(fetch_threads):
+    profile = Profile()
+    with profiling(profile):
+        profiles = [p for _, p in fetch_concurrently([active, active])]
+    assert profiles == [profile, profile]
+
+
+def test_fetch_concurrently_raises_errors_of_calls(fetch_threads):
+    def fail():
+        raise RuntimeError("fetch failed")
+
+    with pytest.raises(RuntimeError):
+        _fetch_all([lambda: 1, fail])
@@ -0,0 +1,110 @@
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+
+from maggtomic import (
+    DESC,
+    MIN_OID,
+    OID_GENERATED_AT_TIME,
+    T,
+    TxTimeIndex,
+    _tx_times,
+    as_of,
+    assert_,
+    current,
+    current_collection,
+    rebuild_current,
+    retract,
+    since,
+    transact,
+)
+from maggtomic.query import query
+
+PREFIXES = {"ex": "http://example.org/"}
+
+KNOWS = {"prefixes": PREFIXES, "where": [["?x", "ex:knows", "?y"]]}
+
+
+def _transact(coll, statements, is_assert=True):
+    op = assert_ if is_assert else retract
+    transact([op(s, use_prefixes=PREFIXES, coll=coll) for s in statements], coll=coll)
+    return coll.find_one({}, [T], sort=[(T, DESC)])[T]
+
+
+def _known(coll_hof):
+    return sorted((r["?x"], r["?y"]) for r in query(KNOWS, coll_hof=coll_hof))
+
+
+def _current_state(coll):
+    return sorted(
+        (d["e"], d["a"], repr(d["v"]))
+        for d in current_collection(coll).find({}, {"_id": 0, "t": 0})
+    )
+
+
+def test_current_state_resolves_retractions(coll):
+    t1 = _transact(coll, [("ex:a", "ex:knows", "ex:b"), ("ex:a", "ex:knows", "ex:c")])
+    t2 = _transact(coll, [("ex:a", "ex:knows", "ex:b")], is_assert=False)
+    assert _known(current(coll)) == [("ex:a", "ex:c")]
+    assert _known(as_of(coll, t1)) == [("ex:a", "ex:b"), ("ex:a", "ex:c")]
+    assert _known(as_of(coll, t2)) == [("ex:a", "ex:c")]
+    assert _known(as_of(coll, t2, live=True)) == [("ex:a", "ex:c")]
+
+
+def test_rebuild_current_matches_maintained_state(coll):
+    _transact(coll, [("ex:a", "ex:knows", "ex:b"), ("ex:b", "ex:knows", "ex:c")])
+    _transact(coll, [("ex:b", "ex:knows", "ex:c")], is_assert=False)
+    _transact(coll, [("ex:b", "ex:knows", "ex:c")])
+    maintained = _current_state(coll)
+    current_collection(coll).drop()
+    rebuild_current(coll)
+    assert _current_state(coll) == maintained
+
+
+def test_as_of_latest_is_pinned_unless_live(coll):
+    t1 = _transact(coll, [("ex:a", "ex:knows", "ex:b")])
+    live, pinned = as_of(coll, t1, live=True), as_of(coll, t1)
+    _transact(coll, [("ex:a", "ex:knows", "ex:c")])
+    assert _known(live) == [("ex:a", "ex:b"), ("ex:a", "ex:c")]
+    assert _known(pinned) == [("ex:a", "ex:b")]
+
+
+def test_as_of_a_transaction_needs_no_transaction_times(coll):
+    t1 = _transact(coll, [("ex:a", "ex:knows", "ex:b")])
+    assert _known(as_of(coll, t1)) == [("ex:a", "ex:b")]
+    assert _tx_times.latest(coll.full_name) == MIN_OID
+
+
+def test_since_produces_later_operations(coll):
+    t1 = _transact(coll, [("ex:a", "ex:knows", "ex:b")])
+    _transact(coll, [("ex:c", "ex:knows", "ex:d")])
+    assert _known(since(coll, t1)) == [("ex:c", "ex:d")]
+
+
+def test_tx_time_index_finds_the_latest_transaction_at_or_before_a_time():
+    index = TxTimeIndex()
+    t0 = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    txs = [ObjectId() for _ in range(3)]
+    # Wall times as read from MongoDB are naive, and are taken to be UTC.
+    index.add(
+        "ns",
+        [{"v": t0.replace(tzinfo=None) + timedelta(n), "t": txs[n]} for n in (2, 0, 1)],
+    )
+    assert index.latest("ns") == txs[2]
+    assert index.basis("ns", t0 - timedelta(1)) == MIN_OID
+    assert index.basis("ns", t0) == txs[0]
+    assert index.basis("ns", t0 + timedelta(hours=36)) == txs[1]
+    assert index.basis("ns", t0 + timedelta(5)) == txs[2]
+    assert index.refresh_filter("ns")["t"] == {"$gt": txs[2]}
+    assert index.basis("other", t0) == MIN_OID
+
+
+def test_as_of_a_datetime(coll):
+    t1 = _transact(coll, [("ex:a", "ex:knows", "ex:b")])
+    wall_time = coll.find_one({"e": t1, "a": OID_GENERATED_AT_TIME})["v"]
+    _transact(coll, [("ex:a", "ex:knows", "ex:c")])
+    # Wall times are to the second, so the second transaction may share t1's.
+    assert ("ex:a", "ex:b") in _known(as_of(coll, wall_time))
+    assert _known(as_of(coll, datetime(2000, 1, 1, tzinfo=timezone.utc))) == []
+    later = datetime.now(tz=timezone.utc) + timedelta(1)
+    assert _known(as_of(coll, later)) == _known(current(coll))
@@ -0,0 +1,47 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from maggtomic import A, OID_VAEM_ID, V, IDPool, generate_ids_unique
+from maggtomic.util import decode_id, generate_id
+
+
+def test_id_pool_shortfall_refills_by_block():
+    pool = IDPool(block_size=10)
+    assert pool.shortfall(3, "ns") == 10
+    assert pool.shortfall(30, "ns") == 30
+    pool.add("ns", [generate_id() for _ in range(10)])
+    assert pool.shortfall(3, "ns") == 0
+    taken = pool.pop(3, "ns")
+    assert len(set(taken)) == 3
+    assert pool.shortfall(7, "ns") == 0
+    assert pool.shortfall(8, "ns") == 10
+    assert pool.pop(8, "ns") is None
+
+
+def test_id_pool_namespaces_are_separate():
+    pool = IDPool(block_size=10)
+    pool.add("ns1", [generate_id() for _ in range(10)])
+    assert pool.shortfall(1, "ns2") == 10
+    pool.reset_ns("ns1")
+    assert pool.shortfall(1, "ns1") == 10
+
+
+def test_id_pool_is_shared_by_threads():
+    pool = IDPool()
+    pool.add("ns", [generate_id() for _ in range(1000)])
+    with ThreadPoolExecutor(8) as executor:
+        taken = list(executor.map(lambda _: pool.pop(5, "ns"), range(200)))
+    assert len({eid for eids in taken for eid in eids}) == 1000
+    assert pool.pop(1, "ns") is None
+
+
+def test_id_pool_take_draws_unused_ids(coll):
+    pool = IDPool(block_size=50)
+    taken = pool.take(5, coll=coll) + pool.take(5, coll=coll)
+    assert len(set(taken)) == 10
+    decoded = [decode_id(eid) for eid in taken]
+    assert coll.count_documents({A: OID_VAEM_ID, V: {"$in": decoded}}) == 0
+    assert pool.shortfall(40, coll.full_name) == 0
+
+
+def test_generate_ids_unique(coll):
+    assert len(set(generate_ids_unique(20, coll=coll))) == 20
@@ -0,0 +1,118 @@
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+
+from maggtomic import (
+    A,
+    E,
+    OID_QUDT_VALUE,
+    OID_VAEM_ID,
+    _claim_interned_ids,
+    _interned_id,
+    assert_,
+    current,
+    literal_oid,
+    retract,
+    transact,
+    transact_bulk,
+)
+from maggtomic.query import query
+from maggtomic.util import decode_id, encode_id
+
+PREFIXES = {"ex": "http://example.org/"}
+
+MODIFIED = datetime(2021, 6, 1, 12, tzinfo=timezone(timedelta(hours=2)))
+
+# MODIFIED as read back from MongoDB, i.e. naive UTC.
+STORED = datetime(2021, 6, 1, 10)
+
+
+def _transact(coll, statements, is_assert=True):
+    op = assert_ if is_assert else retract
+    transact(
+        [
+            op(s, use_prefixes=PREFIXES, coll=coll, intern_literals=True)
+            for s in statements
+        ],
+        coll=coll,
+    )
+
+
+def _modified(coll):
+    results = query(
+        {
+            "prefixes": PREFIXES,
+            "where": [["?x", "ex:modified", "?sv"], ["?sv", "qudt:value", "?v"]],
+        },
+        coll_hof=current(coll),
+    )
+    return sorted((r["?x"], r["?v"]) for r in results)
+
+
+def _structure_count(coll, value):
+    oid = literal_oid(value)
+    return (
+        coll.count_documents({E: oid, A: OID_VAEM_ID}),
+        coll.count_documents({E: oid, A: OID_QUDT_VALUE}),
+    )
+
+
+def test_literal_oid_is_per_value_type_and_shard():
+    assert literal_oid("x") == literal_oid("x")
+    assert len({literal_oid(1), literal_oid(1.0), literal_oid(True)}) == 3
+    assert literal_oid("x", shard="a") != literal_oid("x")
+
+
+def test_interned_id_candidates_are_local_ids():
+    oid = literal_oid("x")
+    assert _interned_id(oid) == _interned_id(literal_oid("x"))
+    assert _interned_id(oid) != _interned_id(oid, attempt=1)
+    assert 0 <= _interned_id(oid) < 2**40
+    assert decode_id(encode_id(_interned_id(oid))) == _interned_id(oid)
+
+
+def test_claim_interned_ids_skips_taken_and_claimed_ids():
+    a, b, c = ObjectId(), ObjectId(), ObjectId()
+    ids = {a: 1}
+    new = _claim_interned_ids([b, c], {1: b, 2: c}, {2}, ids)
+    assert new == [b, c]
+    assert _claim_interned_ids(new, {3: b, 4: c}, set(), ids) == []
+    assert ids == {a: 1, b: 3, c: 4}
+
+
+def test_interned_ids_are_unique(coll):
+    clash = _interned_id(literal_oid(MODIFIED))
+    transact([[(ObjectId(), OID_VAEM_ID, clash, True)]], coll=coll)
+    _transact(coll, [("ex:e1", "ex:modified", MODIFIED)])
+    _transact(coll, [("ex:e2", "ex:modified", MODIFIED)])
+    ids = coll.distinct("v", {E: literal_oid(MODIFIED), A: OID_VAEM_ID})
+    assert ids == [_interned_id(literal_oid(MODIFIED), attempt=1)]
+    assert coll.count_documents({A: OID_VAEM_ID, "v": clash}) == 1
+
+
+def test_interned_values_are_structured_once_per_transaction(coll):
+    _transact(coll, [(f"ex:e{n}", "ex:modified", MODIFIED) for n in range(20)])
+    assert _structure_count(coll, MODIFIED) == (1, 1)
+    assert len(_modified(coll)) == 20
+
+
+def test_interned_values_are_structured_once_across_transactions(coll):
+    _transact(coll, [("ex:e1", "ex:modified", MODIFIED)])
+    _transact(coll, [("ex:e2", "ex:modified", MODIFIED)])
+    transact_bulk(
+        [("ex:e3", "ex:modified", MODIFIED)],
+        use_prefixes=PREFIXES,
+        coll=coll,
+        intern_literals=True,
+    )
+    assert _structure_count(coll, MODIFIED) == (1, 1)
+    assert _modified(coll) == [(f"ex:e{n}", STORED) for n in (1, 2, 3)]
+
+
+def test_retracting_an_interned_value_retracts_only_its_link(coll):
+    _transact(
+        coll, [("ex:e1", "ex:modified", MODIFIED), ("ex:e2", "ex:modified", MODIFIED)]
+    )
+    _transact(coll, [("ex:e1", "ex:modified", MODIFIED)], is_assert=False)
+    assert _modified(coll) == [("ex:e2", STORED)]
+    assert coll.count_documents({E: literal_oid(MODIFIED), "o": False}) == 0
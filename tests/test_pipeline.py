@@ -0,0 +1,90 @@
+import pytest
+from bson import ObjectId
+from pymongo import MongoClient
+
+from maggtomic import INDEX_NAMES, DatomFilter, assert_, current, transact
+from maggtomic.query import compile_pipeline, query
+
+PREFIXES = {"ex": "http://example.org/"}
+
+
+def _transact(coll, statements):
+    transact(
+        [assert_(s, use_prefixes=PREFIXES, coll=coll) for s in statements], coll=coll
+    )
+
+
+def test_compile_pipeline_correlates_shared_variables():
+    source = MongoClient(connect=False)["maggtomic_test"]["test.current"]
+    p, q = ObjectId(), ObjectId()
+    components = [[["?x", p, "?y"], ["?y", q, "?z"]]]
+    pipeline, fields = compile_pipeline(components, (DatomFilter(source, {}), None))
+    assert fields == {"?x": "b0", "?y": "b1", "?z": "b2"}
+    assert pipeline[0] == {"$match": {"a": p}}
+    assert pipeline[1] == {"$project": {"_id": 0, "b0": "$e", "b1": "$v"}}
+    lookup = pipeline[2]["$lookup"]
+    assert lookup["from"] == "test.current"
+    assert lookup["let"] == {"b1": "$b1"}
+    assert lookup["pipeline"][0]["$match"] == {
+        "a": q,
+        "$expr": {"$and": [{"$eq": ["$e", "$$b1"]}]},
+    }
+    assert pipeline[-1]["$project"] == {"_id": 0, "b0": 1, "b1": 1, "b2": "$_datom.v"}
+
+
+def test_compile_pipeline_resolves_retractions_of_history():
+    source = MongoClient(connect=False)["maggtomic_test"]["test"]
+    docs_for = DatomFilter(
+        source,
+        INDEX_NAMES,
+        basis={"t": {"$lte": ObjectId()}},
+        resolve_retractions=True,
+    )
+    pipeline, _ = compile_pipeline([[["?x", ObjectId(), "?y"]]], (docs_for, None))
+    assert [list(stage)[0] for stage in pipeline] == [
+        "$match",
+        "$sort",
+        "$group",
+        "$match",
+        "$project",
+        "$project",
+    ]
+
+
+@pytest.mark.parametrize("engine", ["python", "pipeline"])
+def test_ground_conditions_test_for_existence(coll, engine):
+    _transact(coll, [("ex:a", "ex:knows", "ex:b"), ("ex:b", "ex:knows", "ex:c")])
+    where = [["?x", "ex:knows", "?y"]]
+    spec = {"prefixes": PREFIXES, "select": ["?x"]}
+    hof = current(coll)
+    found = query(
+        dict(spec, where=where + [["ex:a", "ex:knows", "ex:b"]]),
+        coll_hof=hof,
+        engine=engine,
+    )
+    assert sorted(r["?x"] for r in found) == ["ex:a", "ex:b"]
+    missing = dict(spec, where=where + [["ex:b", "ex:knows", "ex:a"]])
+    assert query(missing, coll_hof=hof, engine=engine) == []
+
+
+def test_engines_agree(coll):
+    _transact(
+        coll,
+        [
+            ("ex:a", "ex:knows", "ex:b"),
+            ("ex:b", "ex:knows", "ex:c"),
+            ("ex:c", "ex:knows", "ex:a"),
+            ("ex:a", "ex:likes", "ex:c"),
+        ],
+    )
+    spec = {
+        "prefixes": PREFIXES,
+        "where": [
+            ["?x", "ex:knows", "?y"],
+            ["?y", "ex:knows", "?z"],
+            ["?x", "ex:likes", "?z"],
+        ],
+    }
+    python = query(spec, coll_hof=current(coll))
+    assert python == [{"?x": "ex:a", "?y": "ex:b", "?z": "ex:c"}]
+    assert query(spec, coll_hof=current(coll), engine="pipeline") == python
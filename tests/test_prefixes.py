@@ -0,0 +1,70 @@
+import pytest
+
+from maggtomic import (
+    PREFIXES,
+    PrefixRegistry,
+    _prefix_registries,
+    load_prefixes,
+    prefix_expand,
+    prefix_registry,
+    prefixes_collection,
+    register_prefixes,
+    save_prefixes,
+)
+
+
+@pytest.fixture
+def restore_prefixes():
+    saved = dict(PREFIXES)
+    yield
+    PREFIXES.clear()
+    PREFIXES.update(saved)
+    _prefix_registries.clear()
+
+
+def test_compact_uses_the_longest_namespace():
+    registry = PrefixRegistry(
+        {"ex": "http://example.org/", "exv": "http://example.org/vocab#"}
+    )
+    assert registry.compact("http://example.org/vocab#term") == "exv:term"
+    assert registry.compact("http://example.org/thing") == "ex:thing"
+    assert registry.compact("http://other.org/thing") == "http://other.org/thing"
+    assert registry.compact("not a uri") == "not a uri"
+    assert registry.compact(42) == 42
+
+
+def test_first_prefix_of_a_namespace_wins():
+    registry = PrefixRegistry({"a": "http://example.org/", "b": "http://example.org/"})
+    assert registry.compact("http://example.org/x") == "a:x"
+
+
+def test_expand():
+    registry = PrefixRegistry({"ex": "http://example.org/"})
+    assert registry.expand("ex:thing") == "http://example.org/thing"
+    assert registry.expand("http://example.org/thing") == "http://example.org/thing"
+    assert registry.expand("unknown:thing") == "unknown:thing"
+    assert registry.expand(1) == 1
+
+
+def test_prefix_registry_is_compiled_once_per_use_prefixes():
+    use_prefixes = {"ex": "http://example.org/"}
+    assert prefix_registry(use_prefixes) is prefix_registry(dict(use_prefixes))
+    assert prefix_expand(["ex:a", "rdf:type"], use_prefixes) == [
+        "http://example.org/a",
+        "http://www.w3.org/1999/02/22-rdf-syntax-ns#type",
+    ]
+
+
+def test_register_prefixes_refreshes_registries(restore_prefixes):
+    assert prefix_expand(["reg:a"]) == ["reg:a"]
+    register_prefixes({"reg": "http://example.org/registered/"})
+    assert prefix_expand(["reg:a"]) == ["http://example.org/registered/a"]
+
+
+def test_save_and_load_prefixes(coll, restore_prefixes):
+    save_prefixes({"saved": "http://example.org/saved/"}, coll=coll)
+    assert prefixes_collection(coll).count_documents({}) == 1
+    del PREFIXES["saved"]
+    _prefix_registries.clear()
+    assert load_prefixes(coll=coll) == {"saved": "http://example.org/saved/"}
+    assert prefix_expand(["saved:a"]) == ["http://example.org/saved/a"]
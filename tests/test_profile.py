@@ -0,0 +1,103 @@
+import threading
+from types import SimpleNamespace
+
+from maggtomic import assert_, current, transact
+from maggtomic.profile import (
+    Profile,
+    active,
+    command_counter,
+    explained,
+    phase,
+    profiling,
+    propagating,
+)
+from maggtomic.query import query
+
+PREFIXES = {"ex": "http://example.org/"}
+
+
+def test_profiling_activates_a_profile_for_a_block():
+    outer, inner = Profile(), Profile()
+    with profiling(outer):
+        with profiling(inner):
+            assert active() is inner
+        assert active() is outer
+        with profiling(None):
+            assert active() is outer
+    assert active() is None
+
+
+def test_phases_add_up_only_while_profiling():
+    with phase("compile"):
+        pass
+    profile = Profile()
+    with profiling(profile):
+        for _ in range(2):
+            with phase("compile"):
+                pass
+    assert set(profile.phases) == {"compile"}
+    assert profile.phases["compile"] >= 0
+
+
+def test_propagating_runs_calls_with_the_callers_profile():
+    profile, seen = Profile(), []
+    with profiling(profile):
+        call = propagating(lambda: seen.append(active()))
+    thread = threading.Thread(target=call)
+    thread.start()
+    thread.join()
+    assert seen == [profile]
+    assert propagating(active) is active
+
+
+def test_command_counter_counts_into_the_active_profile():
+    event = SimpleNamespace(command_name="find")
+    command_counter.started(event)
+    profile = Profile()
+    with profiling(profile):
+        command_counter.started(event)
+        command_counter.started(SimpleNamespace(command_name="insert"))
+    assert profile.commands == {"find": 1, "insert": 1}
+    assert profile.round_trips == 2
+
+
+def test_explained_finds_the_winning_index():
+    explanation = {
+        "queryPlanner": {
+            "winningPlan": {"stage": "FETCH", "inputStage": {"indexName": "AVE"}}
+        },
+        "executionStats": {"totalDocsExamined": 3, "totalKeysExamined": 4},
+    }
+    assert explained(explanation) == {
+        "index": "AVE",
+        "docs_examined": 3,
+        "keys_examined": 4,
+    }
+    assert explained({"queryPlanner": {"winningPlan": {"stage": "COLLSCAN"}}}) == {
+        "index": None,
+        "docs_examined": None,
+        "keys_examined": None,
+    }
+
+
+def test_profiled_transaction_and_query(coll):
+    statements = [("ex:a", "ex:knows", "ex:b"), ("ex:b", "ex:knows", "ex:c")]
+    profile = Profile()
+    transact(
+        [assert_(s, use_prefixes=PREFIXES, coll=coll) for s in statements],
+        coll=coll,
+        profile=profile,
+    )
+    assert {"lookup", "insert", "current"} <= set(profile.phases)
+    assert profile.round_trips > 0
+
+    profile = Profile()
+    spec = {
+        "prefixes": PREFIXES,
+        "where": [["?x", "ex:knows", "?y"], ["?y", "ex:knows", "?z"]],
+    }
+    assert len(query(spec, coll_hof=current(coll), profile=profile)) == 1
+    assert {"compile", "fetch", "join", "refs", "format"} <= set(profile.phases)
+    assert [c["returned"] for c in profile.conditions] == [2, 1]
+    assert profile.conditions[-1]["bindings"] == 1
+    assert profile.as_dict()["round_trips"] == profile.round_trips
@@ -0,0 +1,42 @@
+from maggtomic import assert_, current, transact
+from maggtomic.pull import pull, pull_many
+
+PREFIXES = {"ex": "http://example.org/"}
+
+
+def _transact(coll, statements):
+    transact(
+        [assert_(s, use_prefixes=PREFIXES, coll=coll) for s in statements], coll=coll
+    )
+
+
+def test_pull_nests_entities_as_per_pattern(coll):
+    _transact(
+        coll,
+        [
+            ("ex:a", "ex:name", "Alice"),
+            ("ex:a", "ex:knows", "ex:b"),
+            ("ex:b", "ex:name", "Bob"),
+            ("ex:b", "ex:knows", "ex:c"),
+        ],
+    )
+    pulled = pull(
+        "ex:a",
+        ["ex:name", {"ex:knows": ["ex:name", "ex:knows"]}],
+        coll_hof=current(coll),
+        use_prefixes=PREFIXES,
+    )
+    assert pulled == {
+        "@id": "ex:a",
+        "ex:name": ["Alice"],
+        "ex:knows": [{"@id": "ex:b", "ex:name": ["Bob"], "ex:knows": ["ex:c"]}],
+    }
+
+
+def test_pull_wildcard_and_missing_entities(coll):
+    _transact(coll, [("ex:a", "ex:name", "Alice"), ("ex:a", "ex:knows", "ex:b")])
+    a, nobody = pull_many(
+        ["ex:a", "ex:nobody"], ["*"], coll_hof=current(coll), use_prefixes=PREFIXES
+    )
+    assert a == {"@id": "ex:a", "ex:name": ["Alice"], "ex:knows": ["ex:b"]}
+    assert nobody is None
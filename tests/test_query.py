@@ -0,0 +1,200 @@
+import pytest
+
+from maggtomic import assert_, current, transact
+from maggtomic.query import (
+    Bindings,
+    _plan_cache,
+    _join_all,
+    _plan_components,
+    _stream_join,
+    bound_values,
+    compile_graph_pattern,
+    filter_for,
+    merge_binding_collections,
+    plan_conditions,
+    prepare,
+    query,
+    query_iter,
+)
+
+PREFIXES = {"ex": "http://example.org/"}
+
+
+def _transact(coll, statements):
+    transact(
+        [assert_(s, use_prefixes=PREFIXES, coll=coll) for s in statements], coll=coll
+    )
+
+
+def test_merge_binding_collections_joins_on_shared_variables():
+    left = [{"?a": 1, "?b": 2}, {"?a": 1, "?b": 3}, {"?a": 4, "?b": 5}]
+    right = [{"?b": 2, "?c": 6}, {"?b": 5, "?c": 7}, {"?b": 8, "?c": 9}]
+    merged = merge_binding_collections(left, right)
+    assert sorted(tuple(sorted(b.items())) for b in merged) == [
+        (("?a", 1), ("?b", 2), ("?c", 6)),
+        (("?a", 4), ("?b", 5), ("?c", 7)),
+    ]
+
+
+def test_merge_binding_collections_crosses_independent_bindings():
+    merged = merge_binding_collections([{"?a": 1}, {"?a": 2}], [{"?b": 3}, {"?b": 4}])
+    assert len(merged) == 4
+    assert {(b["?a"], b["?b"]) for b in merged} == {(1, 3), (1, 4), (2, 3), (2, 4)}
+    assert merge_binding_collections([], [{"?b": 3}]) == []
+
+
+def test_join_all_defers_cross_products():
+    a = Bindings(("?a",), [(1,), (2,)])
+    ab = Bindings(("?a", "?b"), [(1, 10), (3, 30)])
+    c = Bindings(("?c",), [(100,), (200,)])
+    joined = _join_all([a, c, ab])
+    assert set(joined.variables) == {"?a", "?b", "?c"}
+    assert sorted(dict(zip(joined.variables, row))["?c"] for row in joined.rows) == [
+        100,
+        200,
+    ]
+    assert all(dict(zip(joined.variables, row))["?a"] == 1 for row in joined.rows)
+    assert not _join_all([a, Bindings(("?b",), [])])
+
+
+def test_query_joins_conditions(coll):
+    _transact(
+        coll,
+        [
+            ("ex:alice", "ex:knows", "ex:bob"),
+            ("ex:bob", "ex:knows", "ex:carol"),
+            ("ex:carol", "ex:knows", "ex:dave"),
+        ],
+    )
+    results = query(
+        {
+            "prefixes": PREFIXES,
+            "select": ["?x", "?z"],
+            "where": [["?x", "ex:knows", "?y"], ["?y", "ex:knows", "?z"]],
+        },
+        coll_hof=current(coll),
+    )
+    assert sorted((r["?x"], r["?z"]) for r in results) == [
+        ("ex:alice", "ex:carol"),
+        ("ex:bob", "ex:dave"),
+    ]
+
+
+def test_filter_for_pushes_down_bound_values():
+    condition = ["?x", "http://example.org/p", {"?v": {"$gt": 1}}]
+    assert filter_for(condition) == {"a": "http://example.org/p", "v": {"$gt": 1}}
+    assert filter_for(condition, bound={"?x": [1, 2], "?v": [3]}) == {
+        "e": {"$in": [1, 2]},
+        "a": "http://example.org/p",
+        "v": {"$gt": 1, "$in": [3]},
+    }
+
+
+def test_plan_components_orders_by_estimate_within_components():
+    c1 = ["?x", "http://example.org/p", "?y"]
+    c2 = ["?y", "http://example.org/q", "?z"]
+    c3 = ["?w", "http://example.org/r", "?v"]
+    components = _plan_components([c1, c2, c3], [100, 1, 10])
+    assert components == [[c2, c1], [c3]]
+
+
+def test_plan_components_starts_from_bound_variables():
+    c1 = ["?x", "http://example.org/p", "?y"]
+    c2 = ["?w", "http://example.org/r", "?v"]
+    components = _plan_components([c1, c2], [1, 100], bound={"?w"})
+    assert components == [[c2], [c1]]
+
+
+def test_bound_values_omits_variables_with_too_many_values(monkeypatch):
+    monkeypatch.setattr("maggtomic.query.MAX_PUSHDOWN_VALUES", 2)
+    bindings = Bindings(("?a", "?b"), [(1, 1), (2, 1), (3, 1)])
+    assert bound_values(bindings, ["?a", "?b", "?c"]) == {"?b": [1]}
+
+
+def test_plan_conditions_with_stats(coll):
+    _transact(
+        coll,
+        [("ex:a", "ex:common", f"ex:v{n}") for n in range(5)]
+        + [("ex:a", "ex:rare", "ex:b")],
+    )
+    where = [["?x", "ex:common", "?y"], ["?x", "ex:rare", "?z"]]
+    results = query({"prefixes": PREFIXES, "where": where}, coll_hof=current(coll))
+    assert len(results) == 5
+    conditions = compile_graph_pattern(
+        where, use_prefixes=PREFIXES, coll_hof=current(coll)
+    )
+    [component] = plan_conditions(conditions, current(coll))
+    assert component == [conditions[1], conditions[0]]
+
+
+def test_unknown_constants_are_not_created(coll):
+    _transact(coll, [("ex:a", "ex:knows", "ex:b")])
+    n_datoms = coll.count_documents({})
+    where = [["?x", "ex:knows", "ex:nobody"]]
+    assert (
+        compile_graph_pattern(where, use_prefixes=PREFIXES, coll_hof=current(coll))
+        is None
+    )
+    assert query({"prefixes": PREFIXES, "where": where}, coll_hof=current(coll)) == []
+    assert coll.count_documents({}) == n_datoms
+
+
+def test_query_iter_yields_the_results_of_query(coll):
+    _transact(coll, [("ex:a", "ex:knows", f"ex:p{n}") for n in range(7)])
+    spec = {"prefixes": PREFIXES, "where": [["?x", "ex:knows", "?y"]]}
+    results = query_iter(spec, coll_hof=current(coll), batch_size=3)
+    first = next(results)
+    assert first["?x"] == "ex:a"
+    rest = list(results)
+    assert len(rest) == 6
+    assert sorted(r["?y"] for r in [first] + rest) == sorted(
+        r["?y"] for r in query(spec, coll_hof=current(coll))
+    )
+
+
+def test_params_bind_args_and_reuse_the_plan(coll):
+    _transact(
+        coll,
+        [
+            ("ex:a", "ex:knows", "ex:b"),
+            ("ex:b", "ex:knows", "ex:c"),
+            ("ex:c", "ex:knows", "ex:a"),
+        ],
+    )
+    spec = {
+        "prefixes": PREFIXES,
+        "select": ["?y"],
+        "where": [["?x", "ex:knows", "?y"]],
+        "params": ["?x"],
+    }
+    run = prepare(spec)
+    assert run("ex:a", coll_hof=current(coll)) == [{"?y": "ex:b"}]
+    n_plans = len(_plan_cache)
+    assert sorted(
+        r["?y"] for r in run(["ex:b", "ex:c", "ex:nobody"], coll_hof=current(coll))
+    ) == ["ex:a", "ex:c"]
+    assert run("ex:nobody", coll_hof=current(coll)) == []
+    assert len(_plan_cache) == n_plans
+
+
+def test_args_must_match_params(coll):
+    spec = {"where": [["?x", "?a", "?y"]], "params": ["?x", "?y"], "args": [1]}
+    with pytest.raises(ValueError):
+        query(spec, coll_hof=current(coll))
+
+
+def test_bindings_round_trip_dicts():
+    dicts = [{"?a": 1, "?b": "x"}, {"?a": 2, "?b": "y"}]
+    bindings = Bindings.from_dicts(dicts)
+    assert bindings.variables == ("?a", "?b")
+    assert bindings.rows == [(1, "x"), (2, "y")]
+    assert bindings.dicts() == dicts
+    assert len(Bindings.from_dicts([])) == 0
+
+
+def test_stream_join_appends_the_stream_variables_not_in_build():
+    build = Bindings(("?a", "?b"), [(1, 2), (1, 3)])
+    variables, join = _stream_join(build, ("?b", "?c"))
+    assert variables == ("?a", "?b", "?c")
+    assert join((2, 4)) == [(1, 2, 4)]
+    assert join((5, 6)) == []
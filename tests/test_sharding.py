@@ -0,0 +1,67 @@
+import pytest
+
+from maggtomic import (
+    CURRENT_INDEX_NAMES,
+    SHARDED_CURRENT_INDEX_NAMES,
+    assert_,
+    current,
+    current_collection,
+    transact,
+)
+from maggtomic.query import query
+
+PREFIXES = {"ex": "http://example.org/"}
+
+KNOWS = {"prefixes": PREFIXES, "where": [["?x", "ex:knows", "?y"]]}
+
+
+def _transact(coll, statements, shard=None):
+    transact(
+        [assert_(s, use_prefixes=PREFIXES, coll=coll, shard=shard) for s in statements],
+        coll=coll,
+        shard=shard,
+    )
+
+
+def _known(coll_hof):
+    return sorted((r["?x"], r["?y"]) for r in query(KNOWS, coll_hof=coll_hof))
+
+
+def test_current_state_of_a_shard_includes_shared_datoms(sharded_coll):
+    _transact(sharded_coll, [("ex:a", "ex:knows", "ex:b")], shard="s1")
+    _transact(sharded_coll, [("ex:c", "ex:knows", "ex:d")], shard="s2")
+    _transact(sharded_coll, [("ex:e", "ex:knows", "ex:f")])
+    assert _known(current(sharded_coll, shard="s1")) == [
+        ("ex:a", "ex:b"),
+        ("ex:e", "ex:f"),
+    ]
+    assert _known(current(sharded_coll)) == [
+        ("ex:a", "ex:b"),
+        ("ex:c", "ex:d"),
+        ("ex:e", "ex:f"),
+    ]
+
+
+def test_current_state_is_indexed_within_and_across_shards(sharded_coll):
+    existing = set(current_collection(sharded_coll).index_information())
+    assert set(SHARDED_CURRENT_INDEX_NAMES.values()) <= existing
+    assert set(CURRENT_INDEX_NAMES.values()) <= existing
+    for shard, index_names in [
+        ("s1", SHARDED_CURRENT_INDEX_NAMES),
+        (None, CURRENT_INDEX_NAMES),
+    ]:
+        datom_filter, _ = current(sharded_coll, shard=shard)
+        assert datom_filter._cursor_options("AVE")["hint"] == index_names["AVE"]
+
+
+def test_the_same_datom_may_be_current_in_many_shards(sharded_coll):
+    for shard in ("s1", "s2"):
+        _transact(sharded_coll, [("ex:a", "ex:knows", "ex:b")], shard=shard)
+    assert _known(current(sharded_coll)) == [("ex:a", "ex:b")] * 2
+
+
+def test_shards_need_a_sharded_collection(coll):
+    with pytest.raises(ValueError):
+        current(coll, shard="s1")
+    with pytest.raises(ValueError):
+        _transact(coll, [("ex:a", "ex:knows", "ex:b")], shard="s1")
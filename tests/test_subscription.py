@@ -0,0 +1,66 @@
+from maggtomic import assert_, retract, transact
+from maggtomic.subscription import subscribe
+
+PREFIXES = {"ex": "http://example.org/"}
+
+FRIENDS_OF_FRIENDS = {
+    "prefixes": PREFIXES,
+    "select": ["?x", "?z"],
+    "where": [["?x", "ex:knows", "?y"], ["?y", "ex:knows", "?z"]],
+}
+
+
+def _transact(coll, statements, is_assert=True):
+    op = assert_ if is_assert else retract
+    transact([op(s, use_prefixes=PREFIXES, coll=coll) for s in statements], coll=coll)
+
+
+def test_poll_reports_added_and_removed_rows(coll):
+    _transact(coll, [("ex:a", "ex:knows", "ex:b")])
+    subscription = subscribe(FRIENDS_OF_FRIENDS, coll=coll)
+    assert subscription.results() == []
+    assert subscription.poll() == ([], [])
+
+    _transact(coll, [("ex:b", "ex:knows", "ex:c")])
+    assert subscription.poll() == ([{"?x": "ex:a", "?z": "ex:c"}], [])
+    assert subscription.results() == [{"?x": "ex:a", "?z": "ex:c"}]
+
+    _transact(coll, [("ex:a", "ex:knows", "ex:b")], is_assert=False)
+    assert subscription.poll() == ([], [{"?x": "ex:a", "?z": "ex:c"}])
+    assert subscription.results() == []
+
+
+def test_subscription_to_unknown_constants_loads_when_they_appear(coll):
+    _transact(coll, [("ex:a", "ex:knows", "ex:b")])
+    spec = {
+        "prefixes": PREFIXES,
+        "select": ["?x"],
+        "where": [["?x", "ex:likes", "ex:b"]],
+    }
+    subscription = subscribe(spec, coll=coll)
+    assert subscription.results() == []
+    _transact(coll, [("ex:a", "ex:likes", "ex:b")])
+    assert subscription.poll() == ([{"?x": "ex:a"}], [])
+
+
+def test_subscription_with_params(coll):
+    _transact(coll, [("ex:a", "ex:knows", "ex:b"), ("ex:c", "ex:knows", "ex:b")])
+    spec = dict(FRIENDS_OF_FRIENDS, params=["?x"], args=["ex:a"])
+    subscription = subscribe(spec, coll=coll)
+    _transact(coll, [("ex:b", "ex:knows", "ex:d")])
+    assert subscription.poll() == ([{"?x": "ex:a", "?z": "ex:d"}], [])
+
+
+def test_subscription_to_a_ground_condition(coll):
+    _transact(coll, [("ex:a", "ex:knows", "ex:b"), ("ex:c", "ex:likes", "ex:b")])
+    spec = {
+        "prefixes": PREFIXES,
+        "select": ["?x", "?y"],
+        "where": [["ex:a", "ex:likes", "ex:b"], ["?x", "ex:knows", "?y"]],
+    }
+    subscription = subscribe(spec, coll=coll)
+    assert subscription.results() == []
+    _transact(coll, [("ex:a", "ex:likes", "ex:b")])
+    assert subscription.poll() == ([{"?x": "ex:a", "?y": "ex:b"}], [])
+    _transact(coll, [("ex:a", "ex:likes", "ex:b")], is_assert=False)
+    assert subscription.poll() == ([], [{"?x": "ex:a", "?y": "ex:b"}])
@@ -0,0 +1,80 @@
+import pytest
+
+from maggtomic import assert_, current, transact
+from maggtomic.table import _encoded_columns, query_to_table
+
+PREFIXES = {"ex": "http://example.org/"}
+
+AGES = {
+    "prefixes": PREFIXES,
+    "select": ["?x", "?age"],
+    "where": [["?x", "ex:age", "?sv"], ["?sv", "qudt:value", "?age"]],
+}
+
+
+@pytest.fixture
+def ages(coll):
+    statements = [("ex:a", "ex:age", 30), ("ex:b", "ex:age", 40)]
+    transact(
+        [assert_(s, use_prefixes=PREFIXES, coll=coll) for s in statements], coll=coll
+    )
+    return current(coll)
+
+
+def test_encoded_columns_keep_values_of_different_types_distinct():
+    values, codes = _encoded_columns(2, [(1, "x"), (1.0, "x"), (True, [1]), (1, [1])])
+    assert values[0] == [1, 1.0, True]
+    assert list(codes[0]) == [0, 1, 2, 0]
+    assert values[1] == ["x", [1], [1]]
+    assert list(codes[1]) == [0, 0, 1, 2]
+
+
+def test_query_to_numpy(ages):
+    np = pytest.importorskip("numpy")
+    columns = query_to_table(AGES, coll_hof=ages, format="numpy")
+    order = np.argsort(columns["?x"])
+    assert list(columns["?x"][order]) == ["ex:a", "ex:b"]
+    assert columns["?age"].dtype.kind == "i"
+    assert list(columns["?age"][order]) == [30, 40]
+
+
+def test_query_to_pandas(ages):
+    pytest.importorskip("pandas")
+    df = query_to_table(AGES, coll_hof=ages).sort_values("?x")
+    assert list(df.columns) == ["?x", "?age"]
+    assert df["?age"].tolist() == [30, 40]
+
+
+def test_query_to_arrow(ages):
+    pytest.importorskip("pyarrow")
+    table = query_to_table(AGES, coll_hof=ages, format="arrow")
+    assert sorted(zip(*table.to_pydict().values())) == [("ex:a", 30), ("ex:b", 40)]
+
+
+@pytest.mark.parametrize(
+    "where",
+    [
+        [
+            ["?x", "ex:age", "?sv"],
+            ["?sv", "qudt:value", "?age"],
+            ["?x", "ex:age", "ex:b"],
+        ],
+        [["?x", "ex:unknown", "?sv"], ["?sv", "qudt:value", "?age"]],
+    ],
+)
+def test_empty_results_have_the_selected_columns(ages, where):
+    pytest.importorskip("pandas")
+    pytest.importorskip("pyarrow")
+    spec = dict(AGES, where=where)
+    df = query_to_table(spec, coll_hof=ages)
+    assert list(df.columns) == ["?x", "?age"] and len(df) == 0
+    table = query_to_table(spec, coll_hof=ages, format="arrow")
+    assert table.column_names == ["?x", "?age"] and table.num_rows == 0
+    spec.pop("select")
+    columns = query_to_table(spec, coll_hof=ages, format="numpy")
+    assert list(columns) == ["?x", "?sv", "?age"]
+
+
+def test_unknown_format(ages):
+    with pytest.raises(ValueError):
+        query_to_table(AGES, coll_hof=ages, format="csv")
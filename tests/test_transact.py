@@ -0,0 +1,109 @@
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+
+from maggtomic import (
+    A,
+    OID_GENERATED_AT_TIME,
+    OID_VAEM_ID,
+    _datom_key,
+    _effective_operations,
+    _net_operations,
+    assert_,
+    current,
+    retract,
+    transact,
+    transact_bulk,
+)
+from maggtomic.query import query
+
+PREFIXES = {"ex": "http://example.org/"}
+
+
+def _values(coll):
+    results = query(
+        {
+            "prefixes": PREFIXES,
+            "where": [["?x", "ex:value", "?sv"], ["?sv", "qudt:value", "?v"]],
+        },
+        coll_hof=current(coll),
+    )
+    return sorted((r["?x"], r["?v"]) for r in results)
+
+
+def test_transact_bulk_transacts_each_chunk(coll):
+    n_transactions = coll.count_documents({A: OID_GENERATED_AT_TIME})
+    statements = ((f"ex:e{n}", "ex:value", n) for n in range(25))
+    transact_bulk(statements, chunk_size=10, use_prefixes=PREFIXES, coll=coll)
+    assert _values(coll) == sorted((f"ex:e{n}", n) for n in range(25))
+    # One transaction per chunk, after one that adds the chunk's new URIs.
+    assert coll.count_documents({A: OID_GENERATED_AT_TIME}) == n_transactions + 6
+    local_ids = coll.distinct("v", {A: OID_VAEM_ID})
+    assert len(local_ids) == coll.count_documents({A: OID_VAEM_ID})
+
+
+def test_transact_bulk_retracts(coll):
+    statements = [("ex:e1", "ex:knows", "ex:e2"), ("ex:e2", "ex:knows", "ex:e3")]
+    transact_bulk(statements, use_prefixes=PREFIXES, coll=coll)
+    transact_bulk(statements[:1], is_assert=False, use_prefixes=PREFIXES, coll=coll)
+    results = query(
+        {"prefixes": PREFIXES, "where": [["?x", "ex:knows", "?y"]]},
+        coll_hof=current(coll),
+    )
+    assert [(r["?x"], r["?y"]) for r in results] == [("ex:e2", "ex:e3")]
+
+
+def test_net_operations_keep_the_last_operation_per_datom():
+    e, a = ObjectId(), ObjectId()
+    operations = [(e, a, 1, True), (e, a, [2], True), (e, a, 1, False)]
+    assert _net_operations(operations) == [(e, a, [2], True), (e, a, 1, False)]
+
+
+def test_effective_operations_drop_no_ops():
+    e, a = ObjectId(), ObjectId()
+    current_keys = {_datom_key(e, a, 1)}
+    operations = [(e, a, 1, True), (e, a, 2, True), (e, a, 1, False), (e, a, 3, False)]
+    assert _effective_operations(operations, current_keys) == [
+        (e, a, 2, True),
+        (e, a, 1, False),
+    ]
+
+
+def test_restating_datoms_transacts_nothing(coll):
+    statement = ("ex:a", "ex:knows", "ex:b")
+    transact([assert_(statement, use_prefixes=PREFIXES, coll=coll)], coll=coll)
+    n_datoms = coll.count_documents({})
+    transact([assert_(statement, use_prefixes=PREFIXES, coll=coll)], coll=coll)
+    assert coll.count_documents({}) == n_datoms
+    unknown = ("ex:b", "ex:knows", "ex:a")
+    transact([retract(unknown, use_prefixes=PREFIXES, coll=coll)], coll=coll)
+    assert coll.count_documents({}) == n_datoms
+    transact([retract(statement, use_prefixes=PREFIXES, coll=coll)], coll=coll)
+    assert coll.count_documents({"o": False}) == 1
+
+
+def test_datom_keys_are_as_values_round_trip_through_bson():
+    e, a = ObjectId(), ObjectId()
+    aware = datetime(2021, 6, 1, 14, 0, 0, 123456, tzinfo=timezone(timedelta(hours=2)))
+    naive = datetime(2021, 6, 1, 12, 0, 0, 123000)
+    assert _datom_key(e, a, aware) == _datom_key(e, a, naive)
+    assert _datom_key(e, a, [aware]) == _datom_key(e, a, [naive])
+
+
+def test_restating_datetimes_transacts_nothing(coll):
+    aware = datetime(2021, 6, 1, 14, 0, 0, 123456, tzinfo=timezone(timedelta(hours=2)))
+    e = ObjectId()
+    transact([[(e, OID_GENERATED_AT_TIME, aware, True)]], coll=coll)
+    n_datoms = coll.count_documents({})
+    transact([[(e, OID_GENERATED_AT_TIME, aware, True)]] * 2, coll=coll)
+    assert coll.count_documents({}) == n_datoms
+    statement = ("ex:a", "ex:modified", aware)
+    ops = [
+        assert_(statement, use_prefixes=PREFIXES, coll=coll, intern_literals=True)
+        for _ in range(3)
+    ]
+    transact(ops[:1], coll=coll)
+    n_datoms = coll.count_documents({})
+    for op in ops[1:]:
+        transact([op], coll=coll)
+    assert coll.count_documents({}) == n_datoms